@@ -1,9 +1,16 @@
 import os
+import re
 import json
+import base64
+import hmac
 import time
-import sqlite3
-import aiohttp
+import uuid
+import datetime
+import signal
+import socket
 import asyncio
+import traceback
+from urllib.parse import urlencode
 from aiohttp import web
 from botbuilder.core import (
     BotFrameworkAdapterSettings,
@@ -11,17 +18,58 @@ from botbuilder.core import (
     ActivityHandler,
 )
 from botbuilder.integration.aiohttp import BotFrameworkHttpAdapter
-from botbuilder.schema import Activity, ActivityTypes
+from botbuilder.schema import Activity, ActivityTypes, ConversationReference
+from botframework.connector.auth import ClaimsIdentity
+import catalog
+import catalog_sync
+import idempotency
+import jobs
+import logstore
+import metrics
+import outbox
+import policy
+import replies
+import reporting
+import tracing
+from db import open_database
+from mcp_client import MCPClient
+from resilience import Unavailable
 
 # ================== CONFIG ==================
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "10"))
+PICKER_MAX_CHOICES = int(os.getenv("PICKER_MAX_CHOICES", "50"))
 APP_ID = os.getenv("MICROSOFT_APP_ID", "")
 APP_PASSWORD = os.getenv("MICROSOFT_APP_PASSWORD", "")
-DB_PATH = "software.db"
+# Resolved once at startup, so every worker uses the same file whatever its working directory
+DB_PATH = os.path.abspath(os.getenv("BOT_DB_PATH", "software.db"))
+DB_URL = os.getenv("BOT_DB_URL", DB_PATH)
+BOT_HOST = os.getenv("BOT_HOST", "localhost")
+BOT_PORT = int(os.getenv("BOT_PORT", "3978"))
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
 MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://localhost:5000")
+# How often an outbox ticket update queued by the MCP server is re-checked until it is flushed
+TICKET_CONFIRM_INTERVAL = float(os.getenv("TICKET_CONFIRM_INTERVAL", "3"))
+# Base of links to the bot's log endpoint in Teams messages and ServiceNow comments
+BOT_PUBLIC_URL = os.getenv("BOT_PUBLIC_URL", f"http://{BOT_HOST}:{BOT_PORT}").rstrip("/")
+# Signs log links so they open without the API token; BOT_API_TOKEN is used when unset
+LOG_LINK_SECRET = os.getenv("LOG_LINK_SECRET", "")
+LOG_FOLLOW_INTERVAL = float(os.getenv("LOG_FOLLOW_INTERVAL", "2"))
+# Teams user ids (from.id or AAD object id) allowed to run "admin stats"
+BOT_ADMIN_USERS = frozenset(u.strip() for u in os.getenv("BOT_ADMIN_USERS", "").split(",") if u.strip())
+# Teams user ids that see everyone's "pending approvals" with Approve buttons; BOT_ADMIN_USERS when unset
+BOT_APPROVER_USERS = frozenset(
+    u.strip() for u in os.getenv("BOT_APPROVER_USERS", "").split(",") if u.strip()
+) or BOT_ADMIN_USERS
 
 # ================== DB ==================
 def get_connection():
-    return sqlite3.connect(DB_PATH)
+    return DB.connect()
+
+def add_column(cur, table, column, decl):
+    """Add a column to an existing table if an older database lacks it"""
+    cols = [r[1] for r in cur.execute(f"PRAGMA table_info({table})").fetchall()]
+    if column not in cols:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
 
 def init_db():
     conn = get_connection()
@@ -33,9 +81,23 @@ def init_db():
             software_name TEXT NOT NULL,
             version TEXT NOT NULL,
             rundeck_job_id TEXT,
-            winget_id TEXT
+            winget_id TEXT,
+            aliases TEXT,
+            tags TEXT,
+            source TEXT
         )
     """)
+    add_column(cur, "software_catalog", "aliases", "TEXT")
+    # Comma-separated labels (e.g. browser, collaboration) that approval rules match on
+    add_column(cur, "software_catalog", "tags", "TEXT")
+    # "winget" for packages added by catalog_sync.py, which may also remove them
+    add_column(cur, "software_catalog", "source", "TEXT")
+    # Every known version of synced packages, and the manifest directories they came from
+    for stmt in catalog_sync.SCHEMA:
+        cur.execute(stmt)
+    # Catalog change counter, bumped by triggers
+    for stmt in catalog.SCHEMA:
+        cur.execute(stmt)
     # Requests table
     cur.execute("""
         CREATE TABLE IF NOT EXISTS user_requests (
@@ -50,7 +112,63 @@ def init_db():
             approved_by TEXT,
             approved_at DATETIME,
             accepted_at DATETIME,
-            finished_at DATETIME
+            finished_at DATETIME,
+            execution_id TEXT,
+            ticket_sys_id TEXT,
+            request_type TEXT DEFAULT 'single',
+            card_reference TEXT
+        )
+    """)
+    add_column(cur, "user_requests", "execution_id", "TEXT")
+    add_column(cur, "user_requests", "ticket_sys_id", "TEXT")
+    add_column(cur, "user_requests", "request_type", "TEXT DEFAULT 'single'")
+    # Conversation reference of the request's status card, activity_id = the card's message id
+    add_column(cur, "user_requests", "card_reference", "TEXT")
+    # Packages of a bundle request
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS request_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_id INTEGER NOT NULL,
+            software_name TEXT NOT NULL,
+            version TEXT NOT NULL,
+            winget_id TEXT NOT NULL,
+            rundeck_job_id TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_request_items_request ON request_items (request_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_requests_execution ON user_requests (execution_id)")
+    # History views use keyset pagination over these
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_requests_user ON user_requests (user_id, requested_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_requests_status ON user_requests (status, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_requests_ticket ON user_requests (ticket_number)")
+    # Durable install job queue
+    cur.execute(jobs.SCHEMA)
+    cur.execute(jobs.INDEX)
+    # Transactional outbox for ServiceNow side effects
+    cur.execute(outbox.SCHEMA)
+    for index in outbox.INDEXES:
+        cur.execute(index)
+    # Install logs, compressed and chunked outside user_requests; move any still inline
+    cur.execute(logstore.SCHEMA)
+    for req_id, logs in cur.execute("SELECT id, logs FROM user_requests WHERE logs IS NOT NULL").fetchall():
+        logstore.store(cur, req_id, logs)
+    cur.execute("UPDATE user_requests SET logs=NULL WHERE logs IS NOT NULL")
+    # Daily reporting rollups, maintained by triggers; filled from existing requests when new
+    for stmt in reporting.SCHEMA:
+        cur.execute(stmt)
+    reporting.backfill(cur)
+    # Trace context of the request that queued the work
+    add_column(cur, "install_jobs", "traceparent", "TEXT")
+    add_column(cur, "outbox", "traceparent", "TEXT")
+    # Seen card submits, so retries and double clicks run once
+    cur.execute(idempotency.SCHEMA)
+    cur.execute(idempotency.INDEX)
+    # Latest conversation reference per user, for proactive messages
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_refs (
+            user_id TEXT PRIMARY KEY,
+            reference TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     """)
     conn.commit()
@@ -61,344 +179,1423 @@ def seed_data():
     cur = conn.cursor()
     cur.execute("SELECT COUNT(*) FROM software_catalog")
     if cur.fetchone()[0] == 0:
+        job_id = os.getenv("RUNDECK_INSTALL_JOB_ID", "your-universal-job-id")
         cur.executemany(
-            "INSERT INTO software_catalog (software_name, version, rundeck_job_id, winget_id) VALUES (?,?,?,?)",
+            "INSERT INTO software_catalog (software_name, version, rundeck_job_id, winget_id, aliases, tags) VALUES (?,?,?,?,?,?)",
             [
-                ("Google Chrome", "117.0", "your-universal-job-id", "Google.Chrome"),
-                ("VS Code", "1.90", "your-universal-job-id", "Microsoft.VisualStudioCode"),
-                ("Slack", "4.35", "your-universal-job-id", "SlackTechnologies.Slack"),
-                ("Firefox", "latest", "your-universal-job-id", "Mozilla.Firefox"),
-                ("Zoom", "latest", "your-universal-job-id", "Zoom.Zoom")
+                ("Google Chrome", "117.0", job_id, "Google.Chrome", "chrome", "browser"),
+                ("VS Code", "1.90", job_id, "Microsoft.VisualStudioCode", "vscode,code,visual studio code", "developer"),
+                ("Slack", "4.35", job_id, "SlackTechnologies.Slack", "", "collaboration"),
+                ("Firefox", "latest", job_id, "Mozilla.Firefox", "mozilla firefox", "browser"),
+                ("Zoom", "latest", job_id, "Zoom.Zoom", "", "collaboration")
             ]
         )
     conn.commit()
     conn.close()
 
 # Database helper functions
-def insert_request(user_id, software, version):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO user_requests (user_id, software_name, version, status) VALUES (?,?,?, 'requested')",
-        (user_id, software, version),
+DB = open_database(DB_URL)
+
+def auto_approver(conn, user_id, rules):
+    """approved_by for the first matching rule the user still has quota for, else None"""
+    for rule in rules:
+        if policy.quota_available(conn, user_id, rule):
+            return policy.approver(rule)
+    return None
+
+def utc_now():
+    """Timestamp in the zone and format of CURRENT_TIMESTAMP and datetime('now'), which reports compare against"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+def approved_at(approved_by):
+    return utc_now() if approved_by else None
+
+def log_inserted(approved_by, rules):
+    metrics.REQUEST_TRANSITIONS.labels("requested").inc()
+    if approved_by:
+        metrics.REQUEST_TRANSITIONS.labels("approved").inc()
+    metrics.POLICY_DECISIONS.labels("approved" if approved_by else "over_quota" if rules else "manual").inc()
+    OUTBOX.notify()
+
+async def insert_request(user_id, software, version, rules=()):
+    """Log a new request and queue its ServiceNow ticket creation in one transaction.
+
+    ``rules`` are the approval rules it matched; the first one within the
+    user's quota approves it on the spot. Returns (request id, approved_by).
+    """
+    def insert(conn):
+        approved_by = auto_approver(conn, user_id, rules)
+        cur = conn.execute(
+            """INSERT INTO user_requests (user_id, software_name, version, status, approved_by, approved_at)
+               VALUES (?,?,?,?,?,?)""",
+            (user_id, software, version, "approved" if approved_by else "requested", approved_by, approved_at(approved_by)),
+        )
+        outbox.add(conn, "create_ticket", cur.lastrowid)
+        return cur.lastrowid, approved_by
+    with metrics.stage_timer("db_insert"):
+        req_id, approved_by = await DB.transaction(insert)
+    log_inserted(approved_by, rules)
+    return req_id, approved_by
+
+async def insert_bundle_request(user_id, entries, rules=()):
+    """Log one bundle request covering several catalog entries, with a single ticket to create"""
+    software = "Bundle: " + ", ".join(e.software_name for e in entries)
+
+    def insert(conn):
+        approved_by = auto_approver(conn, user_id, rules)
+        cur = conn.execute(
+            """INSERT INTO user_requests (user_id, software_name, version, status, request_type, approved_by, approved_at)
+               VALUES (?,?,?,?, 'bundle', ?,?)""",
+            (user_id, software, "bundle", "approved" if approved_by else "requested", approved_by, approved_at(approved_by)),
+        )
+        req_id = cur.lastrowid
+        conn.executemany(
+            "INSERT INTO request_items (request_id, software_name, version, winget_id, rundeck_job_id) VALUES (?,?,?,?,?)",
+            [(req_id, e.software_name, e.version, e.winget_id, e.rundeck_job_id) for e in entries],
+        )
+        outbox.add(conn, "create_ticket", req_id)
+        return req_id, approved_by
+    with metrics.stage_timer("db_insert"):
+        req_id, approved_by = await DB.transaction(insert)
+    log_inserted(approved_by, rules)
+    return req_id, approved_by
+
+async def fetch_request_items(req_id):
+    """Packages of a bundle request; empty for single requests"""
+    return await DB.fetchall(
+        "SELECT software_name, version, winget_id, rundeck_job_id FROM request_items WHERE request_id=? ORDER BY id",
+        (req_id,),
     )
-    req_id = cur.lastrowid
-    conn.commit()
-    conn.close()
-    return req_id
 
-def update_request(req_id, **fields):
-    if not fields:
-        return
-    conn = get_connection()
-    cur = conn.cursor()
+def request_update_sql(req_id, expected_status, fields):
+    """UPDATE statement for a request, guarded by its current status when expected_status is given"""
     cols = ", ".join([f"{k}=?" for k in fields.keys()])
     vals = list(fields.values()) + [req_id]
-    cur.execute(f"UPDATE user_requests SET {cols} WHERE id=?", vals)
-    conn.commit()
-    conn.close()
+    sql = f"UPDATE user_requests SET {cols} WHERE id=?"
+    if expected_status is not None:
+        expected = (expected_status,) if isinstance(expected_status, str) else tuple(expected_status)
+        sql += f" AND status IN ({', '.join('?' * len(expected))})"
+        vals += list(expected)
+    return sql, vals
 
-def fetch_request(req_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, user_id, software_name, version, status, ticket_number FROM user_requests WHERE id=?", (req_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+async def update_request(req_id, expected_status=None, **fields):
+    """Update a request; with expected_status this is a compare-and-set. Returns True if the row changed"""
+    if not fields:
+        return False
+    sql, vals = request_update_sql(req_id, expected_status, fields)
+    changed = await DB.transaction(lambda conn: conn.execute(sql, vals).rowcount > 0)
+    if changed and "status" in fields:
+        metrics.REQUEST_TRANSITIONS.labels(fields["status"]).inc()
+    return changed
+
+async def update_request_and_ticket(req_id, ticket_status, comments, expected_status=None, **fields):
+    """Update a request and queue the matching ServiceNow ticket update in one transaction.
+
+    With expected_status the update is a compare-and-set and nothing is
+    queued if the request moved on; returns True if the row changed.
+    """
+    sql, vals = request_update_sql(req_id, expected_status, fields)
+
+    def update(conn):
+        if conn.execute(sql, vals).rowcount == 0:
+            return False
+        outbox.add(conn, "update_ticket", req_id, status=ticket_status, comments=comments,
+                   update_id=uuid.uuid4().hex)
+        return True
+    if not await DB.transaction(update):
+        return False
+    if "status" in fields:
+        metrics.REQUEST_TRANSITIONS.labels(fields["status"]).inc()
+    OUTBOX.notify()
+    return True
+
+async def fetch_request(req_id):
+    return await DB.fetchone(
+        "SELECT id, user_id, software_name, version, status, ticket_number, ticket_sys_id FROM user_requests WHERE id=?",
+        (req_id,),
+    )
+
+async def accept_request(req_id):
+    """Move an approved request to accepted and queue its install job in one transaction"""
+    def accept(conn):
+        cur = conn.execute(
+            "UPDATE user_requests SET status='accepted', accepted_at=? WHERE id=? AND status='approved'",
+            (utc_now(), req_id),
+        )
+        if cur.rowcount == 0:
+            return None
+        return jobs.enqueue(conn, req_id)
+    job_id = await DB.transaction(accept)
+    if job_id is not None:
+        metrics.REQUEST_TRANSITIONS.labels("accepted").inc()
+    return job_id
+
+async def request_age(req_id):
+    """Seconds since the request was logged"""
+    row = await DB.fetchone(
+        "SELECT (julianday('now') - julianday(requested_at)) * 86400 FROM user_requests WHERE id=?", (req_id,)
+    )
+    return row[0] if row else None
+
+async def save_conversation_ref(user_id, activity):
+    reference = TurnContext.get_conversation_reference(activity)
+    await DB.execute(
+        """INSERT INTO conversation_refs (user_id, reference, updated_at) VALUES (?,?,CURRENT_TIMESTAMP)
+           ON CONFLICT(user_id) DO UPDATE SET reference=excluded.reference, updated_at=excluded.updated_at""",
+        (user_id, json.dumps(reference.serialize())),
+    )
+
+async def save_card_reference(req_id, activity, card_id):
+    """Remember where a request's status card was sent; returns the request's current (status, ticket_number)"""
+    reference = TurnContext.get_conversation_reference(activity)
+    reference.activity_id = card_id
+
+    def save(conn):
+        conn.execute(
+            "UPDATE user_requests SET card_reference=? WHERE id=?", (json.dumps(reference.serialize()), req_id)
+        )
+        row = conn.execute("SELECT status, ticket_number FROM user_requests WHERE id=?", (req_id,)).fetchone()
+        return tuple(row) if row else None
+    return await DB.transaction(save)
+
+async def fetch_request_card(req_id):
+    """(user_id, software, version, status, ticket_number, execution_id, approved_by, card_reference) or None"""
+    return await DB.fetchone(
+        """SELECT user_id, software_name, version, status, ticket_number, execution_id, approved_by, card_reference
+           FROM user_requests WHERE id=?""",
+        (req_id,),
+    )
+
+async def fetch_conversation_ref(user_id):
+    row = await DB.fetchone("SELECT reference FROM conversation_refs WHERE user_id=?", (user_id,))
+    if not row:
+        return None
+    return ConversationReference.deserialize(json.loads(row[0]))
+
+HISTORY_COLUMNS = "id, user_id, software_name, version, status, ticket_number, requested_at"
+
+def encode_cursor(*key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode a pagination cursor; raises ValueError if it is malformed"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or not key:
+        raise ValueError("Invalid cursor")
+    return key
+
+async def list_user_requests(user_id, cursor=None, limit=10):
+    """A user's requests, newest first; returns (rows, next_cursor)"""
+    if cursor:
+        requested_at, last_id = decode_cursor(cursor)
+        rows = await DB.fetchall(
+            f"""SELECT {HISTORY_COLUMNS} FROM user_requests
+                WHERE user_id=? AND (requested_at, id) < (?, ?)
+                ORDER BY requested_at DESC, id DESC LIMIT ?""",
+            (user_id, requested_at, last_id, limit),
+        )
+    else:
+        rows = await DB.fetchall(
+            f"""SELECT {HISTORY_COLUMNS} FROM user_requests
+                WHERE user_id=? ORDER BY requested_at DESC, id DESC LIMIT ?""",
+            (user_id, limit),
+        )
+    next_cursor = encode_cursor(rows[-1][6], rows[-1][0]) if len(rows) == limit else None
+    return rows, next_cursor
+
+async def list_requests_by_status(status, cursor=None, limit=10, user_id=None):
+    """Requests in one status, newest first, optionally one user's; returns (rows, next_cursor)"""
+    last_id = decode_cursor(cursor)[0] if cursor else None
+    where, params = "status=?", [status]
+    if user_id is not None:
+        where += " AND user_id=?"
+        params.append(user_id)
+    if last_id is not None:
+        where += " AND id < ?"
+        params.append(last_id)
+    rows = await DB.fetchall(
+        f"SELECT {HISTORY_COLUMNS} FROM user_requests WHERE {where} ORDER BY id DESC LIMIT ?",
+        (*params, limit),
+    )
+    next_cursor = encode_cursor(rows[-1][0]) if len(rows) == limit else None
+    return rows, next_cursor
+
+# In-memory catalog; the hot paths below never touch disk
+CATALOG = catalog.Catalog(DB)
+# Auto-approval rules, evaluated in memory when a request is logged
+POLICY = policy.ApprovalPolicy()
 
 def get_software_list():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT software_name, version, winget_id FROM software_catalog")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    return [(e.software_name, e.version, e.winget_id) for e in CATALOG.entries]
+
+def fetch_catalog_entry(software):
+    entry = CATALOG.get(software)
+    if entry is None:
+        return None
+    return entry.rundeck_job_id, entry.winget_id
 
 # ================== REAL INTEGRATIONS ==================
-async def create_ticket_real(user_id, software, version):
-    """Create a real ServiceNow ticket via MCP server"""
+# Wrappers re-raise Unavailable (open circuit, full bulkhead) so the outbox and
+# the job queue defer the work instead of counting it as a failed attempt
+MCP = MCPClient(MCP_SERVER_URL)
+
+async def create_ticket_real(user_id, software, version, packages=None, approved_by=None):
+    """Create a real ServiceNow ticket via MCP server; returns (ticket_number, sys_id).
+
+    With ``approved_by`` the ticket is created already approved, with the decision in its comments.
+    """
     try:
-        async with aiohttp.ClientSession() as session:
-            data = {
-                "user_id": user_id,
-                "software": software,
-                "version": version
-            }
-            async with session.post(
-                f"{MCP_SERVER_URL}/api/create_ticket",
-                json=data,
-                timeout=30
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result.get("ticket_number")
-                else:
-                    print(f"MCP server error: {response.status}")
-                    return None
+        data = {
+            "user_id": user_id,
+            "software": software,
+            "version": version
+        }
+        if packages:
+            data["packages"] = packages
+        if approved_by:
+            data["approved_by"] = approved_by
+        status, result = await MCP.post_json("/api/create_ticket", data, upstream="servicenow")
+        if status == 200 and result:
+            return result.get("ticket_number"), result.get("sys_id")
+        else:
+            tracing.log(f"MCP server error: {status}")
+            return None, None
+    except Unavailable:
+        raise
     except Exception as e:
-        print(f"Error creating ticket: {e}")
-        return None
+        tracing.log(f"Error creating ticket: {e}")
+        return None, None
 
-async def update_ticket_real(ticket_number, status, comments):
-    """Update a real ServiceNow ticket via MCP server"""
+async def update_ticket_real(ticket_number, status, comments, sys_id=None, update_id=None):
+    """Update a real ServiceNow ticket via MCP server.
+
+    A write-behind update is only queued by the MCP server; that raises
+    Unavailable so the caller resends the same update_id until it is flushed.
+    """
     try:
-        async with aiohttp.ClientSession() as session:
-            data = {
-                "ticket_number": ticket_number,
-                "status": status,
-                "comments": comments
-            }
-            async with session.post(
-                f"{MCP_SERVER_URL}/api/update_ticket",
-                json=data,
-                timeout=30
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result.get("success", False)
-                else:
-                    print(f"MCP server error: {response.status}")
-                    return False
+        data = {
+            "ticket_number": ticket_number,
+            "sys_id": sys_id,
+            "status": status,
+            "comments": comments,
+            "update_id": update_id
+        }
+        http_status, result = await MCP.post_json("/api/update_ticket", data, upstream="servicenow")
+        if http_status == 202 and result and result.get("queued"):
+            raise Unavailable(f"ServiceNow update for {ticket_number} not flushed yet", TICKET_CONFIRM_INTERVAL)
+        if http_status in (200, 202) and result:
+            return result.get("success", False)
+        else:
+            tracing.log(f"MCP server error: {http_status}")
+            return False
+    except Unavailable:
+        raise
     except Exception as e:
-        print(f"Error updating ticket: {e}")
+        tracing.log(f"Error updating ticket: {e}")
         return False
 
-async def run_rundeck_job_real(job_id, software, winget_id, version):
-    """Execute a real Rundeck job via MCP server with Winget ID"""
+async def run_rundeck_job_real(job_id, software, winget_id, version, request_id=None):
+    """Start a real Rundeck job via MCP server with Winget ID; returns (status, message, execution_id)"""
+    try:
+        data = {
+            "job_id": job_id,
+            "software": software,
+            "winget_id": winget_id,
+            "version": version,
+            "request_id": request_id
+        }
+        status, result = await MCP.post_json("/api/run_job", data, upstream="rundeck")
+        if status == 200 and result:
+            return result.get("status", "failed"), result.get("message", "Unknown error"), result.get("execution_id")
+        else:
+            return "failed", f"MCP server error: {status}", None
+    except Unavailable:
+        raise
+    except Exception as e:
+        return "failed", f"Error running job: {e}", None
+
+async def run_bundle_job_real(job_id, packages, request_id=None):
+    """Start one Rundeck execution installing several packages; returns (status, message, execution_id)"""
+    try:
+        data = {
+            "job_id": job_id,
+            "packages": packages,
+            "request_id": request_id
+        }
+        status, result = await MCP.post_json("/api/run_job", data, upstream="rundeck")
+        if status == 200 and result:
+            return result.get("status", "failed"), result.get("message", "Unknown error"), result.get("execution_id")
+        else:
+            return "failed", f"MCP server error: {status}", None
+    except Unavailable:
+        raise
+    except Exception as e:
+        return "failed", f"Error running job: {e}", None
+
+async def track_executions_real(executions):
+    """Re-register in-flight executions with the MCP server's status poller"""
     try:
-        async with aiohttp.ClientSession() as session:
-            data = {
-                "job_id": job_id,
-                "software": software,
-                "winget_id": winget_id,
-                "version": version
-            }
-            async with session.post(
-                f"{MCP_SERVER_URL}/api/run_job",
-                json=data,
-                timeout=30
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result.get("status", "failed"), result.get("message", "Unknown error")
-                else:
-                    return "failed", f"MCP server error: {response.status}"
+        status, _ = await MCP.post_json("/api/executions/track", {"executions": executions}, upstream="rundeck")
+        return status == 200
     except Exception as e:
-        return "failed", f"Error running job: {e}"
+        tracing.log(f"Error registering executions: {e}")
+        return False
 
 # ================== ADAPTIVE CARDS ==================
 def card_select_software():
+    if len(CATALOG.entries) > PICKER_MAX_CHOICES:
+        # Too many entries for one drop-down: start with the first page of the search card
+        results, total = CATALOG.search("", 0, SEARCH_PAGE_SIZE)
+        return card_search_results("", None, results, 0, total)
+    return Activity(
+        type=ActivityTypes.message,
+        attachments=[{"contentType": "application/vnd.microsoft.card.adaptive", "content": CATALOG.select_card()}],
+    )
+
+def card_select_bundle():
+    return Activity(
+        type=ActivityTypes.message,
+        attachments=[{"contentType": "application/vnd.microsoft.card.adaptive", "content": CATALOG.bundle_card()}],
+    )
+
+def card_search_results(query, version, results, offset, total):
     choices = [
         {
-            "title": f"{name} ({ver})",
-            "value": json.dumps({"software": name, "version": ver, "winget_id": winget_id}),
+            "title": f"{e.software_name} ({version or e.version}) · {e.winget_id}",
+            "value": json.dumps({"software": e.software_name, "version": version or e.version, "winget_id": e.winget_id}),
         }
-        for name, ver, winget_id in get_software_list()
+        for e in results
     ]
+    page = {"action": "search_software", "query": query, "version": version}
+    actions = [{"type": "Action.Submit", "title": "Install selected", "data": {"action": "select_software"}}]
+    if offset > 0:
+        actions.append({"type": "Action.Submit", "title": "◀ Previous", "data": dict(page, offset=max(0, offset - SEARCH_PAGE_SIZE))})
+    if offset + SEARCH_PAGE_SIZE < total:
+        actions.append({"type": "Action.Submit", "title": "Next ▶", "data": dict(page, offset=offset + SEARCH_PAGE_SIZE)})
+    actions.append({"type": "Action.Submit", "title": "Search", "data": dict(page, offset=0)})
+    heading = f"Results for \"{query}\"" if query else "Software catalog"
     card = {
         "type": "AdaptiveCard",
         "version": "1.4",
         "body": [
-            {"type": "TextBlock", "text": "Select software to install:", "weight": "Bolder", "size": "Medium"},
+            {"type": "TextBlock", "text": heading, "weight": "Bolder", "size": "Medium"},
+            {"type": "TextBlock", "text": f"{offset + 1}–{offset + len(results)} of {total}", "isSubtle": True},
+            {"type": "Input.Text", "id": "search_query", "placeholder": "Search by name or winget ID", "value": query},
             {
                 "type": "Input.ChoiceSet",
                 "id": "software_selection",
-                "style": "compact",
-                "choices": [{"title": c["title"], "value": c["value"]} for c in choices],
+                "style": "expanded",
+                "choices": choices,
             },
         ],
-        "actions": [{"type": "Action.Submit", "title": "Submit", "data": {"action": "select_software"}}],
+        "actions": actions,
     }
     return Activity(
         type=ActivityTypes.message,
         attachments=[{"contentType": "application/vnd.microsoft.card.adaptive", "content": card}],
     )
 
-def card_approval(request_id, software, version, ticket_number):
-    card = {
-        "type": "AdaptiveCard",
-        "version": "1.4",
-        "body": [
-            {"type": "TextBlock", "text": "Install Request Approval", "weight": "Bolder", "size": "Medium"},
-            {"type": "TextBlock", "text": f"Ticket: {ticket_number}"},
-            {"type": "TextBlock", "text": f"Software: {software}"},
-            {"type": "TextBlock", "text": f"Version: {version}"},
-            {"type": "TextBlock", "text": "Approve or Reject this request."},
-        ],
-        "actions": [
+def card_request_status(request_id, software, version, status, ticket_number, execution_id, approved_by, log_url=None):
+    """The request's single status card, updated in place as the request moves on"""
+    ticket = f"Ticket {ticket_number}" if ticket_number else "no ticket yet"
+    lines = {
+        "requested": "📝 Logged. Creating ServiceNow ticket…",
+        "ticket_created": f"📨 {ticket}. Waiting for approval…",
+        "approved": (
+            f"✅ Auto-approved by the {approved_by[len('policy:'):]} policy ({ticket}). Ready to install. Proceed?"
+            if (approved_by or "").startswith("policy:")
+            else f"✅ Approved by {approved_by} ({ticket}). Ready to install. Proceed?"
+        ),
+        "rejected": f"❌ Rejected by {approved_by} ({ticket}).",
+        "accepted": "🚀 Installation queued. I'll message you when it finishes.",
+        "running": f"🚀 Installing (Rundeck execution {execution_id})…" if execution_id else "🚀 Starting installation…",
+        "installed": "✅ Installation completed.",
+        "failed": "❌ Installation failed.",
+    }
+    actions = []
+    if status == "ticket_created":
+        actions = [
             {"type": "Action.Submit", "title": "Approve", "data": {"action": "approve_request", "request_id": request_id}},
             {"type": "Action.Submit", "title": "Reject", "data": {"action": "reject_request", "request_id": request_id}},
-        ],
-    }
+        ]
+    elif status == "approved":
+        actions = [{"type": "Action.Submit", "title": "Proceed", "data": {"action": "accept_install", "request_id": request_id}}]
+    if log_url:
+        actions.append({"type": "Action.OpenUrl", "title": "Follow log" if status == "running" else "View log", "url": log_url})
+    body = [
+        {"type": "TextBlock", "text": f"Install request {request_id}", "weight": "Bolder", "size": "Medium"},
+        {"type": "TextBlock", "text": f"Software: {software}", "wrap": True},
+    ]
+    if version != "bundle":
+        body.append({"type": "TextBlock", "text": f"Version: {version}"})
+    body.append({"type": "TextBlock", "text": lines.get(status, status), "wrap": True})
+    card = {"type": "AdaptiveCard", "version": "1.4", "body": body, "actions": actions}
     return Activity(
         type=ActivityTypes.message,
         attachments=[{"contentType": "application/vnd.microsoft.card.adaptive", "content": card}],
     )
 
-def card_confirm_install(request_id, software, version):
-    card = {
-        "type": "AdaptiveCard",
-        "version": "1.4",
-        "body": [
-            {"type": "TextBlock", "text": "Ready to install. Proceed?", "weight": "Bolder", "size": "Medium"},
-            {"type": "TextBlock", "text": f"Software: {software} (v{version})"},
-        ],
-        "actions": [
-            {"type": "Action.Submit", "title": "Proceed", "data": {"action": "accept_install", "request_id": request_id}},
-        ],
-    }
+def is_approver(user):
+    """Whether a Teams user (from_property) is in BOT_APPROVER_USERS"""
+    return bool(BOT_APPROVER_USERS & {user.id, user.aad_object_id})
+
+def card_request_list(view, rows, next_cursor, can_approve=False):
+    """Request history; the pending view has Approve buttons only for approvers"""
+    if view == "mine":
+        title = "My requests"
+    else:
+        title = "Pending approvals" if can_approve else "My pending requests"
+    body = [{"type": "TextBlock", "text": title, "weight": "Bolder", "size": "Medium"}]
+    if not rows:
+        body.append({"type": "TextBlock", "text": "Nothing here.", "isSubtle": True})
+    for req_id, req_user, software, version, status, ticket_number, requested_at in rows:
+        body.append({
+            "type": "TextBlock",
+            "wrap": True,
+            "text": f"#{req_id} · {software} ({version}) · {status} · {ticket_number or 'no ticket'} · {requested_at}",
+        })
+    actions = []
+    if view == "pending" and can_approve:
+        actions = [
+            {"type": "Action.Submit", "title": f"Approve #{row[0]}", "data": {"action": "approve_request", "request_id": row[0]}}
+            for row in rows[:5]
+        ]
+    if next_cursor:
+        actions.append({"type": "Action.Submit", "title": "More", "data": {"action": "list_requests", "view": view, "cursor": next_cursor}})
+    card = {"type": "AdaptiveCard", "version": "1.4", "body": body, "actions": actions}
+    return Activity(
+        type=ActivityTypes.message,
+        attachments=[{"contentType": "application/vnd.microsoft.card.adaptive", "content": card}],
+    )
+
+def card_admin_stats(report):
+    """Rollup summary for "admin stats": totals for the period and the most installed software"""
+    totals = report["totals"]
+
+    def pct(rate):
+        return "–" if rate is None else f"{rate:.1%}"
+
+    facts = [
+        ("Requests", totals["requested"]),
+        ("Approved", f"{totals['approved']} ({totals['auto_approved']} by policy, {pct(totals['auto_approval_rate'])})"),
+        ("Rejected", totals["rejected"]),
+        ("Avg. decision time", "–" if totals["avg_decision_seconds"] is None else f"{totals['avg_decision_seconds'] / 60:.1f} min"),
+        ("Installed", totals["installed"]),
+        ("Failed", f"{totals['failed']} ({pct(totals['failure_rate'])})"),
+    ]
+    body = [
+        {"type": "TextBlock", "text": f"Stats {report['since']} – {report['until']}", "weight": "Bolder", "size": "Medium"},
+        {"type": "FactSet", "facts": [{"title": title, "value": str(value)} for title, value in facts]},
+    ]
+    if report["installs"]:
+        body.append({"type": "TextBlock", "text": "Installs by software", "weight": "Bolder"})
+        body.append({"type": "FactSet", "facts": [
+            {"title": row["software_name"], "value": f"{row['installed']} ok, {row['failed']} failed"}
+            for row in report["installs"][:10]
+        ]})
+    card = {"type": "AdaptiveCard", "version": "1.4", "body": body}
     return Activity(
         type=ActivityTypes.message,
         attachments=[{"contentType": "application/vnd.microsoft.card.adaptive", "content": card}],
     )
 
+# ================== INSTALL JOBS ==================
+async def continue_conversation(reference, callback):
+    if APP_ID:
+        await ADAPTER.continue_conversation(reference, callback, bot_id=APP_ID)
+    else:
+        await ADAPTER.continue_conversation(reference, callback, claims_identity=ClaimsIdentity({}, True))
+
+async def send_proactive(user_id, *messages):
+    """Send messages to a user's last known conversation outside of a turn, batched like a turn's replies"""
+    reference = await fetch_conversation_ref(user_id)
+    if reference is None:
+        tracing.log(f"No conversation reference for {user_id}; dropping notification")
+        return
+
+    async def callback(turn_context: TurnContext):
+        items = replies.merge([
+            (Activity(type=ActivityTypes.message, text=m) if isinstance(m, str) else m, None) for m in messages
+        ])
+        await turn_context.send_activities([activity for activity, _ in items])
+        metrics.CONNECTOR_CALLS.labels("send").inc(len(items))
+
+    with tracing.start_span("send_proactive", kind="client", user_id=user_id, messages=len(messages)):
+        await continue_conversation(reference, callback)
+
+async def update_request_card(req_id):
+    """Re-render a request's status card from its current state and edit it in place.
+
+    Without a card (sent before cards were tracked) or when the channel
+    refuses the edit, a new card is sent and tracked instead.
+    """
+    row = await fetch_request_card(req_id)
+    if not row:
+        return
+    req_user, software, version, status, ticket_number, execution_id, approved_by, card_reference = row
+    log_url = None
+    if status in ("running", "installed", "failed") and execution_id:
+        log_url = log_link(req_id, follow=status == "running")
+    card = card_request_status(req_id, software, version, status, ticket_number, execution_id, approved_by, log_url)
+    if card_reference:
+        reference = ConversationReference.deserialize(json.loads(card_reference))
+        card.id = reference.activity_id
+
+        async def edit(turn_context: TurnContext):
+            await turn_context.update_activity(card)
+
+        try:
+            with tracing.start_span("update_card", kind="client", request_id=req_id, status=status):
+                await continue_conversation(reference, edit)
+            metrics.CONNECTOR_CALLS.labels("update").inc()
+            return
+        except Exception as e:
+            tracing.log(f"Could not update the card of request {req_id}, sending a new one: {e}")
+    elif status == "requested":
+        # The submitting turn is still sending the card; it refreshes it once sent if needed
+        return
+    reference = await fetch_conversation_ref(req_user)
+    if reference is None:
+        tracing.log(f"No conversation reference for {req_user}; dropping card of request {req_id}")
+        return
+    card.id = None
+
+    async def send(turn_context: TurnContext):
+        response = await turn_context.send_activity(card)
+        if response is not None and response.id:
+            await save_card_reference(req_id, turn_context.activity, response.id)
+
+    with tracing.start_span("send_card", kind="client", request_id=req_id, status=status):
+        await continue_conversation(reference, send)
+    metrics.CONNECTOR_CALLS.labels("send").inc()
+
+CARDS = replies.CardUpdater(update_request_card)
+
+async def process_install_job(job_id, req_id):
+    """Start one queued install; completion arrives later on /api/job_status"""
+    async with REQUEST_LOCKS.hold(req_id):
+        started = await start_install(req_id)
+    if started is None:
+        return
+    req_user, software, execution_id, message = started
+    if execution_id:
+        CARDS.refresh(req_id)
+    else:
+        await finish_install(req_id, "failed", message)
+
+async def start_install(req_id):
+    """Claim the request and dispatch it to Rundeck; returns (user, software, execution_id, message) or None"""
+    row = await fetch_request(req_id)
+    if not row:
+        return None
+    _, req_user, software, version, status, ticket_number, ticket_sys_id = row
+    # accepted -> running, or a re-run of a job that died before Rundeck returned an execution;
+    # anything else means the install was already dispatched or finished
+    claimed = await DB.transaction(lambda conn: conn.execute(
+        "UPDATE user_requests SET status='running' WHERE id=? AND (status='accepted' OR (status='running' AND execution_id IS NULL))",
+        (req_id,),
+    ).rowcount)
+    if not claimed:
+        tracing.log(f"Request {req_id} is {status}; not starting another install")
+        return None
+    metrics.REQUEST_TRANSITIONS.labels("running").inc()
+    with metrics.stage_timer("job_dispatch"):
+        return await dispatch_install(req_id, req_user, software, version)
+
+async def dispatch_install(req_id, req_user, software, version):
+    """Hand a claimed request to Rundeck via the MCP server"""
+    items = await fetch_request_items(req_id)
+    if items:
+        # Bundle: every package in one Rundeck execution
+        packages = [{"software": name, "version": ver, "winget_id": winget_id} for name, ver, winget_id, _ in items]
+        job_status, message, execution_id = await run_bundle_job_real(items[0][3], packages, req_id)
+    else:
+        # Get Rundeck job ID and Winget ID from catalog
+        catalog_row = fetch_catalog_entry(software)
+        if not catalog_row:
+            return req_user, software, None, "Software not found in catalog."
+        rundeck_job_id, winget_id = catalog_row
+
+        # Start REAL Rundeck job via MCP with Winget ID
+        job_status, message, execution_id = await run_rundeck_job_real(rundeck_job_id, software, winget_id, version, req_id)
+    if job_status == "running" and execution_id:
+        await update_request(req_id, execution_id=execution_id)
+        return req_user, software, execution_id, message
+    return req_user, software, None, message
+
+async def finish_install(req_id, job_status, logs):
+    """Record the final install result, update the ticket and notify the requester"""
+    async with REQUEST_LOCKS.hold(req_id):
+        finished = await record_install_result(req_id, job_status, logs)
+    if finished:
+        req_user, software, final_status = finished
+        CARDS.refresh(req_id)
+        # A new message as well as the card edit, so the requester gets notified
+        tail = f"Last log lines:\n{logstore.summary(logs)}\n\nFull log: {log_link(req_id)}"
+        if final_status == "installed":
+            await send_proactive(req_user, f"✅ Installation of {software} completed.\n\n{tail}")
+        else:
+            await send_proactive(req_user, f"❌ Installation of {software} failed.\n\n{tail}")
+
+async def record_install_result(req_id, job_status, logs):
+    """running (or accepted, for a job that never started) -> installed/failed plus the ticket update.
+
+    None if the request was already finished.
+    """
+    row = await fetch_request(req_id)
+    if not row:
+        return None
+    _, req_user, software, version, _, ticket_number, ticket_sys_id = row
+    final_status = "installed" if job_status == "success" else "failed"
+    # The ticket gets the end of the log and a link, not the whole output
+    tail = f"{logstore.summary(logs)}\nFull log: {log_link(req_id)}"
+    if final_status == "installed":
+        ticket_status, comments = "completed", f"Installation completed successfully.\n{tail}"
+    else:
+        ticket_status, comments = "failed", f"Installation failed.\n{tail}"
+
+    def finish(conn):
+        cur = conn.execute(
+            "UPDATE user_requests SET status=?, finished_at=? WHERE id=? AND status IN ('accepted', 'running')",
+            (final_status, utc_now(), req_id),
+        )
+        if cur.rowcount == 0:
+            # Already finished (duplicate callback)
+            return False
+        logstore.store(conn, req_id, logs)
+        # Update REAL Ticket in ServiceNow via MCP (through the outbox)
+        outbox.add(conn, "update_ticket", req_id, status=ticket_status, comments=comments,
+                   update_id=uuid.uuid4().hex)
+        # Seconds since the install job handed the request to Rundeck
+        dispatched = conn.execute(
+            """SELECT (julianday('now') - julianday(finished_at)) * 86400 FROM install_jobs
+               WHERE request_id=? AND status='done' ORDER BY id DESC LIMIT 1""",
+            (req_id,),
+        ).fetchone()
+        return (dispatched[0] if dispatched else None,)
+    finished = await DB.transaction(finish)
+    if not finished:
+        return None
+    OUTBOX.notify()
+    metrics.REQUEST_TRANSITIONS.labels(final_status).inc()
+    metrics.observe_stage("job_completion", finished[0])
+    return req_user, software, final_status
+
+async def resume_execution_tracking(app=None):
+    """Hand running executions back to the MCP poller in case it restarted"""
+    if WORKER_INDEX:
+        # One worker is enough
+        return
+    rows = await DB.fetchall(
+        """SELECT r.id, r.execution_id, c.rundeck_job_id FROM user_requests r
+           LEFT JOIN software_catalog c ON c.software_name = r.software_name
+           WHERE r.status='running' AND r.execution_id IS NOT NULL""",
+    )
+    if rows:
+        await track_executions_real([
+            {"request_id": req_id, "execution_id": execution_id, "job_id": job_id}
+            for req_id, execution_id, job_id in rows
+        ])
+
+async def start_retention(app=None):
+    """Archive old requests from one worker only"""
+    if not WORKER_INDEX:
+        await RETENTION.start(app)
+
+# Serializes state changes of one request within this process; CAS updates cover other processes
+REQUEST_LOCKS = idempotency.KeyedLocks()
+
+async def fail_install_job(job_id, req_id, error):
+    """An install job used up its attempts: fail the request so the card, ticket and requester hear about it"""
+    await finish_install(req_id, "failed", f"The installation could not be started: {error}")
+
+JOBS = jobs.JobQueue(DB, process_install_job, on_failed=fail_install_job)
+
+# ================== OUTBOX HANDLERS ==================
+async def outbox_create_ticket(req_id):
+    """Create the ServiceNow ticket for a logged request, then show the approval on its status card"""
+    row = await fetch_request(req_id)
+    if not row:
+        return
+    _, req_user, software, version, status, ticket_number, ticket_sys_id = row
+    if ticket_number:
+        return
+
+    items = await fetch_request_items(req_id)
+    packages = [{"software": name, "version": ver, "winget_id": winget_id} for name, ver, winget_id, _ in items]
+    # Policy approvals go on the ticket in the create call; there is no separate approval update
+    approver = await DB.fetchone("SELECT approved_by FROM user_requests WHERE id=? AND approved_by LIKE 'policy:%'", (req_id,))
+    with metrics.stage_timer("ticket_create"):
+        ticket_number, ticket_sys_id = await create_ticket_real(
+            req_user, software, version, packages, approver[0] if approver else None
+        )
+    if not ticket_number:
+        raise RuntimeError(f"Failed to create ServiceNow ticket for request {req_id}")
+    await DB.execute(
+        "UPDATE user_requests SET ticket_number=?, ticket_sys_id=?, status=CASE WHEN status='requested' THEN 'ticket_created' ELSE status END WHERE id=?",
+        (ticket_number, ticket_sys_id, req_id),
+    )
+    metrics.REQUEST_TRANSITIONS.labels("ticket_created").inc()
+    # The status card turns into the approval card; errors there never retry (and duplicate) the ticket
+    CARDS.refresh(req_id)
+
+async def outbox_update_ticket(req_id, status, comments, update_id=None):
+    """Push a request's state change to its ServiceNow ticket"""
+    row = await fetch_request(req_id)
+    if not row:
+        return
+    ticket_number, ticket_sys_id = row[5], row[6]
+    if not ticket_number:
+        raise RuntimeError(f"Request {req_id} has no ticket yet")
+    # The row stays in flight until the MCP server confirms the update reached ServiceNow
+    if not await update_ticket_real(ticket_number, status, comments, ticket_sys_id, update_id):
+        raise RuntimeError(f"Failed to update ServiceNow ticket {ticket_number}")
+
+OUTBOX = outbox.OutboxDispatcher(DB, {
+    "create_ticket": outbox_create_ticket,
+    "update_ticket": outbox_update_ticket,
+})
+
 # ================== BOT ==================
+IDEMPOTENT_ACTIONS = {"select_software", "select_bundle", "approve_request", "reject_request", "accept_install"}
+IDEMPOTENCY = idempotency.IdempotencyStore(DB)
+# Archives closed requests past RETENTION_DAYS; rollups keep reporting on them
+RETENTION = reporting.Retention(DB)
+
+INSTALL_KEYWORDS = ["install", "software", "setup", "add program"]
+# Only a message that starts with an install verb logs a request; anything else at most shows the picker
+INSTALL_COMMAND = re.compile(r"^(?:please\s+)?(?:install|set\s*up|add\s+program)\b(.*)$")
+NOT_INSTALL = re.compile(r"\b(?:uninstall|reinstall|remove|delete)\w*")
+FILLER_WORDS = {"software", "program", "app", "application", "please", "me", "the", "a", "an", "version", "on", "my", "for"}
+VERSION_TOKEN = re.compile(r"^(v?\d+(\.\d+)*|latest)$")
+
+def parse_install_query(text):
+    """Split "install chrome 117" into ("chrome", "117"); None if the text is not an install request.
+
+    The install verb must open the message as a whole word, so "uninstall
+    chrome" or "how do I install chrome" never log a request.
+    """
+    match = INSTALL_COMMAND.match(text)
+    if match is None or NOT_INSTALL.search(text):
+        return None
+    words = match.group(1).split()
+    version = None
+    if words and VERSION_TOKEN.match(words[-1]):
+        version = words.pop().lstrip("v")
+    query = " ".join(w for w in words if w not in FILLER_WORDS)
+    return query, version
+
+def send_status_card(turn_context, req_id, software, version, approved_by=None):
+    """Reply with a new request's status card and remember where it landed, so later changes edit it"""
+    status = "approved" if approved_by else "requested"
+
+    async def on_sent(card_id):
+        if await save_card_reference(req_id, turn_context.activity, card_id) != (status, None):
+            # The ticket was created before the card went out
+            CARDS.refresh(req_id)
+
+    card = card_request_status(req_id, software, version, status, None, None, approved_by)
+    replies.ReplyBuffer.of(turn_context).track(card, on_sent)
+
+async def pin_version(entry, version):
+    """Turn "latest" into the newest version synced from the winget manifests, so requests name a real version"""
+    if version != "latest" or not entry.winget_id:
+        return version
+    row = await DB.fetchone(
+        "SELECT version FROM software_versions WHERE winget_id=? ORDER BY sort_key DESC LIMIT 1", (entry.winget_id,)
+    )
+    return row[0] if row else version
+
+async def submit_request(turn_context, user_id, software, version):
+    """Log a request; the ServiceNow ticket is created by the outbox dispatcher, which then shows the approval on the card.
+
+    Requests the approval policy covers are approved right away and only wait for the requester's Proceed.
+    """
+    await save_conversation_ref(user_id, turn_context.activity)
+    entry = CATALOG.get(software)
+    if entry:
+        version = await pin_version(entry, version)
+    rules = POLICY.candidates(user_id, [entry], [version]) if entry else []
+    req_id, approved_by = await insert_request(user_id, software, version, rules)
+    send_status_card(turn_context, req_id, software, version, approved_by)
+    return req_id
+
+async def submit_bundle(turn_context, user_id, entries):
+    """Log a bundle request: one ticket, one approval and one Rundeck execution for all packages"""
+    entries = list({e.winget_id: e for e in entries}.values())
+    if len(entries) == 1:
+        return await submit_request(turn_context, user_id, entries[0].software_name, entries[0].version)
+    if len({e.rundeck_job_id for e in entries}) > 1:
+        await turn_context.send_activity("⚠️ These packages use different Rundeck jobs and can't be bundled. Please request them separately.")
+        return None
+    await save_conversation_ref(user_id, turn_context.activity)
+    entries = [e._replace(version=await pin_version(e, e.version)) for e in entries]
+    rules = POLICY.candidates(user_id, entries, [e.version for e in entries])
+    req_id, approved_by = await insert_bundle_request(user_id, entries, rules)
+    send_status_card(turn_context, req_id, "Bundle: " + ", ".join(e.software_name for e in entries), "bundle", approved_by)
+    return req_id
+
+def resolve_bundle_query(query):
+    """Resolve "chrome, vscode and slack" to catalog entries; returns (entries, unresolved parts)"""
+    entries, unresolved = [], []
+    for part in re.split(r",|\band\b|&", query):
+        part = part.strip()
+        if not part:
+            continue
+        matches = CATALOG.resolve(part)
+        if len(matches) != 1:
+            results, total = CATALOG.search(part, 0, 2)
+            matches = results if total == 1 else matches[:0]
+        if matches:
+            entries.append(matches[0])
+        else:
+            unresolved.append(part)
+    return entries, unresolved
+
+async def send_request_list(turn_context, user_id, view, cursor=None):
+    # Everyone's pending requests are for approvers; others see only their own
+    can_approve = view != "mine" and is_approver(turn_context.activity.from_property)
+    try:
+        if view == "mine":
+            rows, next_cursor = await list_user_requests(user_id, cursor)
+        else:
+            rows, next_cursor = await list_requests_by_status(
+                "ticket_created", cursor, user_id=None if can_approve else user_id
+            )
+    except ValueError:
+        await turn_context.send_activity("⚠️ Invalid page.")
+        return
+    await turn_context.send_activity(card_request_list(view, rows, next_cursor, can_approve))
+
 class TeamsSoftwareBot(ActivityHandler):
+    async def on_turn(self, turn_context: TurnContext):
+        # Everything the turn sends goes out in one batch at the end
+        reply = replies.ReplyBuffer(turn_context)
+        try:
+            await super().on_turn(turn_context)
+        finally:
+            await reply.flush()
+
     async def on_message_activity(self, turn_context: TurnContext):
         text_raw = (turn_context.activity.text or "").strip()
         text = text_raw.lower()
         value = turn_context.activity.value
         user_id = turn_context.activity.from_property.id
+        tracing.set_attribute("user_id", user_id)
 
         # Handle all Adaptive Card submissions
         if value and isinstance(value, dict) and value.get("action"):
             action = value.get("action")
-            if action == "select_software":
-                # Parse selection
-                selection = value.get("software_selection")
-                try:
-                    data = json.loads(selection)
-                    software, version, winget_id = data["software"], data["version"], data.get("winget_id", "")
-                except Exception:
-                    await turn_context.send_activity("⚠️ Invalid selection payload.")
-                    return
-
-                # 1) Log request
-                req_id = insert_request(user_id, software, version)
-
-                # 2) Create REAL Ticket in ServiceNow via MCP
-                ticket_number = await create_ticket_real(user_id, software, version)
-                if ticket_number:
-                    update_request(req_id, ticket_number=ticket_number, status="ticket_created")
-                    await turn_context.send_activity(f"📨 Ticket created: {ticket_number}. Waiting for approval…")
-                    
-                    # 3) Send approval card to supervisor (in real scenario)
-                    await turn_context.send_activity(card_approval(req_id, software, version, ticket_number))
-                else:
-                    await turn_context.send_activity("⚠️ Failed to create ServiceNow ticket. Please try again.")
+            tracing.set_attribute("card.action", action)
+            if action not in IDEMPOTENT_ACTIONS:
+                metrics.CARD_ACTIONS.labels(action, "handled").inc()
+                await self.on_card_action(turn_context, action, value, user_id)
                 return
+            # Retries and double clicks replay the same submit; run it once
+            key = idempotency.activity_key(action, user_id, turn_context.activity)
+            first, outcome = await IDEMPOTENCY.once(
+                key, lambda: self.on_card_action(turn_context, action, value, user_id)
+            )
+            metrics.CARD_ACTIONS.labels(action, "handled" if first else "duplicate").inc()
+            if not first:
+                await turn_context.send_activity(f"ℹ️ Already handled{': ' + outcome if outcome else ''}.")
+            return
 
-            elif action == "approve_request":
-                req_id = int(value.get("request_id"))
-                row = fetch_request(req_id)
-                if not row:
-                    await turn_context.send_activity("⚠️ Request not found.")
-                    return
-                _, req_user, software, version, _, ticket_number = row
-                
-                # Update request in DB
-                update_request(req_id, status="approved", approved_by=user_id, approved_at=time.strftime("%Y-%m-%d %H:%M:%S"))
-                
-                # Update REAL Ticket in ServiceNow via MCP
-                success = await update_ticket_real(ticket_number, "approved", f"Request approved by {user_id}")
-                if success:
-                    await turn_context.send_activity(f"✅ Approved request {req_id} (Ticket {ticket_number}).")
-                else:
-                    await turn_context.send_activity(f"✅ Approved request {req_id} but failed to update ServiceNow.")
-                
-                # Ask requester to proceed
-                await turn_context.send_activity(card_confirm_install(req_id, software, version))
+        # If not a card submit: decide by text intent
+        if text in ("my requests", "pending approvals"):
+            await send_request_list(turn_context, user_id, "mine" if text == "my requests" else "pending")
+            return
+
+        if text == "admin stats" or text.startswith("admin stats "):
+            await self.send_admin_stats(turn_context, text[len("admin stats"):].strip())
+            return
+
+        if text in ("bundle", "install bundle", "onboarding"):
+            await turn_context.send_activity(card_select_bundle())
+            return
+
+        parsed = parse_install_query(text)
+        if parsed is not None:
+            query, version = parsed
+            if not query:
+                await turn_context.send_activity(card_select_software())
                 return
 
-            elif action == "reject_request":
-                req_id = int(value.get("request_id"))
-                row = fetch_request(req_id)
-                if not row:
-                    await turn_context.send_activity("⚠️ Request not found.")
+            # "install chrome, vscode and slack": several packages as one bundle request
+            if re.search(r",|\band\b|&", query):
+                entries, unresolved = resolve_bundle_query(query)
+                if unresolved:
+                    await turn_context.send_activity(f"🔎 Couldn't find: {', '.join(unresolved)}. Type 'bundle' to pick from the catalog.")
                     return
-                _, _, software, version, _, ticket_number = row
-                
-                # Update request in DB
-                update_request(req_id, status="rejected", approved_by=user_id, approved_at=time.strftime("%Y-%m-%d %H:%M:%S"))
-                
-                # Update REAL Ticket in ServiceNow via MCP
-                success = await update_ticket_real(ticket_number, "rejected", f"Request rejected by {user_id}")
-                if success:
-                    await turn_context.send_activity(f"❌ Rejected request {req_id} (Ticket {ticket_number}).")
-                else:
-                    await turn_context.send_activity(f"❌ Rejected request {req_id} but failed to update ServiceNow.")
+
+                async def log_bundle():
+                    req_id = await submit_bundle(turn_context, user_id, entries)
+                    return f"request {req_id} is logged" if req_id else None
+                await self.submit_once(turn_context, user_id, log_bundle)
                 return
 
-            elif action == "accept_install":
-                req_id = int(value.get("request_id"))
-                row = fetch_request(req_id)
-                if not row:
-                    await turn_context.send_activity("⚠️ Request not found.")
-                    return
-                _, _, software, version, status, ticket_number = row
-                if status != "approved":
-                    await turn_context.send_activity("⚠️ Request is not approved yet.")
-                    return
+            # "install chrome 117": resolve straight from the message when unambiguous
+            matches = CATALOG.resolve(query)
+            results, total = CATALOG.search(query, 0, SEARCH_PAGE_SIZE)
+            if len(matches) != 1 and total == 1:
+                matches = results
+            if len(matches) == 1:
+                entry = matches[0]
 
-                update_request(req_id, status="accepted", accepted_at=time.strftime("%Y-%m-%d %H:%M:%S"))
-                await turn_context.send_activity("🚀 Starting installation…")
-                update_request(req_id, status="running")
-
-                # Get Rundeck job ID and Winget ID from catalog
-                conn = get_connection()
-                cur = conn.cursor()
-                cur.execute("SELECT rundeck_job_id, winget_id FROM software_catalog WHERE software_name=?", (software,))
-                catalog_row = cur.fetchone()
-                conn.close()
-                
-                if not catalog_row:
-                    await turn_context.send_activity("⚠️ Software not found in catalog.")
-                    return
-                    
-                job_id, winget_id = catalog_row
-                
-                # Execute REAL Rundeck job via MCP with Winget ID
-                job_status, logs = await run_rundeck_job_real(job_id, software, winget_id, version)
-                
-                if job_status == "success":
-                    update_request(req_id, status="installed", logs=logs, finished_at=time.strftime("%Y-%m-%d %H:%M:%S"))
-                    # Update REAL Ticket in ServiceNow via MCP
-                    await update_ticket_real(ticket_number, "completed", f"Installation completed successfully.\n{logs}")
-                    await turn_context.send_activity(f"✅ Installation completed.\n\nLogs:\n{logs}")
-                else:
-                    update_request(req_id, status="failed", logs=logs, finished_at=time.strftime("%Y-%m-%d %H:%M:%S"))
-                    # Update REAL Ticket in ServiceNow via MCP
-                    await update_ticket_real(ticket_number, "failed", f"Installation failed.\n{logs}")
-                    await turn_context.send_activity(f"❌ Installation failed.\n\nLogs:\n{logs}")
+                async def log_request():
+                    req_id = await submit_request(turn_context, user_id, entry.software_name, version or entry.version)
+                    return f"request {req_id} for {entry.software_name} is logged"
+                await self.submit_once(turn_context, user_id, log_request)
                 return
+            if total == 0:
+                await turn_context.send_activity(f"🔎 No software matching \"{query}\". Type 'install' to browse the catalog.")
+                return
+            await turn_context.send_activity(card_search_results(query, version, results, 0, total))
+            return
 
-        # If not a card submit: decide by text intent
-        if any(kw in text for kw in ["install", "software", "setup", "add program"]):
+        if NOT_INSTALL.search(text):
+            await turn_context.send_activity("⚠️ I can only install software. Please raise a ServiceNow ticket to remove or repair it.")
+            return
+
+        # Mentions of installing show the picker, as before
+        if any(kw in text for kw in INSTALL_KEYWORDS):
             await turn_context.send_activity(card_select_software())
             return
 
         # Otherwise, respond with help
         await turn_context.send_activity("I can help you install software. Type 'install' to get started.")
 
+    async def submit_once(self, turn_context: TurnContext, user_id, submit):
+        """Log requests from a text message once; a Teams retry of the same activity gets the first outcome"""
+        key = idempotency.message_key(user_id, turn_context.activity)
+        if key is None:
+            await submit()
+            return
+        first, outcome = await IDEMPOTENCY.once(key, submit)
+        if not first:
+            await turn_context.send_activity(f"ℹ️ Already handled{': ' + outcome if outcome else ''}.")
+
+    async def send_admin_stats(self, turn_context: TurnContext, days):
+        """Reporting rollups of the last N days (default 7), for BOT_ADMIN_USERS only"""
+        user = turn_context.activity.from_property
+        if not BOT_ADMIN_USERS & {user.id, user.aad_object_id}:
+            await turn_context.send_activity("⚠️ Only bot admins can see stats.")
+            return
+        if days and not (days.isdigit() and 0 < int(days) <= 366):
+            await turn_context.send_activity("Usage: admin stats [days, 1-366]")
+            return
+        since, until = reporting.date_range(int(days or 7))
+        report = await DB.read(lambda conn: reporting.report(conn, since, until))
+        await turn_context.send_activity(card_admin_stats(report))
+
+    async def on_card_action(self, turn_context: TurnContext, action, value, user_id):
+        """Handle an Adaptive Card submit; returns a short outcome for duplicate submits"""
+        if action == "select_software":
+            # Parse selection
+            selection = value.get("software_selection")
+            try:
+                data = json.loads(selection)
+                software, version = data["software"], data["version"]
+            except Exception:
+                await turn_context.send_activity("⚠️ Invalid selection payload.")
+                return None
+
+            req_id = await submit_request(turn_context, user_id, software, version)
+            return f"request {req_id} for {software} is logged"
+
+        elif action == "select_bundle":
+            selection = value.get("bundle_selection") or ""
+            entries = [CATALOG.get_by_winget(w.strip()) for w in selection.split(",") if w.strip()]
+            if not entries or None in entries:
+                await turn_context.send_activity("⚠️ Invalid selection payload.")
+                return None
+            req_id = await submit_bundle(turn_context, user_id, entries)
+            return f"request {req_id} is logged" if req_id else None
+
+        elif action == "show_bundle":
+            await turn_context.send_activity(card_select_bundle())
+
+        elif action == "list_requests":
+            await send_request_list(turn_context, user_id, value.get("view"), value.get("cursor"))
+
+        elif action == "search_software":
+            query = (value.get("search_query") or value.get("query") or "").strip()
+            version = value.get("version") or None
+            offset = max(0, int(value.get("offset") or 0))
+            results, total = CATALOG.search(query, offset, SEARCH_PAGE_SIZE)
+            if not results:
+                await turn_context.send_activity(f"🔎 No software matching \"{query}\".")
+                return None
+            await turn_context.send_activity(card_search_results(query, version, results, offset, total))
+
+        elif action in ("approve_request", "reject_request"):
+            req_id = int(value.get("request_id"))
+            approved = action == "approve_request"
+            async with REQUEST_LOCKS.hold(req_id):
+                row = await fetch_request(req_id)
+                if not row:
+                    await turn_context.send_activity("⚠️ Request not found.")
+                    return None
+                _, req_user, software, version, status, ticket_number, ticket_sys_id = row
+                decision = "approved" if approved else "rejected"
+
+                # Update request in DB; the ServiceNow update goes out through the outbox
+                changed = await update_request_and_ticket(
+                    req_id, decision, f"Request {decision} by {user_id}",
+                    expected_status="ticket_created",
+                    status=decision, approved_by=user_id, approved_at=utc_now(),
+                )
+            if not changed:
+                await turn_context.send_activity(f"⚠️ Request {req_id} is already {status}.")
+                return f"request {req_id} is {status}"
+            metrics.observe_stage("approval_wait", await request_age(req_id))
+            # The requester's card now asks to proceed (or shows the rejection)
+            CARDS.refresh(req_id)
+            if user_id != req_user:
+                # Decided from another conversation, e.g. the "pending approvals" list
+                mark = "✅ Approved" if approved else "❌ Rejected"
+                await turn_context.send_activity(f"{mark} request {req_id} (Ticket {ticket_number}).")
+            return f"request {req_id} was {decision}"
+
+        elif action == "accept_install":
+            req_id = int(value.get("request_id"))
+            async with REQUEST_LOCKS.hold(req_id):
+                row = await fetch_request(req_id)
+                if not row:
+                    await turn_context.send_activity("⚠️ Request not found.")
+                    return None
+                _, _, software, version, status, ticket_number, ticket_sys_id = row
+                if status != "approved":
+                    await turn_context.send_activity(f"⚠️ Request {req_id} is {status}, not awaiting installation.")
+                    return f"request {req_id} is {status}"
+
+                # Queue the install; a background worker runs it and reports back proactively
+                await save_conversation_ref(user_id, turn_context.activity)
+                job_id = await accept_request(req_id)
+            if job_id is None:
+                await turn_context.send_activity("⚠️ Request is not approved yet.")
+                return None
+            JOBS.notify()
+            CARDS.refresh(req_id)
+            return f"installation of {software} is queued"
+        return None
+
 # ================== SERVER ==================
-def init_app():
-    init_db()
-    seed_data()
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+LOOP_LAG = metrics.LoopLagMonitor()
+
+def collect_gauges():
+    """Point-in-time gauges for /metrics"""
+    pool = MCP.stats()
+    yield "bot_mcp_connections", "MCP client pool connections", {"state": "in_use"}, pool["connections_in_use"]
+    yield "bot_mcp_connections", "MCP client pool connections", {"state": "idle"}, pool["connections_idle"]
+    yield "bot_mcp_requests_in_flight", "Calls to the MCP server in flight", {}, pool["requests_in_flight"]
+    for upstream, guards in pool["upstreams"].items():
+        yield ("bot_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+               {"upstream": upstream}, CIRCUIT_STATES[guards["circuit"]["state"]])
+        yield ("bot_bulkhead_in_use", "Bulkhead slots in use", {"upstream": upstream}, guards["bulkhead"]["in_use"])
+    yield "bot_outbox_in_flight", "Outbox side effects being performed", {}, len(OUTBOX._in_flight)
+    yield "bot_sqlite_group_commits", "Group commits since start", {}, DB.batches
+    yield "bot_sqlite_writes", "Writes since start", {}, DB.writes
+    yield "bot_catalog_entries", "Entries in the in-memory catalog", {}, len(CATALOG.entries)
+    traces = tracing.EXPORTER.stats()
+    yield "bot_trace_queue", "Spans and log lines waiting for the exporter thread", {}, traces["queued"]
+    yield "bot_trace_dropped", "Spans and log lines dropped because the export queue was full", {}, traces["dropped_total"]
+
+metrics.register_gauges(collect_gauges)
+
+async def metrics_endpoint(req: web.Request) -> web.Response:
+    """Prometheus scrape endpoint"""
+    if not authorized(req):
+        return web.json_response({"error": "Unauthorized"}, status=401)
+    body, content_type = metrics.render()
+    return web.Response(body=body, headers={"Content-Type": content_type})
+
+def init_app(setup_db=True):
+    if setup_db:
+        init_db()
+        seed_data()
     app = web.Application()
     app.router.add_post("/api/messages", messages)
-    app.router.add_get("/health", lambda r: web.json_response({"ok": True}))
+    app.router.add_post("/api/job_status", job_status)
+    app.router.add_get("/api/requests", list_requests)
+    app.router.add_get("/api/requests/{request_id}/logs", request_logs)
+    app.router.add_get("/api/reports/daily", get_report)
+    app.router.add_get("/health", lambda r: web.json_response({"ok": True, "mcp_pool": MCP.stats()}))
+    app.router.add_get("/metrics", metrics_endpoint)
+    app.on_startup.append(DB.start)
+    app.on_startup.append(CATALOG.start)
+    app.on_startup.append(POLICY.start)
+    app.on_startup.append(MCP.start)
+    app.on_startup.append(JOBS.start)
+    app.on_startup.append(OUTBOX.start)
+    app.on_startup.append(IDEMPOTENCY.start)
+    app.on_startup.append(LOOP_LAG.start)
+    app.on_startup.append(resume_execution_tracking)
+    app.on_startup.append(start_retention)
+    app.on_cleanup.append(LOOP_LAG.close)
+    app.on_cleanup.append(IDEMPOTENCY.close)
+    app.on_cleanup.append(RETENTION.close)
+    app.on_cleanup.append(OUTBOX.close)
+    app.on_cleanup.append(JOBS.close)
+    app.on_cleanup.append(CARDS.close)
+    app.on_cleanup.append(MCP.close)
+    app.on_cleanup.append(CATALOG.close)
+    app.on_cleanup.append(POLICY.close)
+    app.on_cleanup.append(DB.close)
+    app.on_cleanup.append(tracing.close)
     return app
 
 SETTINGS = BotFrameworkAdapterSettings(APP_ID, APP_PASSWORD)
 ADAPTER = BotFrameworkHttpAdapter(SETTINGS)
 BOT = TeamsSoftwareBot()
 
+API_TOKEN = os.getenv("BOT_API_TOKEN", "")
+# Shared with the MCP server (BOT_CALLBACK_TOKEN there too); /api/job_status is open when unset
+CALLBACK_TOKEN = os.getenv("BOT_CALLBACK_TOKEN", "")
+
+def authorized(req):
+    """Bearer-token check for the bot's JSON endpoints (open when BOT_API_TOKEN is unset)"""
+    if not API_TOKEN:
+        return True
+    return hmac.compare_digest(req.headers.get("Authorization", ""), f"Bearer {API_TOKEN}")
+
+async def list_requests(req: web.Request) -> web.Response:
+    """Request history: ?user_id=... or ?status=..., keyset-paginated with ?cursor=&limit="""
+    if not authorized(req):
+        return web.json_response({"error": "Unauthorized"}, status=401)
+    try:
+        limit = min(100, max(1, int(req.query.get("limit", "20"))))
+    except ValueError:
+        return web.json_response({"error": "Invalid limit"}, status=400)
+    cursor = req.query.get("cursor")
+    try:
+        if req.query.get("user_id"):
+            rows, next_cursor = await list_user_requests(req.query["user_id"], cursor, limit)
+        elif req.query.get("status"):
+            rows, next_cursor = await list_requests_by_status(req.query["status"], cursor, limit)
+        else:
+            return web.json_response({"error": "user_id or status required"}, status=400)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    keys = HISTORY_COLUMNS.split(", ")
+    return web.json_response({
+        "items": [dict(zip(keys, row)) for row in rows],
+        "next_cursor": next_cursor,
+    })
+
+def log_signature(req_id):
+    return logstore.sign(LOG_LINK_SECRET or API_TOKEN, req_id)
+
+def log_link(req_id, follow=False):
+    """Link to a request's install log for chat messages, cards and ticket comments"""
+    query = {}
+    sig = log_signature(req_id)
+    if sig:
+        query["sig"] = sig
+    if follow:
+        query["follow"] = "1"
+    return f"{BOT_PUBLIC_URL}/api/requests/{req_id}/logs" + (f"?{urlencode(query)}" if query else "")
+
+async def read_log(req_id, offset, rundeck_offset):
+    """Next part of a request's log: (bytes, offset, rundeck_offset, complete).
+
+    ``offset`` counts log bytes already read. While the install runs the
+    output comes from Rundeck, from ``rundeck_offset`` on; afterwards from
+    the stored log, which is the same text, so a reader moves over
+    seamlessly. Log lines dropped by the size cap are replaced by a marker.
+    Only an accepted or running request can still produce output; for any
+    other status the log is complete once drained. None if the request is
+    gone (unknown or archived).
+    """
+    row = await DB.fetchone("SELECT status, execution_id FROM user_requests WHERE id=?", (req_id,))
+    if not row:
+        return None
+    status, execution_id = row
+    if status == "running" and execution_id:
+        try:
+            code, body = await MCP.get_json(
+                f"/api/executions/{execution_id}/output", {"offset": rundeck_offset},
+                upstream="rundeck", route="/api/executions/{id}/output",
+            )
+        except Exception as e:
+            tracing.log(f"Could not fetch the log of request {req_id}: {e}")
+            code, body = None, {}
+        if code == 200:
+            data = (body.get("output") or "").encode("utf-8")
+            return data, offset + len(data), int(body.get("offset") or rundeck_offset), False
+        return b"", offset, rundeck_offset, False
+    data, next_offset, first = await DB.read(lambda conn: logstore.read(conn, req_id, offset))
+    if first > offset:
+        data = f"[… {first - offset} bytes dropped …]\n".encode("utf-8") + data
+    return data, next_offset, rundeck_offset, status not in ("accepted", "running")
+
+async def request_logs(req: web.Request) -> web.StreamResponse:
+    """Install log of a request as text: ?offset=&rundeck_offset= to resume, ?follow=1 to tail a running install.
+
+    Opens with the API token or the ``sig`` of a link the bot sent.
+    """
+    try:
+        req_id = int(req.match_info["request_id"])
+        offset = max(0, int(req.query.get("offset", "0")))
+        rundeck_offset = max(0, int(req.query.get("rundeck_offset", "0")))
+    except ValueError:
+        return web.json_response({"error": "Invalid request id or offset"}, status=400)
+    if not authorized(req) and not logstore.verify(LOG_LINK_SECRET or API_TOKEN, req_id, req.query.get("sig", "")):
+        return web.json_response({"error": "Unauthorized"}, status=401)
+    part = await read_log(req_id, offset, rundeck_offset)
+    if part is None:
+        return web.json_response({"error": "Unknown request"}, status=404)
+    data, offset, rundeck_offset, complete = part
+    if req.query.get("follow") != "1":
+        return web.Response(body=data, content_type="text/plain", charset="utf-8", headers={
+            "X-Log-Offset": str(offset),
+            "X-Log-Rundeck-Offset": str(rundeck_offset),
+            "X-Log-Complete": "1" if complete else "0",
+        })
+    response = web.StreamResponse(headers={"Content-Type": "text/plain; charset=utf-8", "Cache-Control": "no-cache"})
+    await response.prepare(req)
+    await response.write(data)
+    # Until the request has finished and its stored log is drained
+    while not complete or data:
+        if not data:
+            await asyncio.sleep(LOG_FOLLOW_INTERVAL)
+        part = await read_log(req_id, offset, rundeck_offset)
+        if part is None:
+            # Archived while we were following
+            break
+        data, offset, rundeck_offset, complete = part
+        await response.write(data)
+    await response.write_eof()
+    return response
+
+async def get_report(req: web.Request) -> web.Response:
+    """Daily rollups: ?days=30 or ?since=&until= (ISO dates), optionally ?software="""
+    if not authorized(req):
+        return web.json_response({"error": "Unauthorized"}, status=401)
+    try:
+        if req.query.get("since"):
+            since = datetime.date.fromisoformat(req.query["since"]).isoformat()
+            until = datetime.date.fromisoformat(req.query.get("until") or reporting.date_range(1)[1]).isoformat()
+        else:
+            days = int(req.query.get("days", "30"))
+            if not 0 < days <= 3660:
+                raise ValueError(days)
+            since, until = reporting.date_range(days)
+    except ValueError:
+        return web.json_response({"error": "Invalid days or dates"}, status=400)
+    report = await DB.read(lambda conn: reporting.report(conn, since, until, req.query.get("software")))
+    return web.json_response(report)
+
+async def job_status(req: web.Request) -> web.Response:
+    """Final Rundeck execution status pushed by the MCP server (poller or Rundeck webhook)"""
+    if CALLBACK_TOKEN and not hmac.compare_digest(req.headers.get("Authorization", ""), f"Bearer {CALLBACK_TOKEN}"):
+        return web.json_response({"error": "Unauthorized"}, status=401)
+    try:
+        data = await req.json()
+    except ValueError:
+        return web.json_response({"error": "Invalid JSON"}, status=400)
+    execution_id = data.get("execution_id")
+    status = data.get("status")
+    if not execution_id or not status:
+        return web.json_response({"error": "Missing required fields"}, status=400)
+
+    with tracing.start_span("POST /api/job_status", parent=req.headers.get("traceparent"), kind="server",
+                            execution_id=str(execution_id), status=status):
+        row = await DB.fetchone("SELECT id FROM user_requests WHERE execution_id=?", (str(execution_id),))
+        if not row:
+            return web.json_response({"error": "Unknown execution"}, status=404)
+        tracing.set_attribute("request_id", row[0])
+        await finish_install(row[0], status, data.get("output") or "")
+    return web.json_response({"success": True})
+
 async def messages(req: web.Request) -> web.Response:
     auth_header = req.headers.get("Authorization", "")
-    response = await ADAPTER.process_activity(req, auth_header, BOT.on_turn)
+    # One trace per turn; joins the caller's trace when a traceparent header is sent
+    with tracing.start_span("POST /api/messages", parent=req.headers.get("traceparent"), kind="server") as span:
+        response = await ADAPTER.process_activity(req, auth_header, BOT.on_turn)
+        span.set_attribute("http.status_code", response.status if response else 200)
     if response:
         return web.Response(status=response.status)
     return web.Response(status=200)
 
+# ================== WORKERS ==================
+WORKER_INDEX = 0
+
+def run_worker(index, sock=None):
+    """Serve in a forked worker: on the inherited socket, or on its own SO_REUSEPORT socket"""
+    global WORKER_INDEX
+    WORKER_INDEX = index
+    app = init_app(setup_db=False)
+    if sock is not None:
+        web.run_app(app, sock=sock, print=None)
+    else:
+        web.run_app(app, host=BOT_HOST, port=BOT_PORT, reuse_port=True, print=None)
+
+def serve_workers(workers):
+    """Prefork master: set up the database once, fork ``workers`` servers and restart any that die.
+
+    With SO_REUSEPORT (Linux) every worker binds its own socket and the
+    kernel spreads connections across them; elsewhere they share one
+    listening socket. Workers coordinate only through the database:
+    compare-and-set status updates, idempotency keys and job/outbox leases.
+    """
+    init_db()
+    seed_data()
+    metrics.reset_multiprocess()
+    sock = None
+    if not hasattr(socket, "SO_REUSEPORT"):
+        sock = socket.create_server((BOT_HOST, BOT_PORT))
+        sock.set_inheritable(True)
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(index, sock)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for index in range(workers):
+        spawn(index)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print(f"======== {workers} workers on http://{BOT_HOST}:{BOT_PORT} (pids {', '.join(map(str, children))}) ========")
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        metrics.mark_process_dead(pid)
+        if not stopping and index is not None:
+            print(f"Worker {index} (pid {pid}) exited with status {status}; restarting")
+            time.sleep(1)
+            spawn(index)
+
 if __name__ == "__main__":
-    web.run_app(init_app(), host="localhost", port=3978)
\ No newline at end of file
+    if BOT_WORKERS > 1:
+        serve_workers(BOT_WORKERS)
+    else:
+        web.run_app(init_app(), host=BOT_HOST, port=BOT_PORT)
\ No newline at end of file
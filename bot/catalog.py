@@ -0,0 +1,277 @@
+import os
+import re
+import itertools
+import json
+import asyncio
+from collections import namedtuple
+import tracing
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    """,
+    "INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 1)",
+    """
+    CREATE TRIGGER IF NOT EXISTS software_catalog_ins AFTER INSERT ON software_catalog
+    BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS software_catalog_upd AFTER UPDATE ON software_catalog
+    BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS software_catalog_del AFTER DELETE ON software_catalog
+    BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END
+    """,
+)
+
+CatalogEntry = namedtuple("CatalogEntry", "software_name version rundeck_job_id winget_id aliases tags")
+
+_NON_WORD = re.compile(r"[^a-z0-9+#]+")
+
+
+def normalize(text):
+    return " ".join(_NON_WORD.split((text or "").lower())).strip()
+
+
+def _split(value):
+    """Comma-separated column (aliases, tags) as a tuple"""
+    return tuple(v.strip() for v in (value or "").split(",") if v.strip())
+
+
+# Word prefixes up to this length are indexed; longer query tokens are checked against the text
+PREFIX_LENGTH = 6
+
+
+class SearchIndex:
+    """Word-prefix index over software name, winget ID and aliases.
+
+    Each query token must be a word prefix in an entry's searchable text.
+    Every word prefix (up to ``PREFIX_LENGTH`` characters) maps to the
+    entries that have it, listed in rank order: name length, then name.
+    A one-word query is a lookup and a slice. With several words, the
+    lists are intersected as sets and put back in rank order. Only tokens
+    longer than ``PREFIX_LENGTH`` are checked against the text. Exact
+    name, alias and ID matches rank first.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.exact = {}
+        self.prefixes = {}
+        self.texts = []
+        names = [normalize(e.software_name) for e in entries]
+        by_name = sorted(range(len(entries)), key=lambda i: (len(names[i]), names[i]))
+        self.order = [0] * len(entries)
+        for position, i in enumerate(by_name):
+            self.order[i] = position
+        texts = {}
+        for i, entry in enumerate(entries):
+            keys = [entry.software_name, entry.winget_id, *entry.aliases]
+            normalized = [normalize(k) for k in keys if k]
+            texts[i] = " " + " ".join(normalized)
+            for key in normalized:
+                self.exact.setdefault(key, []).append(i)
+        self.texts = [texts[i] for i in range(len(entries))]
+        # Filled in rank order, so every list comes out sorted
+        for i in by_name:
+            for prefix in {token[:n] for token in self.texts[i].split() for n in range(1, min(len(token), PREFIX_LENGTH) + 1)}:
+                self.prefixes.setdefault(prefix, []).append(i)
+        self._sets = {}
+
+    def exact_match(self, query):
+        ids = self.exact.get(normalize(query), [])
+        return [self.entries[i] for i in dict.fromkeys(ids)]
+
+    def _set(self, prefix):
+        found = self._sets.get(prefix)
+        if found is None:
+            found = self._sets[prefix] = frozenset(self.prefixes[prefix])
+        return found
+
+    def search(self, query, offset=0, limit=10):
+        """Return (matching entries for the page, total match count)"""
+        q = normalize(query)
+        tokens = list(dict.fromkeys(q.split()))
+        if not tokens:
+            return self.entries[offset:offset + limit], len(self.entries)
+
+        keys = [t[:PREFIX_LENGTH] for t in tokens]
+        if any(k not in self.prefixes for k in keys):
+            return [], 0
+        keys = sorted(set(keys), key=lambda k: len(self.prefixes[k]))
+        long_checks = [" " + t for t in tokens if len(t) > PREFIX_LENGTH]
+        matches = self.prefixes[keys[0]]
+        if len(keys) > 1:
+            found = self._set(keys[0]).intersection(*(self._set(k) for k in keys[1:]))
+            # Back in rank order: sort a small result, or filter the shortest list when most of it matched
+            if len(found) * 8 < len(matches):
+                matches = sorted(found, key=self.order.__getitem__)
+            else:
+                matches = [i for i in matches if i in found]
+        if long_checks:
+            texts = self.texts
+            matches = [i for i in matches if all(c in texts[i] for c in long_checks)]
+
+        exact = [i for i in dict.fromkeys(self.exact.get(q, ())) if all(c in self.texts[i] for c in (" " + t for t in tokens))]
+        page_end = offset + limit
+        if exact:
+            exact_set = set(exact)
+            rest = (i for i in matches if i not in exact_set)
+            ranked = exact + list(itertools.islice(rest, max(0, page_end - len(exact))))
+        else:
+            ranked = matches[:page_end]
+        return [self.entries[i] for i in ranked[offset:page_end]], len(matches)
+
+
+class Catalog:
+    """In-memory copy of ``software_catalog`` for the turn hot paths.
+
+    Lookups by software name and winget ID, and the software picker card, are
+    served from memory. Triggers on ``software_catalog`` bump
+    ``catalog_version``; a background task compares that counter every
+    ``refresh_interval`` seconds and reloads on change. ``invalidate()``
+    forces a reload after an in-process catalog write. The picker card is
+    built once per catalog version.
+    """
+
+    def __init__(self, db, refresh_interval=None):
+        self.db = db
+        self.refresh_interval = refresh_interval or float(os.getenv("CATALOG_REFRESH_INTERVAL", "30"))
+        self.version = None
+        self.entries = []
+        self.by_name = {}
+        self.by_winget = {}
+        self.index = SearchIndex([])
+        self._card = None
+        self._card_version = None
+        self._bundle_card = None
+        self._bundle_card_version = None
+        self._task = None
+        self._reload = asyncio.Event()
+
+    async def start(self, app=None):
+        """Load the catalog and start watching for changes (aiohttp on_startup hook)"""
+        await self.load()
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def close(self, app=None):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def invalidate(self):
+        """Reload soon, e.g. after this process wrote to software_catalog"""
+        self._reload.set()
+
+    async def load(self):
+        def read(conn):
+            version = conn.execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()
+            rows = conn.execute(
+                "SELECT software_name, version, rundeck_job_id, winget_id, aliases, tags FROM software_catalog ORDER BY id"
+            ).fetchall()
+            return (version[0] if version else 0), rows
+
+        version, rows = await self.db.read(read)
+        entries = [
+            CatalogEntry(name, ver, job_id, winget_id, _split(aliases), frozenset(t.lower() for t in _split(tags)))
+            for name, ver, job_id, winget_id, aliases, tags in rows
+        ]
+        # Building the index is CPU-bound; keep it off the event loop
+        index = await asyncio.get_running_loop().run_in_executor(None, SearchIndex, entries)
+        # Swap all views at once so readers never see a half-built catalog
+        self.entries = entries
+        self.by_name = {e.software_name: e for e in entries}
+        self.by_winget = {e.winget_id: e for e in entries if e.winget_id}
+        self.index = index
+        self.version = version
+
+    async def _watch(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._reload.wait(), self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+            forced = self._reload.is_set()
+            self._reload.clear()
+            try:
+                row = await self.db.fetchone("SELECT version FROM catalog_version WHERE id = 1")
+                if forced or (row and row[0] != self.version):
+                    await self.load()
+            except Exception as e:
+                tracing.log(f"Catalog refresh failed: {e}")
+
+    def get(self, software_name):
+        return self.by_name.get(software_name)
+
+    def get_by_winget(self, winget_id):
+        return self.by_winget.get(winget_id)
+
+    def resolve(self, query):
+        """Entries whose name, winget ID or alias equals the query"""
+        return self.index.exact_match(query)
+
+    def search(self, query, offset=0, limit=10):
+        return self.index.search(query, offset, limit)
+
+    def select_card(self):
+        """Adaptive Card content for the software picker, memoized per catalog version"""
+        if self._card is None or self._card_version != self.version:
+            choices = [
+                {
+                    "title": f"{e.software_name} ({e.version})",
+                    "value": json.dumps({"software": e.software_name, "version": e.version, "winget_id": e.winget_id}),
+                }
+                for e in self.entries
+            ]
+            self._card = {
+                "type": "AdaptiveCard",
+                "version": "1.4",
+                "body": [
+                    {"type": "TextBlock", "text": "Select software to install:", "weight": "Bolder", "size": "Medium"},
+                    {
+                        "type": "Input.ChoiceSet",
+                        "id": "software_selection",
+                        "style": "compact",
+                        "choices": choices,
+                    },
+                ],
+                "actions": [
+                    {"type": "Action.Submit", "title": "Submit", "data": {"action": "select_software"}},
+                    {"type": "Action.Submit", "title": "Pick several…", "data": {"action": "show_bundle"}},
+                ],
+            }
+            self._card_version = self.version
+        return self._card
+
+    def bundle_card(self, max_choices=100):
+        """Multi-select picker for bundle requests, memoized per catalog version"""
+        if self._bundle_card is None or self._bundle_card_version != self.version:
+            choices = [
+                {"title": f"{e.software_name} ({e.version})", "value": e.winget_id}
+                for e in self.entries[:max_choices]
+                if e.winget_id
+            ]
+            self._bundle_card = {
+                "type": "AdaptiveCard",
+                "version": "1.4",
+                "body": [
+                    {"type": "TextBlock", "text": "Select the software to install together:", "weight": "Bolder", "size": "Medium"},
+                    {"type": "TextBlock", "text": "One ticket and one approval cover the whole bundle.", "isSubtle": True, "wrap": True},
+                    {
+                        "type": "Input.ChoiceSet",
+                        "id": "bundle_selection",
+                        "isMultiSelect": True,
+                        "style": "expanded",
+                        "choices": choices,
+                    },
+                ],
+                "actions": [{"type": "Action.Submit", "title": "Request bundle", "data": {"action": "select_bundle"}}],
+            }
+            self._bundle_card_version = self.version
+        return self._bundle_card
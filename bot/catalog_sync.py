@@ -0,0 +1,376 @@
+import os
+import re
+import sys
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from db import open_database
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS software_versions (
+        winget_id TEXT NOT NULL,
+        version TEXT NOT NULL,
+        sort_key TEXT NOT NULL,
+        package_name TEXT,
+        moniker TEXT,
+        tags TEXT,
+        PRIMARY KEY (winget_id, version)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_software_versions_latest ON software_versions (winget_id, sort_key)",
+    """
+    CREATE TABLE IF NOT EXISTS catalog_manifests (
+        dir TEXT PRIMARY KEY,
+        stamp TEXT NOT NULL,
+        digest TEXT NOT NULL,
+        winget_id TEXT,
+        version TEXT
+    )
+    """,
+)
+
+# Top-level manifest keys the catalog uses; everything else is skipped
+FIELDS = {"PackageIdentifier", "PackageVersion", "PackageName", "Moniker", "Tags", "ManifestType"}
+MAX_TAGS = 10
+# Catalog values reach Rundeck job options, where bundles join them with ';'
+UNSAFE_ID = re.compile(r"[\s;'\"`$\\]")
+UNSAFE_NAME = re.compile(r"[;\x00-\x1f\x7f]")
+_VERSION_PART = re.compile(r"\d+|[A-Za-z]+")
+
+
+def version_key(version):
+    """Sort key that orders versions numerically part by part ("1.10" after "1.9")"""
+    return ".".join(
+        part.zfill(12) if part.isdigit() else "!" + part.lower()
+        for part in _VERSION_PART.findall(version)
+    )
+
+
+def _scalar(value):
+    value = value.strip()
+    if value[:1] in ("'", '"'):
+        end = value.find(value[0], 1)
+        return value[1:end] if end > 0 else value[1:]
+    return value.split(" #", 1)[0].strip()
+
+
+def parse_manifest(text):
+    """The top-level ``FIELDS`` of a winget manifest.
+
+    winget manifests are flat YAML; reading the few keys needed line by
+    line is much faster than a full YAML parse and keeps versions as text
+    (a YAML parser turns ``1.10`` into the float 1.1).
+    """
+    fields = {}
+    key = None
+    for line in text.lstrip("\ufeff").splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        if stripped.startswith("- "):
+            if key == "Tags":
+                fields["Tags"].append(_scalar(stripped[2:]))
+            continue
+        if line[0] in " \t":
+            continue
+        key, sep, value = line.partition(":")
+        key = key.strip()
+        if not sep or key not in FIELDS:
+            key = None
+            continue
+        value = _scalar(value)
+        if key == "Tags":
+            fields["Tags"] = [_scalar(t) for t in value.strip("[]").split(",") if t.strip()] if value else []
+        else:
+            fields[key] = value
+    return fields
+
+
+def read_version_dir(path):
+    """Hash and parse one version directory (runs in the parser pool).
+
+    Returns (path, digest, manifest) where manifest has ``winget_id``,
+    ``version``, ``name``, ``moniker`` and ``tags``, or is None when the
+    directory holds no usable manifest. Package name, moniker and tags
+    come from the singleton or default-locale manifest. Identifiers and
+    versions with whitespace, quotes or ``;`` and names with ``;`` or
+    control characters make the manifest unusable.
+    """
+    digest = hashlib.sha256()
+    merged = {}
+    locale = {}
+    try:
+        names = sorted(n for n in os.listdir(path) if n.endswith((".yaml", ".yml")))
+        for name in names:
+            with open(os.path.join(path, name), "rb") as f:
+                data = f.read()
+            digest.update(name.encode() + b"\0" + data)
+            fields = parse_manifest(data.decode("utf-8", errors="replace"))
+            kind = fields.get("ManifestType", "singleton")
+            if kind in ("singleton", "defaultLocale"):
+                locale = fields
+            elif kind == "locale" and not locale and name.endswith(".locale.en-US.yaml"):
+                locale = fields
+            for key in ("PackageIdentifier", "PackageVersion"):
+                merged.setdefault(key, fields.get(key))
+    except OSError:
+        return path, None, None
+    if not merged.get("PackageIdentifier") or not merged.get("PackageVersion"):
+        return path, digest.hexdigest(), None
+    name = locale.get("PackageName") or merged["PackageIdentifier"]
+    if UNSAFE_ID.search(merged["PackageIdentifier"]) or UNSAFE_ID.search(merged["PackageVersion"]) \
+            or UNSAFE_NAME.search(name):
+        return path, digest.hexdigest(), None
+    tags = [t.lower() for t in locale.get("Tags") or [] if t and "," not in t][:MAX_TAGS]
+    return path, digest.hexdigest(), {
+        "winget_id": merged["PackageIdentifier"],
+        "version": merged["PackageVersion"],
+        "name": name,
+        "moniker": locale.get("Moniker") or "",
+        "tags": ",".join(dict.fromkeys(tags)),
+    }
+
+
+def _read_chunk(paths):
+    return [read_version_dir(path) for path in paths]
+
+
+def scan(root):
+    """Stat the mirror: {version dir: stamp} for every directory holding manifests.
+
+    The stamp (file count, total size, newest and summed mtimes) changes
+    whenever a file in the directory is added, removed or rewritten, so
+    unchanged directories are skipped without being read.
+    """
+    found = {}
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        count = size = newest = total = 0
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith("."):
+                            stack.append(entry.path)
+                    elif entry.name.endswith((".yaml", ".yml")):
+                        st = entry.stat(follow_symlinks=False)
+                        count += 1
+                        size += st.st_size
+                        newest = max(newest, st.st_mtime_ns)
+                        total += st.st_mtime_ns
+        except OSError:
+            continue
+        if count:
+            found[os.path.relpath(path, root)] = f"{count}:{size}:{newest}:{total}"
+    return found
+
+
+class CatalogSync:
+    """Indexes a local mirror of the winget-pkgs manifest tree into ``software_catalog``.
+
+    Each run stats the tree and compares every version directory with
+    ``catalog_manifests``; only new or changed directories are read, hashed
+    and parsed, in a process pool. Results are written in bulk, one
+    transaction per ``batch_size`` directories, to ``software_versions``
+    (every known version of a package), and the catalog row of each
+    touched package is pointed at its newest version. New packages get
+    ``job_id`` as their Rundeck job and the manifest's moniker and tags.
+    Existing rows keep their name, aliases and tags and only get the new
+    version. Packages whose manifests are all gone are removed if the
+    sync added them. The bot's catalog picks the changes up through the
+    ``catalog_version`` triggers.
+    """
+
+    def __init__(self, conn, root, job_id, workers=None, batch_size=2000, chunk_size=64, log=print):
+        self.conn = conn
+        self.root = os.path.abspath(root)
+        self.job_id = job_id
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.log = log
+        self.stats = {"dirs": 0, "unchanged": 0, "read": 0, "parsed": 0, "invalid": 0, "removed": 0, "packages": 0}
+
+    def check_schema(self):
+        cols = [r[1] for r in self.conn.execute("PRAGMA table_info(software_catalog)").fetchall()]
+        if "source" not in cols:
+            raise RuntimeError("software_catalog is missing or outdated; start the bot once to set up the database")
+        for stmt in SCHEMA:
+            self.conn.execute(stmt)
+
+    def run(self):
+        started = time.perf_counter()
+        self.check_schema()
+        current = scan(self.root)
+        known = {d: (stamp, digest, winget_id, version) for d, stamp, digest, winget_id, version
+                 in self.conn.execute("SELECT dir, stamp, digest, winget_id, version FROM catalog_manifests")}
+        changed = [d for d, stamp in current.items() if known.get(d, (None,))[0] != stamp]
+        removed = [d for d in known if d not in current]
+        self.stats["dirs"] = len(current)
+        self.stats["unchanged"] = len(current) - len(changed)
+        self.log(f"{len(current)} version directories, {len(changed)} new or changed, {len(removed)} removed "
+                 f"(scan {time.perf_counter() - started:.1f}s)")
+
+        touched = set()
+        if removed:
+            self._write(lambda: self._remove(removed, known, touched))
+        if changed:
+            chunks = [changed[i:i + self.chunk_size] for i in range(0, len(changed), self.chunk_size)]
+            pending = []
+            if self.workers > 1:
+                with ProcessPoolExecutor(self.workers) as pool:
+                    for results in pool.map(_read_chunk, [[os.path.join(self.root, d) for d in c] for c in chunks]):
+                        pending.extend(results)
+                        if len(pending) >= self.batch_size:
+                            self._write(lambda: self._apply(pending, current, known, touched))
+                            pending = []
+            else:
+                for chunk in chunks:
+                    pending.extend(_read_chunk([os.path.join(self.root, d) for d in chunk]))
+                    if len(pending) >= self.batch_size:
+                        self._write(lambda: self._apply(pending, current, known, touched))
+                        pending = []
+            if pending:
+                self._write(lambda: self._apply(pending, current, known, touched))
+        if touched:
+            self._write(lambda: self._update_catalog(touched))
+        self.stats["packages"] = len(touched)
+        self.stats["seconds"] = round(time.perf_counter() - started, 2)
+        return self.stats
+
+    def _write(self, fn):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            fn()
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _remove(self, dirs, known, touched):
+        gone = [(known[d][2], known[d][3]) for d in dirs if known[d][2]]
+        self.conn.executemany("DELETE FROM software_versions WHERE winget_id=? AND version=?", gone)
+        self.conn.executemany("DELETE FROM catalog_manifests WHERE dir=?", [(d,) for d in dirs])
+        touched.update(winget_id for winget_id, _ in gone)
+        self.stats["removed"] += len(dirs)
+
+    def _apply(self, results, current, known, touched):
+        manifests, versions, stale = [], [], []
+        for path, digest, manifest in results:
+            d = os.path.relpath(path, self.root)
+            old = known.get(d)
+            if digest is None:
+                # Vanished or unreadable since the scan; the next run sees it again
+                continue
+            if old and old[1] == digest:
+                # Touched but not modified (e.g. a fresh clone): only remember the new stamp
+                self.conn.execute("UPDATE catalog_manifests SET stamp=? WHERE dir=?", (current[d], d))
+                continue
+            self.stats["parsed"] += 1
+            if old and old[2] and (not manifest or (old[2], old[3]) != (manifest["winget_id"], manifest["version"])):
+                stale.append((old[2], old[3]))
+                touched.add(old[2])
+            if manifest is None:
+                self.stats["invalid"] += 1
+                manifests.append((d, current[d], digest, None, None))
+                continue
+            manifests.append((d, current[d], digest, manifest["winget_id"], manifest["version"]))
+            versions.append((manifest["winget_id"], manifest["version"], version_key(manifest["version"]),
+                             manifest["name"], manifest["moniker"], manifest["tags"]))
+            touched.add(manifest["winget_id"])
+        self.stats["read"] += len(results)
+        self.conn.executemany("DELETE FROM software_versions WHERE winget_id=? AND version=?", stale)
+        self.conn.executemany(
+            """INSERT INTO software_versions (winget_id, version, sort_key, package_name, moniker, tags)
+               VALUES (?,?,?,?,?,?)
+               ON CONFLICT (winget_id, version) DO UPDATE SET
+                   sort_key=excluded.sort_key, package_name=excluded.package_name,
+                   moniker=excluded.moniker, tags=excluded.tags""",
+            versions,
+        )
+        self.conn.executemany(
+            """INSERT INTO catalog_manifests (dir, stamp, digest, winget_id, version) VALUES (?,?,?,?,?)
+               ON CONFLICT (dir) DO UPDATE SET
+                   stamp=excluded.stamp, digest=excluded.digest, winget_id=excluded.winget_id, version=excluded.version""",
+            manifests,
+        )
+
+    def _update_catalog(self, touched):
+        """Point each touched package's catalog row at its newest version"""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS sync_touched (winget_id TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM sync_touched")
+        self.conn.executemany("INSERT OR IGNORE INTO sync_touched VALUES (?)", [(w,) for w in touched])
+        # SQLite returns the other columns of the row holding MAX(sort_key)
+        latest = {
+            winget_id: (version, name, moniker, tags)
+            for winget_id, version, name, moniker, tags, _ in self.conn.execute(
+                """SELECT v.winget_id, v.version, v.package_name, v.moniker, v.tags, MAX(v.sort_key)
+                   FROM software_versions v JOIN sync_touched t ON t.winget_id = v.winget_id
+                   GROUP BY v.winget_id"""
+            )
+        }
+        rows = {winget_id: (row_id, source) for row_id, winget_id, source in self.conn.execute(
+            "SELECT c.id, c.winget_id, c.source FROM software_catalog c JOIN sync_touched t ON t.winget_id = c.winget_id"
+        )}
+        names = {name for (name,) in self.conn.execute("SELECT software_name FROM software_catalog")}
+        updates, inserts, deletes = [], [], []
+        for winget_id in sorted(touched):
+            if winget_id not in latest:
+                if winget_id in rows and rows[winget_id][1] == "winget":
+                    deletes.append((rows[winget_id][0],))
+                continue
+            version, name, moniker, tags = latest[winget_id]
+            if winget_id in rows:
+                updates.append((version, moniker, tags, rows[winget_id][0]))
+                continue
+            # Requests refer to software by name, so names stay unique
+            if name in names:
+                name = f"{name} ({winget_id})"
+            names.add(name)
+            inserts.append((name, version, self.job_id, winget_id, moniker, tags))
+        self.conn.executemany(
+            """UPDATE software_catalog SET version=?,
+                   aliases=COALESCE(NULLIF(aliases, ''), ?), tags=COALESCE(NULLIF(tags, ''), ?)
+               WHERE id=?""",
+            updates,
+        )
+        self.conn.executemany(
+            """INSERT INTO software_catalog (software_name, version, rundeck_job_id, winget_id, aliases, tags, source)
+               VALUES (?,?,?,?,?,?, 'winget')""",
+            inserts,
+        )
+        self.conn.executemany("DELETE FROM software_catalog WHERE id=?", deletes)
+        self.log(f"Catalog: {len(inserts)} added, {len(updates)} updated, {len(deletes)} removed")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync software_catalog from a local winget-pkgs mirror")
+    parser.add_argument("root", help="winget-pkgs checkout or its manifests/ directory")
+    parser.add_argument("--db", default=os.getenv("BOT_DB_URL", os.getenv("BOT_DB_PATH", "software.db")),
+                        help="Bot database (BOT_DB_URL / BOT_DB_PATH)")
+    parser.add_argument("--job-id", default=os.getenv("RUNDECK_INSTALL_JOB_ID"),
+                        help="Rundeck job for new packages (RUNDECK_INSTALL_JOB_ID)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("CATALOG_SYNC_WORKERS", "0")) or None,
+                        help="Parser processes (default: one per CPU)")
+    parser.add_argument("--batch-size", type=int, default=2000, help="Version directories per transaction")
+    args = parser.parse_args(argv)
+    if not args.job_id:
+        parser.error("--job-id or RUNDECK_INSTALL_JOB_ID is required")
+    root = args.root
+    if os.path.isdir(os.path.join(root, "manifests")):
+        root = os.path.join(root, "manifests")
+    conn = open_database(args.db).connect()
+    try:
+        stats = CatalogSync(conn, root, args.job_id, args.workers, args.batch_size).run()
+    except RuntimeError as e:
+        sys.exit(str(e))
+    finally:
+        conn.close()
+    print(", ".join(f"{k}={v}" for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import os
+import time
+import asyncio
+import sqlite3
+import importlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from metrics import SQLITE_LOCK_WAIT, SQLITE_WRITE_SECONDS
+import tracing
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def connect(path):
+    """Open a SQLite connection with the bot's pragma settings"""
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class Database:
+    """Async access to SQLite without blocking the event loop.
+
+    Reads run on a dedicated reader thread and connection. Writes are queued
+    and applied by a single writer thread; writes that arrive while a commit
+    is in progress (or within ``commit_window`` seconds) share one transaction
+    and one fsync. Each write runs in its own savepoint so a failing statement
+    only fails its own caller. Several bot processes may share one database
+    file: ``BEGIN IMMEDIATE`` serializes their group commits and
+    ``busy_timeout`` makes a writer wait for the others.
+
+    This class is also the storage backend contract (see ``open_database``):
+    a replacement implements ``start``/``close``, ``fetchone``/``fetchall``/
+    ``read``, ``execute``/``transaction`` and a synchronous ``connect()``
+    for schema setup. The SQL is not abstracted: its connections must speak
+    SQLite itself (``?`` parameters, ``datetime('now')``/``julianday``,
+    triggers, ``PRAGMA table_info`` for migrations and ``BEGIN IMMEDIATE``
+    in ``catalog_sync.py``), so only SQLite-compatible servers can be
+    plugged in, not other SQL databases.
+    """
+
+    def __init__(self, path, commit_window=None, max_batch=None):
+        self.path = os.path.abspath(path)
+        self.commit_window = commit_window if commit_window is not None else \
+            float(os.getenv("DB_COMMIT_WINDOW_MS", "2")) / 1000
+        self.max_batch = max_batch or int(os.getenv("DB_MAX_BATCH", "256"))
+        self._reader = None
+        self._writer = None
+        self._read_executor = None
+        self._write_executor = None
+        self._queue = None
+        self._writer_task = None
+        self._starting = None
+        self.batches = 0
+        self.writes = 0
+
+    def connect(self):
+        """A new connection with the bot's settings (schema setup, one-off scripts)"""
+        return connect(self.path)
+
+    async def start(self, app=None):
+        """Open the persistent connections (aiohttp on_startup hook)"""
+        # Concurrent first calls (lazy start) share one opening
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._open())
+        await asyncio.shield(self._starting)
+
+    async def _open(self):
+        loop = asyncio.get_running_loop()
+        self._read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-read")
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+        self._reader = await loop.run_in_executor(self._read_executor, self.connect)
+        self._writer = await loop.run_in_executor(self._write_executor, self.connect)
+        self._queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._write_loop())
+
+    async def close(self, app=None):
+        """Flush pending writes and close the connections (aiohttp on_cleanup hook)"""
+        if self._writer_task is None:
+            return
+        await self._queue.put(None)
+        await self._writer_task
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._read_executor, self._reader.close)
+        await loop.run_in_executor(self._write_executor, self._writer.close)
+        self._read_executor.shutdown()
+        self._write_executor.shutdown()
+        self._writer_task = None
+        self._starting = None
+
+    # ---------- reads ----------
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def read(self, fn):
+        """Run ``fn(conn)`` on the reader thread; for multi-statement reads"""
+        if self._writer_task is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, fn, self._reader)
+
+    # ---------- writes ----------
+    async def execute(self, sql, params=()):
+        """Run one write statement; returns the cursor once committed"""
+        return await self.transaction(lambda conn: conn.execute(sql, params))
+
+    async def transaction(self, fn):
+        """Run ``fn(conn)`` atomically on the writer thread; returns its result once committed.
+
+        ``fn`` runs in a copy of the caller's context, so it sees the
+        caller's current trace span.
+        """
+        if self._writer_task is None:
+            await self.start()
+        with tracing.start_span("sqlite.transaction", child_only=True):
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((contextvars.copy_context().run, fn, future, time.perf_counter()))
+            return await future
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            if self.commit_window:
+                await asyncio.sleep(self.commit_window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                results = await loop.run_in_executor(self._write_executor, self._run_batch, [(run, fn) for run, fn, _, _ in batch])
+            except Exception as e:
+                results = [(False, e)] * len(batch)
+            committed = time.perf_counter()
+            for (_, _, future, queued), (ok, value) in zip(batch, results):
+                SQLITE_WRITE_SECONDS.observe(committed - queued)
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _run_batch(self, calls):
+        conn = self._writer
+        results = []
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        SQLITE_LOCK_WAIT.observe(time.perf_counter() - started)
+        try:
+            for run, fn in calls:
+                conn.execute("SAVEPOINT op")
+                try:
+                    value = run(fn, conn)
+                    conn.execute("RELEASE op")
+                    results.append((True, value))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    results.append((False, e))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        self.batches += 1
+        self.writes += len(calls)
+        return results
+
+
+BACKENDS = {"sqlite": Database}
+
+
+def open_database(url, backend=None):
+    """Storage backend for ``url``.
+
+    ``backend`` (``BOT_DB_BACKEND``) is ``sqlite`` (``url`` is a file path)
+    or ``package.module:Class`` for an out-of-tree backend that talks to a
+    networked SQLite-compatible server (the bot's SQL is SQLite's dialect);
+    the class is called with ``url``.
+    """
+    backend = backend or os.getenv("BOT_DB_BACKEND", "sqlite")
+    factory = BACKENDS.get(backend)
+    if factory is None:
+        module, _, name = backend.partition(":")
+        if not name:
+            raise ValueError(f"Unknown storage backend {backend!r} (expected 'sqlite' or 'module:Class')")
+        factory = BACKENDS[backend] = getattr(importlib.import_module(module), name)
+    return factory(url)
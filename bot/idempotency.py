@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import contextlib
+import tracing
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT PRIMARY KEY,
+        result TEXT,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    )
+"""
+INDEX = "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at)"
+
+
+def activity_key(action, user_id, activity):
+    """Idempotency key of a card submit.
+
+    Teams retries resend the same activity, and a double click sends a new
+    activity that replies to the same card with the same value, so the key
+    covers the card (``reply_to_id``, falling back to the activity id) and
+    the submitted value rather than the activity id alone.
+    """
+    conversation = activity.conversation.id if activity.conversation else ""
+    parts = [action, user_id, conversation, activity.reply_to_id or activity.id, activity.value]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def message_key(user_id, activity):
+    """Idempotency key of a text message that creates requests; None without an activity id.
+
+    A Teams retry resends the same activity id; a message typed again is a
+    new activity and a new request.
+    """
+    if not activity.id:
+        return None
+    conversation = activity.conversation.id if activity.conversation else ""
+    parts = ["message", user_id, conversation, activity.id]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Run an action at most once per key.
+
+    The first caller claims the key in ``idempotency_keys`` and stores the
+    action's (JSON-serializable) result; later callers within ``ttl``
+    seconds get the stored result instead. A duplicate that arrives while
+    the first call is still running in this process awaits that call; one
+    that reaches another bot worker meanwhile is refused by the claim and
+    reported without a result. A failed action releases its key so a retry
+    can run it again. Expired keys are swept in the background.
+    """
+
+    def __init__(self, db, ttl=None, sweep_interval=None):
+        self.db = db
+        self.ttl = ttl or float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+        self.sweep_interval = sweep_interval or float(os.getenv("IDEMPOTENCY_SWEEP_INTERVAL", "600"))
+        self._in_flight = {}
+        self._task = None
+        self.duplicates = 0
+
+    async def start(self, app=None):
+        """Start the expiry sweeper (aiohttp on_startup hook)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._sweep())
+
+    async def close(self, app=None):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def once(self, key, fn):
+        """Await ``fn()`` unless key was seen; returns (first, result)"""
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.duplicates += 1
+            return False, await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            if not await self._claim(key):
+                self.duplicates += 1
+                row = await self.db.fetchone("SELECT result FROM idempotency_keys WHERE key=?", (key,))
+                result = json.loads(row[0]) if row and row[0] else None
+                future.set_result(result)
+                return False, result
+            try:
+                result = await fn()
+            except BaseException:
+                await self.db.execute("DELETE FROM idempotency_keys WHERE key=?", (key,))
+                raise
+            await self.db.execute("UPDATE idempotency_keys SET result=? WHERE key=?", (json.dumps(result), key))
+            future.set_result(result)
+            return True, result
+        finally:
+            if not future.done():
+                # Duplicates waiting on a failed call see no result
+                future.set_result(None)
+            self._in_flight.pop(key, None)
+
+    async def _claim(self, key):
+        now = time.time()
+        # Inserts a new key or takes over an expired one; a live key changes nothing
+        claimed = await self.db.transaction(lambda conn: conn.execute(
+            """INSERT INTO idempotency_keys (key, created_at, expires_at) VALUES (?,?,?)
+               ON CONFLICT(key) DO UPDATE SET result=NULL, created_at=excluded.created_at, expires_at=excluded.expires_at
+               WHERE idempotency_keys.expires_at < excluded.created_at""",
+            (key, now, now + self.ttl),
+        ).rowcount)
+        return claimed > 0
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.db.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (time.time(),))
+            except Exception as e:
+                tracing.log(f"Idempotency key sweep failed: {e}")
+
+
+class KeyedLocks:
+    """asyncio locks per key (e.g. request id), dropped once nobody holds or waits for them"""
+
+    def __init__(self):
+        self._locks = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(key, None)
@@ -0,0 +1,172 @@
+import os
+import time
+import random
+import asyncio
+import traceback
+import tracing
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS install_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        request_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        run_after REAL NOT NULL DEFAULT 0,
+        lease_until REAL,
+        worker TEXT,
+        last_error TEXT,
+        traceparent TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        finished_at DATETIME
+    )
+"""
+INDEX = "CREATE INDEX IF NOT EXISTS idx_install_jobs_status ON install_jobs (status, run_after)"
+
+
+def enqueue(conn, request_id):
+    """Add a job inside an open write transaction; returns the job id. The job runs in the caller's trace"""
+    cur = conn.execute(
+        "INSERT INTO install_jobs (request_id, status, traceparent) VALUES (?, 'queued', ?)",
+        (request_id, tracing.traceparent()),
+    )
+    return cur.lastrowid
+
+
+class JobQueue:
+    """Durable install job queue drained by a bounded pool of async workers.
+
+    Jobs live in the ``install_jobs`` table, so queued work survives restarts.
+    A worker claims a job by taking a lease; a job whose lease expired (its
+    worker died mid-run) becomes claimable again. ``handler(job_id, request_id)``
+    does the actual work; if it raises, the job is retried with backoff up to
+    ``max_attempts`` times. An exception with a ``retry_after`` attribute
+    (an open circuit) requeues the job after that delay without using up an
+    attempt. When a job has used up its attempts (including leases that kept
+    expiring) it is marked failed and ``on_failed(job_id, request_id, error)``
+    lets the owner bring the request to a final state.
+    """
+
+    def __init__(self, db, handler, workers=None, poll_interval=None, lease_seconds=None, max_attempts=None,
+                 on_failed=None):
+        self.db = db
+        self.handler = handler
+        self.on_failed = on_failed
+        self.workers = workers or int(os.getenv("INSTALL_WORKERS", "8"))
+        self.poll_interval = poll_interval or float(os.getenv("INSTALL_POLL_INTERVAL", "5"))
+        self.lease_seconds = lease_seconds or float(os.getenv("INSTALL_LEASE_SECONDS", "300"))
+        self.max_attempts = max_attempts or int(os.getenv("INSTALL_MAX_ATTEMPTS", "3"))
+        self.worker_id = None
+        self._wake = asyncio.Event()
+        self._tasks = []
+
+    async def start(self, app=None):
+        """Spawn the worker pool (aiohttp on_startup hook)"""
+        if self._tasks:
+            return
+        # Taken here, not in __init__, so each forked bot worker gets its own id
+        self.worker_id = f"pid{os.getpid()}"
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+
+    async def close(self, app=None):
+        """Stop the workers (aiohttp on_cleanup hook); running jobs are picked up again after their lease expires"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers after a job was enqueued"""
+        self._wake.set()
+
+    async def _claim(self):
+        now = time.time()
+        lease_until = now + self.lease_seconds
+        worker_id = self.worker_id
+
+        def claim(conn):
+            return conn.execute(
+                """
+                UPDATE install_jobs
+                SET status='running', attempts=attempts+1, lease_until=?, worker=?
+                WHERE id = (
+                    SELECT id FROM install_jobs
+                    WHERE (status='queued' AND run_after<=?) OR (status='running' AND lease_until<?)
+                    ORDER BY id LIMIT 1
+                )
+                RETURNING id, request_id, attempts, traceparent
+                """,
+                (lease_until, worker_id, now, now),
+            ).fetchone()
+
+        return await self.db.transaction(claim)
+
+    async def _finish(self, job_id, status, error=None):
+        await self.db.execute(
+            "UPDATE install_jobs SET status=?, last_error=?, lease_until=NULL, finished_at=CURRENT_TIMESTAMP WHERE id=?",
+            (status, error, job_id),
+        )
+
+    async def _fail(self, job_id, request_id, error):
+        await self._finish(job_id, "failed", error)
+        if self.on_failed is None:
+            return
+        try:
+            await self.on_failed(job_id, request_id, error)
+        except Exception as e:
+            tracing.log(f"Install job {job_id}: failure hook failed: {e}")
+
+    async def _retry(self, job_id, request_id, attempts, error):
+        if attempts >= self.max_attempts:
+            await self._fail(job_id, request_id, error)
+            return
+        run_after = time.time() + min(60, 2 ** attempts)
+        await self.db.execute(
+            "UPDATE install_jobs SET status='queued', run_after=?, last_error=?, lease_until=NULL WHERE id=?",
+            (run_after, error, job_id),
+        )
+
+    async def _defer(self, job_id, delay, error):
+        await self.db.execute(
+            "UPDATE install_jobs SET status='queued', attempts=attempts-1, run_after=?, last_error=?, lease_until=NULL WHERE id=?",
+            (time.time() + delay + random.uniform(0, 1), error, job_id),
+        )
+
+    async def _worker(self, n):
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                tracing.log(f"Install worker {n}: claim failed: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+
+            job_id, request_id, attempts, traceparent = job
+            with tracing.start_span("install_job", parent=traceparent, kind="consumer",
+                                    job_id=job_id, request_id=request_id, attempt=attempts):
+                await self._run_job(job_id, request_id, attempts)
+
+    async def _run_job(self, job_id, request_id, attempts):
+        if attempts > self.max_attempts:
+            # Every earlier attempt lost its lease (the worker died mid-run)
+            await self._fail(job_id, request_id, f"Lease expired {attempts - 1} times")
+            return
+        try:
+            await self.handler(job_id, request_id)
+            await self._finish(job_id, "done")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            tracing.current_span().set_error(e)
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None:
+                # Upstream refused the call locally (open circuit); not the job's fault
+                await self._defer(job_id, retry_after, str(e))
+                return
+            traceback.print_exc()
+            await self._retry(job_id, request_id, attempts, str(e))
@@ -0,0 +1,95 @@
+import os
+import hmac
+import zlib
+import hashlib
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS request_logs (
+        request_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        start INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (request_id, seq)
+    )
+"""
+
+MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(1024 * 1024)))
+CHUNK_BYTES = int(os.getenv("LOG_CHUNK_BYTES", str(64 * 1024)))
+SUMMARY_LINES = int(os.getenv("LOG_SUMMARY_LINES", "15"))
+SUMMARY_CHARS = int(os.getenv("LOG_SUMMARY_CHARS", "1500"))
+
+
+def store(conn, request_id, text):
+    """Replace a request's log inside an open write transaction.
+
+    The log is kept out of ``user_requests`` in zlib-compressed chunks of
+    ``LOG_CHUNK_BYTES``. Beyond ``LOG_MAX_BYTES`` only the end is kept (the
+    part that says why an install failed); chunk offsets stay those of the
+    full log, so readers can tell what was dropped. Returns the full size.
+    """
+    data = (text or "").encode("utf-8")
+    total = len(data)
+    start = max(0, total - MAX_BYTES)
+    conn.execute("DELETE FROM request_logs WHERE request_id=?", (request_id,))
+    conn.executemany(
+        "INSERT INTO request_logs (request_id, seq, start, size, data) VALUES (?,?,?,?,?)",
+        [
+            (request_id, seq, offset, len(chunk), zlib.compress(chunk, 6))
+            for seq, offset in enumerate(range(start, total, CHUNK_BYTES))
+            for chunk in (data[offset:offset + CHUNK_BYTES],)
+        ],
+    )
+    return total
+
+
+def read(conn, request_id, offset=0, limit=None):
+    """(bytes from ``offset``, next offset, first stored offset); (b"", offset, 0) without a log.
+
+    Offsets are byte positions in the full log; reads start at the first
+    kept byte when the head was dropped by the size cap.
+    """
+    rows = conn.execute(
+        "SELECT start, size, data FROM request_logs WHERE request_id=? AND start + size > ? ORDER BY seq",
+        (request_id, offset),
+    ).fetchall()
+    first = conn.execute("SELECT MIN(start) FROM request_logs WHERE request_id=?", (request_id,)).fetchone()[0]
+    if first is None:
+        return b"", offset, 0
+    offset = max(offset, first)
+    parts = []
+    taken = 0
+    for start, size, data in rows:
+        chunk = zlib.decompress(data)[max(0, offset - start):]
+        if limit is not None and taken + len(chunk) > limit:
+            chunk = chunk[:limit - taken]
+        parts.append(chunk)
+        taken += len(chunk)
+        if limit is not None and taken >= limit:
+            break
+    return b"".join(parts), offset + taken, first
+
+
+def summary(text, lines=None, chars=None):
+    """Last lines of a log for chat messages and ticket comments"""
+    lines = lines or SUMMARY_LINES
+    chars = chars or SUMMARY_CHARS
+    kept = (text or "").rstrip("\n").split("\n")
+    tail = "\n".join(kept[-lines:])
+    if len(tail) > chars:
+        tail = "…" + tail[-chars:]
+    elif len(kept) > lines:
+        tail = f"… ({len(kept) - lines} earlier lines)\n" + tail
+    return tail
+
+
+def sign(secret, request_id):
+    """Signature that lets a log link open without the API token; None without a secret"""
+    if not secret:
+        return None
+    return hmac.new(secret.encode(), f"logs:{request_id}".encode(), hashlib.sha256).hexdigest()
+
+
+def verify(secret, request_id, sig):
+    expected = sign(secret, request_id)
+    return bool(expected and sig) and hmac.compare_digest(sig, expected)
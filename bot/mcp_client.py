@@ -0,0 +1,156 @@
+import os
+import time
+import aiohttp
+from resilience import Bulkhead, CircuitBreaker, Unavailable
+from metrics import UPSTREAM_SECONDS
+import tracing
+
+
+class MCPClient:
+    """Long-lived, pooled HTTP client for calls from the bot to the MCP server.
+
+    Calls name the upstream behind the MCP endpoint (ServiceNow, Rundeck);
+    each upstream gets its own circuit breaker and bulkhead, so an outage of
+    one fails fast with ``Unavailable`` and does not hold up the other.
+    """
+
+    def __init__(self, base_url, limit=None, limit_per_host=None, keepalive_timeout=None,
+                 connect_timeout=None, read_timeout=None):
+        self.base_url = base_url.rstrip("/")
+        self.limit = limit or int(os.getenv("MCP_POOL_LIMIT", "100"))
+        self.limit_per_host = limit_per_host or int(os.getenv("MCP_POOL_LIMIT_PER_HOST", "50"))
+        self.keepalive_timeout = keepalive_timeout or float(os.getenv("MCP_KEEPALIVE_TIMEOUT", "30"))
+        self.connect_timeout = connect_timeout or float(os.getenv("MCP_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = read_timeout or float(os.getenv("MCP_READ_TIMEOUT", "30"))
+        self._connector = None
+        self._session = None
+        self._requests = 0
+        self._errors = 0
+        self._in_flight = 0
+        self._total_latency = 0.0
+        self.breakers = {}
+        self.bulkheads = {}
+
+    async def start(self, app=None):
+        """Open the pooled session (aiohttp on_startup hook)"""
+        if self._session is not None:
+            return
+        self._connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=self._connector,
+            timeout=timeout,
+        )
+
+    async def close(self, app=None):
+        """Close the pooled session (aiohttp on_cleanup hook)"""
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
+        self._connector = None
+
+    def _guards(self, upstream):
+        if upstream not in self.breakers:
+            self.breakers[upstream] = CircuitBreaker(upstream)
+            self.bulkheads[upstream] = Bulkhead(upstream)
+        return self.breakers[upstream], self.bulkheads[upstream]
+
+    async def post_json(self, path, data, upstream="mcp"):
+        """POST a JSON body to the MCP server and return (status, json_body).
+
+        Raises ``Unavailable`` without sending anything while the upstream's
+        circuit is open or its bulkhead is full, and when the MCP server
+        reports the upstream unavailable (503 with a retry hint). The call
+        is traced and carries the trace context in a ``traceparent`` header.
+        """
+        with tracing.start_span(f"POST {path}", kind="client", upstream=upstream) as span:
+            status, body = await self._request_json("POST", path, upstream, json=data)
+            span.set_attribute("http.status_code", status)
+            return status, body
+
+    async def get_json(self, path, params=None, upstream="mcp", route=None):
+        """GET from the MCP server and return (status, json_body); same guards as ``post_json``.
+
+        ``route`` names the endpoint in metrics and spans when ``path`` has IDs in it.
+        """
+        with tracing.start_span(f"GET {route or path}", kind="client", upstream=upstream) as span:
+            status, body = await self._request_json("GET", path, upstream, route=route, params=params)
+            span.set_attribute("http.status_code", status)
+            return status, body
+
+    async def _request_json(self, method, path, upstream, route=None, **kwargs):
+        label = route or path
+        if self._session is None:
+            await self.start()
+        breaker, bulkhead = self._guards(upstream)
+        try:
+            breaker.before_call()
+        except Unavailable:
+            UPSTREAM_SECONDS.labels(upstream, label, "circuit_open").observe(0)
+            raise
+        success = None
+        outcome = "bulkhead_full"
+        started = time.perf_counter()
+        try:
+            async with bulkhead:
+                success = False
+                outcome = "error"
+                self._requests += 1
+                self._in_flight += 1
+                try:
+                    async with self._session.request(
+                        method, f"{self.base_url}{path}", headers=tracing.inject(), **kwargs
+                    ) as response:
+                        try:
+                            body = await response.json(content_type=None)
+                        except ValueError:
+                            body = None
+                        if response.status >= 500:
+                            self._errors += 1
+                        success = response.status < 500 and response.status != 429
+                        outcome = str(response.status)
+                except Exception:
+                    self._errors += 1
+                    raise
+                finally:
+                    self._in_flight -= 1
+                    self._total_latency += time.perf_counter() - started
+        finally:
+            UPSTREAM_SECONDS.labels(upstream, label, outcome).observe(time.perf_counter() - started)
+            if success is None:
+                # Refused by the bulkhead; the upstream was never called
+                breaker.cancel()
+            else:
+                breaker.record(success)
+        if response.status == 503 and isinstance(body, dict) and body.get("retry_after"):
+            raise Unavailable(body.get("error") or f"{upstream} unavailable", float(body["retry_after"]))
+        return response.status, body
+
+    def stats(self):
+        """Pool usage statistics"""
+        connector = self._connector
+        acquired = len(connector._acquired) if connector is not None else 0
+        idle = sum(len(conns) for conns in connector._conns.values()) if connector is not None else 0
+        return {
+            "base_url": self.base_url,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "connections_in_use": acquired,
+            "connections_idle": idle,
+            "requests_in_flight": self._in_flight,
+            "requests_total": self._requests,
+            "errors_total": self._errors,
+            "avg_latency_ms": round(self._total_latency / self._requests * 1000, 2) if self._requests else 0.0,
+            "upstreams": {
+                name: {"circuit": self.breakers[name].stats(), "bulkhead": self.bulkheads[name].stats()}
+                for name in self.breakers
+            },
+        }
@@ -0,0 +1,147 @@
+import os
+import time
+import asyncio
+from prometheus_client import (
+    Counter, Histogram, REGISTRY, CollectorRegistry, generate_latest, multiprocess, CONTENT_TYPE_LATEST,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# Set with several bot workers so counters and histograms are summed across them
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+_GAUGES = []
+
+# Stages of one request: logged -> ticket -> decision -> dispatched -> finished
+STAGE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600, 4 * 3600, 24 * 3600)
+STAGE_SECONDS = Histogram(
+    "bot_stage_seconds",
+    "Latency of request workflow stages (db_insert, ticket_create, approval_wait, job_dispatch, job_completion)",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+UPSTREAM_SECONDS = Histogram(
+    "bot_upstream_request_seconds",
+    "Bot -> MCP server call latency by upstream behind it and outcome",
+    ["upstream", "path", "outcome"],
+)
+REQUEST_TRANSITIONS = Counter("bot_request_transitions_total", "Request status changes", ["status"])
+CARD_ACTIONS = Counter("bot_card_actions_total", "Adaptive Card submits", ["action", "outcome"])
+POLICY_DECISIONS = Counter(
+    "bot_policy_decisions_total", "Approval policy outcome per logged request (approved, over_quota, manual)", ["decision"]
+)
+REQUESTS_ARCHIVED = Counter("bot_requests_archived_total", "Closed requests moved to the archive files")
+CONNECTOR_CALLS = Counter("bot_connector_calls_total", "Bot Connector calls (send: new message, update: card edited in place)", ["kind"])
+LOOP_LAG = Histogram(
+    "bot_event_loop_lag_seconds",
+    "Delay of a timer on the event loop beyond its due time",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+SQLITE_LOCK_WAIT = Histogram(
+    "bot_sqlite_lock_wait_seconds",
+    "Time spent acquiring the SQLite write lock (BEGIN IMMEDIATE) per group commit",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+SQLITE_WRITE_SECONDS = Histogram(
+    "bot_sqlite_write_seconds",
+    "Time from queueing a write to its group commit",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+
+class _Timer:
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGE_SECONDS.labels(self.stage).observe(time.perf_counter() - self.started)
+
+
+def stage_timer(stage):
+    """``with stage_timer("db_insert"): ...`` records the block's duration"""
+    return _Timer(stage)
+
+
+def observe_stage(stage, seconds):
+    if seconds is not None and seconds >= 0:
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+class GaugeCollector:
+    """Exposes gauges computed at scrape time from in-process state.
+
+    ``fn()`` yields ``(name, help, labels, value)`` tuples; samples with the
+    same name are grouped into one metric family. With several workers the
+    gauges describe the worker that served the scrape and carry its pid.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def collect(self):
+        families = {}
+        for name, doc, labels, value in self.fn():
+            if MULTIPROC_DIR:
+                labels = dict(labels, pid=os.getpid())
+            family = families.get(name)
+            if family is None:
+                family = families[name] = GaugeMetricFamily(name, doc, labels=sorted(labels))
+            family.add_metric([str(labels[k]) for k in sorted(labels)], value)
+        return list(families.values())
+
+
+def register_gauges(fn):
+    collector = GaugeCollector(fn)
+    _GAUGES.append(collector)
+    REGISTRY.register(collector)
+
+
+def render():
+    """(body, content type) of the Prometheus text exposition"""
+    if not MULTIPROC_DIR:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in _GAUGES:
+        registry.register(collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def reset_multiprocess():
+    """Drop metric files of a previous run (called by the worker master before forking)"""
+    if MULTIPROC_DIR and os.path.isdir(MULTIPROC_DIR):
+        for name in os.listdir(MULTIPROC_DIR):
+            if name.endswith(".db"):
+                os.remove(os.path.join(MULTIPROC_DIR, name))
+
+
+def mark_process_dead(pid):
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
+
+
+class LoopLagMonitor:
+    """Samples event-loop lag: how late a ``sleep(interval)`` wakes up"""
+
+    def __init__(self, interval=None):
+        self.interval = interval or float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+        self._task = None
+
+    async def start(self, app=None):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, app=None):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            due = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            LOOP_LAG.observe(max(0.0, loop.time() - due))
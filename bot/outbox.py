@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import random
+import asyncio
+import traceback
+import tracing
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        request_id INTEGER,
+        payload TEXT NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        lease_until REAL,
+        last_error TEXT,
+        traceparent TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)",
+    "CREATE INDEX IF NOT EXISTS idx_outbox_request ON outbox (request_id, id)",
+)
+
+
+def add(conn, kind, request_id, **payload):
+    """Record a side effect inside an open write transaction; it runs in the caller's trace"""
+    conn.execute(
+        "INSERT INTO outbox (kind, request_id, payload, traceparent) VALUES (?,?,?,?)",
+        (kind, request_id, json.dumps(payload), tracing.traceparent()),
+    )
+
+
+class OutboxDispatcher:
+    """Drains the ``outbox`` table and performs the recorded side effects.
+
+    Rows are written in the same transaction as the ``user_requests`` change
+    that caused them, so a side effect is never lost or issued for a change
+    that was rolled back. Rows of one request run strictly in order; rows of
+    different requests run concurrently, at most ``max_in_flight`` at a time.
+    A handler signals failure by raising. The row is then retried with
+    exponential backoff and jitter, and after ``max_attempts`` it is marked
+    ``dead`` and left in the table for inspection. An exception carrying a
+    ``retry_after`` attribute (an open circuit, a full bulkhead) defers the
+    row by that many seconds without using up an attempt.
+    """
+
+    def __init__(self, db, handlers, max_in_flight=None, base_delay=None, max_delay=None,
+                 max_attempts=None, lease_seconds=None, poll_interval=None):
+        self.db = db
+        self.handlers = handlers
+        self.max_in_flight = max_in_flight or int(os.getenv("OUTBOX_MAX_IN_FLIGHT", "32"))
+        self.base_delay = base_delay or float(os.getenv("OUTBOX_BASE_DELAY", "1"))
+        self.max_delay = max_delay or float(os.getenv("OUTBOX_MAX_DELAY", "300"))
+        self.max_attempts = max_attempts or int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+        self.lease_seconds = lease_seconds or float(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+        self.poll_interval = poll_interval or float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+        self._wake = asyncio.Event()
+        self._task = None
+        self._in_flight = set()
+
+    async def start(self, app=None):
+        """Start draining (aiohttp on_startup hook)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, app=None):
+        """Stop draining (aiohttp on_cleanup hook); leased rows are retried after restart"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    def notify(self):
+        """Wake the dispatcher after rows were added"""
+        self._wake.set()
+
+    def backoff(self, attempts):
+        """Exponential backoff with equal jitter"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _claim(self, limit):
+        now = time.time()
+        lease_until = now + self.lease_seconds
+
+        def claim(conn):
+            rows = conn.execute(
+                """
+                SELECT id, kind, request_id, payload, attempts, traceparent FROM outbox o
+                WHERE ((status='pending' AND next_attempt_at<=?) OR (status='in_flight' AND lease_until<?))
+                  AND NOT EXISTS (
+                      SELECT 1 FROM outbox p
+                      WHERE p.request_id = o.request_id AND p.id < o.id AND p.status IN ('pending', 'in_flight')
+                  )
+                ORDER BY id LIMIT ?
+                """,
+                (now, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET status='in_flight', lease_until=?, attempts=attempts+1 WHERE id=?",
+                [(lease_until, row[0]) for row in rows],
+            )
+            return rows
+
+        return await self.db.transaction(claim)
+
+    async def _next_due_in(self):
+        row = await self.db.fetchone("SELECT MIN(next_attempt_at) FROM outbox WHERE status='pending'")
+        if not row or row[0] is None:
+            return self.poll_interval
+        return max(0.0, min(self.poll_interval, row[0] - time.time()))
+
+    async def _run(self):
+        while True:
+            # Cleared before claiming so a notify() that races the claim is not lost
+            self._wake.clear()
+            free = self.max_in_flight - len(self._in_flight)
+            rows = []
+            if free > 0:
+                try:
+                    rows = await self._claim(free)
+                except Exception as e:
+                    tracing.log(f"Outbox claim failed: {e}")
+            for row in rows:
+                task = asyncio.create_task(self._dispatch(*row))
+                self._in_flight.add(task)
+                task.add_done_callback(self._done)
+            if rows and len(rows) == free:
+                # Saturated: wait for a slot to free up
+                await self._wake.wait()
+            elif not rows:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), await self._next_due_in())
+                except asyncio.TimeoutError:
+                    pass
+
+    def _done(self, task):
+        self._in_flight.discard(task)
+        self._wake.set()
+
+    async def _dispatch(self, row_id, kind, request_id, payload, attempts, traceparent):
+        with tracing.start_span(f"outbox {kind}", parent=traceparent, kind="consumer",
+                                request_id=request_id, attempt=attempts + 1):
+            await self._handle(row_id, kind, request_id, payload, attempts)
+
+    async def _handle(self, row_id, kind, request_id, payload, attempts):
+        attempts += 1
+        handler = self.handlers.get(kind)
+        try:
+            if handler is None:
+                raise ValueError(f"No outbox handler for {kind!r}")
+            await handler(request_id, **json.loads(payload))
+        except Exception as e:
+            tracing.current_span().set_error(e)
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None and handler is not None:
+                await self.db.execute(
+                    "UPDATE outbox SET status='pending', lease_until=NULL, attempts=attempts-1, next_attempt_at=?, last_error=? WHERE id=?",
+                    (time.time() + retry_after + random.uniform(0, 1), str(e), row_id),
+                )
+                return
+            if attempts >= self.max_attempts or handler is None:
+                traceback.print_exc()
+                await self.db.execute(
+                    "UPDATE outbox SET status='dead', lease_until=NULL, last_error=? WHERE id=?",
+                    (str(e), row_id),
+                )
+            else:
+                await self.db.execute(
+                    "UPDATE outbox SET status='pending', lease_until=NULL, next_attempt_at=?, last_error=? WHERE id=?",
+                    (time.time() + self.backoff(attempts), str(e), row_id),
+                )
+            return
+        await self.db.execute("DELETE FROM outbox WHERE id=?", (row_id,))
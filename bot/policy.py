@@ -0,0 +1,181 @@
+import os
+import json
+import asyncio
+from collections import namedtuple
+import tracing
+
+# A compiled rule; ``versions`` is "catalog", "any" or a frozenset, ``quota`` is (max requests, hours) or None
+Rule = namedtuple("Rule", "name approve tags software users versions quota")
+
+
+def compile_rules(config):
+    """Rules from the policy config, in evaluation order (first match wins).
+
+    ``{"groups": {"developers": ["user-id", ...]}, "rules": [{"name": "browsers",
+    "tags": ["browser"], "groups": ["developers"], "versions": "catalog",
+    "quota": {"max": 3, "hours": 24}}]}``. A rule matches when every given
+    condition does: ``tags`` (any catalog tag), ``software`` (names or winget
+    IDs), ``users`` / ``groups`` (``"*"`` for everyone). ``versions`` is
+    "catalog" (only the catalog's pinned version, the default), "any" or a
+    list. ``"decision": "manual"`` rules send matching requests to a person.
+    Raises ValueError on a malformed config.
+    """
+    if not isinstance(config, dict):
+        raise ValueError("policy must be a JSON object")
+    raw_groups = config.get("groups") or {}
+    if not isinstance(raw_groups, dict):
+        raise ValueError("groups must be an object of member lists")
+    groups = {name: frozenset(string_list(members, f"group {name}")) for name, members in raw_groups.items()}
+    raw_rules = config.get("rules") or []
+    if not isinstance(raw_rules, list):
+        raise ValueError("rules must be a list")
+    rules = []
+    for n, raw in enumerate(raw_rules):
+        if not isinstance(raw, dict):
+            raise ValueError(f"rule-{n + 1}: must be an object")
+        name = raw.get("name") or f"rule-{n + 1}"
+        for key in ("tags", "software", "users", "groups"):
+            if raw.get(key) is not None:
+                string_list(raw[key], f"{name}: {key}")
+        decision = raw.get("decision", "approve")
+        if decision not in ("approve", "manual"):
+            raise ValueError(f"{name}: decision must be approve or manual")
+        members = None
+        if raw.get("groups") is not None and "*" not in raw["groups"]:
+            unknown = [g for g in raw["groups"] if g not in groups]
+            if unknown:
+                raise ValueError(f"{name}: unknown groups {', '.join(unknown)}")
+            members = frozenset().union(*(groups[g] for g in raw["groups"]))
+        if raw.get("users") is not None and "*" not in raw["users"]:
+            members = (members or frozenset()) | frozenset(raw["users"])
+        versions = raw.get("versions", "catalog")
+        if isinstance(versions, list):
+            versions = frozenset(str(v).lstrip("v") for v in versions)
+        elif versions not in ("catalog", "any"):
+            raise ValueError(f"{name}: versions must be catalog, any or a list")
+        quota = raw.get("quota")
+        if quota is not None:
+            if not isinstance(quota, dict):
+                raise ValueError(f"{name}: quota must be an object with max and hours")
+            quota = (int(quota["max"]), float(quota.get("hours", 24)))
+        rules.append(Rule(
+            name=name,
+            approve=decision == "approve",
+            tags=frozenset(t.lower() for t in raw["tags"]) if raw.get("tags") else None,
+            software=frozenset(raw["software"]) if raw.get("software") else None,
+            users=members,
+            versions=versions,
+            quota=quota,
+        ))
+    return rules
+
+
+def string_list(value, what):
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"{what} must be a list of strings")
+    return value
+
+
+def rule_matches(rule, user_id, entry, version):
+    if rule.users is not None and user_id not in rule.users:
+        return False
+    if rule.tags is not None and not rule.tags & entry.tags:
+        return False
+    if rule.software is not None and entry.software_name not in rule.software and entry.winget_id not in rule.software:
+        return False
+    if rule.versions == "catalog":
+        return version == entry.version
+    return rule.versions == "any" or version in rule.versions
+
+
+class ApprovalPolicy:
+    """Auto-approval rules, compiled from ``APPROVAL_POLICY_FILE`` (JSON) and kept in memory.
+
+    ``candidates`` is evaluated on the turn path without I/O. A background
+    task checks the file's mtime every ``refresh_interval`` seconds and
+    swaps in the recompiled rules; a broken file keeps the previous rules.
+    Without a file every request waits for a person.
+    """
+
+    def __init__(self, path=None, refresh_interval=None):
+        self.path = path or os.getenv("APPROVAL_POLICY_FILE", "approval_policy.json")
+        self.refresh_interval = refresh_interval or float(os.getenv("POLICY_REFRESH_INTERVAL", "5"))
+        self.rules = []
+        self.mtime = None
+        self._task = None
+
+    async def start(self, app=None):
+        """Load the rules and start watching the file (aiohttp on_startup hook)"""
+        self.reload()
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def close(self, app=None):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def reload(self):
+        """Recompile if the file changed; returns True when the rules were replaced"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.mtime:
+            return False
+        try:
+            if mtime is None:
+                rules = []
+            else:
+                with open(self.path, encoding="utf-8") as f:
+                    rules = compile_rules(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            tracing.log(f"Approval policy {self.path} not loaded, keeping {len(self.rules)} rules: {e}")
+            self.mtime = mtime
+            return False
+        self.rules = rules
+        self.mtime = mtime
+        tracing.log(f"Approval policy: {len(rules)} rules from {self.path if mtime else '(no file)'}")
+        return True
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                # Never let a bad file stop the watcher; the previous rules stay in force
+                tracing.log(f"Approval policy reload failed: {e}")
+
+    def candidates(self, user_id, entries, versions):
+        """Approve rules that cover every entry, in order, up to the first manual rule.
+
+        The caller picks the first whose quota the user still has (see
+        ``quota_available``). Entries must all match the same rule, so a
+        bundle is auto-approved only when one rule covers all its packages.
+        """
+        found = []
+        for rule in self.rules:
+            if all(rule_matches(rule, user_id, e, v) for e, v in zip(entries, versions)):
+                if not rule.approve:
+                    break
+                found.append(rule)
+        return found
+
+
+def approver(rule):
+    """``approved_by`` of requests a rule approved"""
+    return f"policy:{rule.name}"
+
+
+def quota_available(conn, user_id, rule):
+    """Whether the user is under the rule's auto-approval quota (run in the insert transaction)"""
+    if rule.quota is None:
+        return True
+    limit, hours = rule.quota
+    used = conn.execute(
+        "SELECT COUNT(*) FROM user_requests WHERE user_id=? AND requested_at >= datetime('now', ?) AND approved_by=?",
+        (user_id, f"-{hours} hours", approver(rule)),
+    ).fetchone()[0]
+    return used < limit
@@ -0,0 +1,122 @@
+import os
+import asyncio
+from botbuilder.schema import ActivityTypes
+import metrics
+import tracing
+
+CARD_UPDATE_WINDOW = float(os.getenv("CARD_UPDATE_WINDOW", "0.5"))
+
+
+def _plain_text(activity):
+    return (
+        activity.type in (None, ActivityTypes.message)
+        and activity.text
+        and not activity.attachments
+        and not activity.suggested_actions
+    )
+
+
+def merge(items):
+    """Fold plain-text messages into the message that follows them.
+
+    ``items`` are ``(activity, on_sent)`` pairs. The adapter makes one
+    Connector call per activity, so "text, text, card" becomes a single
+    card message with the texts above it. Tracked activities (with an
+    ``on_sent`` callback) are updated in place later and are never merged.
+    """
+    merged = []
+    for activity, on_sent in items:
+        if merged:
+            previous, previous_on_sent = merged[-1]
+            if previous_on_sent is None and on_sent is None and _plain_text(previous) and activity.type in (None, ActivityTypes.message):
+                activity.text = previous.text + ("\n\n" + activity.text if activity.text else "")
+                merged[-1] = (activity, None)
+                continue
+        merged.append((activity, on_sent))
+    return merged
+
+
+class ReplyBuffer:
+    """Holds a turn's replies and sends them with one ``send_activities`` call.
+
+    Registered as the turn's send handler, it takes the activities out of
+    every ``send_activity`` during the turn (the caller gets no resource
+    id back); ``flush`` at the end of the turn merges and sends them.
+    ``track`` queues an activity whose Connector id is needed afterwards,
+    e.g. a status card that is later updated in place.
+    """
+
+    def __init__(self, turn_context):
+        self.turn_context = turn_context
+        self.pending = []
+        self.flushing = False
+        turn_context.turn_state[ReplyBuffer] = self
+        turn_context.on_send_activities(self._on_send)
+
+    @staticmethod
+    def of(turn_context):
+        return turn_context.turn_state.get(ReplyBuffer)
+
+    async def _on_send(self, turn_context, activities, next_send):
+        if not self.flushing:
+            self.pending.extend((activity, None) for activity in activities)
+            # Handlers can't short-circuit the send; an empty list makes the adapter call a no-op
+            activities.clear()
+        await next_send()
+
+    def track(self, activity, on_sent):
+        """Queue ``activity``; ``await on_sent(activity_id)`` runs once it is sent"""
+        self.pending.append((activity, on_sent))
+
+    async def flush(self):
+        if not self.pending:
+            return
+        items, self.pending = merge(self.pending), []
+        self.flushing = True
+        try:
+            responses = await self.turn_context.send_activities([activity for activity, _ in items])
+        finally:
+            self.flushing = False
+        metrics.CONNECTOR_CALLS.labels("send").inc(len(items))
+        for (_, on_sent), response in zip(items, responses or []):
+            if on_sent is not None and response is not None and response.id:
+                await on_sent(response.id)
+
+
+class CardUpdater:
+    """Coalesces in-place refreshes of request status cards.
+
+    ``refresh(req_id)`` calls ``update(req_id)`` after ``CARD_UPDATE_WINDOW``
+    seconds; refreshes of the same request in that window ride along, so
+    status changes in quick succession (queued, then started) cost one
+    Connector call. ``update`` renders the card from the database when it
+    runs, so whichever worker updates last shows the current state.
+    """
+
+    def __init__(self, update, window=None):
+        self.update = update
+        self.window = CARD_UPDATE_WINDOW if window is None else window
+        self.pending = {}
+
+    def refresh(self, req_id):
+        if req_id not in self.pending:
+            self.pending[req_id] = asyncio.create_task(self._run(req_id))
+
+    async def _run(self, req_id):
+        await asyncio.sleep(self.window)
+        self.pending.pop(req_id, None)
+        await self._update(req_id)
+
+    async def _update(self, req_id):
+        try:
+            await self.update(req_id)
+        except Exception as e:
+            tracing.log(f"Could not refresh the card of request {req_id}: {e}")
+
+    async def close(self, app=None):
+        """Send refreshes still waiting out the window (aiohttp on_cleanup hook)"""
+        req_ids = list(self.pending)
+        for task in self.pending.values():
+            task.cancel()
+        self.pending.clear()
+        await asyncio.gather(*(self._update(req_id) for req_id in req_ids))
@@ -0,0 +1,336 @@
+import os
+import sys
+import glob
+import gzip
+import json
+import asyncio
+import argparse
+import datetime
+import logstore
+import metrics
+import tracing
+
+# Daily rollups, kept up to date by triggers in the same transaction as the request change
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS report_daily (
+        day TEXT PRIMARY KEY,
+        requested INTEGER NOT NULL DEFAULT 0,
+        approved INTEGER NOT NULL DEFAULT 0,
+        auto_approved INTEGER NOT NULL DEFAULT 0,
+        rejected INTEGER NOT NULL DEFAULT 0,
+        installed INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        decision_seconds REAL NOT NULL DEFAULT 0,
+        decision_seconds_max REAL NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS report_installs_daily (
+        day TEXT NOT NULL,
+        software_name TEXT NOT NULL,
+        installed INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, software_name)
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS report_request_ins AFTER INSERT ON user_requests
+    BEGIN
+        INSERT INTO report_daily (day, requested, approved, auto_approved)
+        VALUES (date('now'), 1, NEW.status = 'approved', NEW.status = 'approved')
+        ON CONFLICT (day) DO UPDATE SET
+            requested = requested + 1,
+            approved = approved + excluded.approved,
+            auto_approved = auto_approved + excluded.auto_approved;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS report_request_decided AFTER UPDATE OF status ON user_requests
+    WHEN NEW.status IN ('approved', 'rejected') AND OLD.status != NEW.status
+    BEGIN
+        INSERT INTO report_daily (day, approved, rejected, decision_seconds, decision_seconds_max)
+        VALUES (date('now'), NEW.status = 'approved', NEW.status = 'rejected',
+                (julianday('now') - julianday(NEW.requested_at)) * 86400,
+                (julianday('now') - julianday(NEW.requested_at)) * 86400)
+        ON CONFLICT (day) DO UPDATE SET
+            approved = approved + excluded.approved,
+            rejected = rejected + excluded.rejected,
+            decision_seconds = decision_seconds + excluded.decision_seconds,
+            decision_seconds_max = MAX(decision_seconds_max, excluded.decision_seconds_max);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS report_request_finished AFTER UPDATE OF status ON user_requests
+    WHEN NEW.status IN ('installed', 'failed') AND OLD.status != NEW.status
+    BEGIN
+        INSERT INTO report_daily (day, installed, failed)
+        VALUES (date('now'), NEW.status = 'installed', NEW.status = 'failed')
+        ON CONFLICT (day) DO UPDATE SET
+            installed = installed + excluded.installed,
+            failed = failed + excluded.failed;
+        INSERT INTO report_installs_daily (day, software_name, installed, failed)
+        SELECT date('now'), software_name, NEW.status = 'installed', NEW.status = 'failed'
+        FROM request_items WHERE request_id = NEW.id
+        UNION ALL
+        SELECT date('now'), NEW.software_name, NEW.status = 'installed', NEW.status = 'failed'
+        WHERE NEW.request_type IS NOT 'bundle'
+        ON CONFLICT (day, software_name) DO UPDATE SET
+            installed = installed + excluded.installed,
+            failed = failed + excluded.failed;
+    END
+    """,
+)
+
+CLOSED_STATUSES = ("installed", "failed", "rejected")
+ARCHIVE_COLUMNS = (
+    "id, user_id, software_name, version, status, ticket_number, requested_at, approved_by, approved_at, "
+    "accepted_at, finished_at, execution_id, ticket_sys_id, request_type"
+)
+
+
+def backfill(conn):
+    """Fill empty rollups from the requests already in the database (once, when the tables are new).
+
+    Days come from the stored timestamps, so counts land on the day each
+    step happened, as the triggers would have put them.
+    """
+    if conn.execute("SELECT 1 FROM report_daily LIMIT 1").fetchone():
+        return
+    conn.execute(
+        """INSERT INTO report_daily (day, requested, auto_approved, approved)
+           SELECT date(requested_at), COUNT(*), SUM(IFNULL(approved_by, '') LIKE 'policy:%'),
+                  SUM(IFNULL(approved_by, '') LIKE 'policy:%')
+           FROM user_requests GROUP BY date(requested_at)"""
+    )
+    conn.execute(
+        """INSERT INTO report_daily (day, approved, rejected, decision_seconds, decision_seconds_max)
+           SELECT date(approved_at), SUM(status != 'rejected'), SUM(status = 'rejected'),
+                  SUM((julianday(approved_at) - julianday(requested_at)) * 86400),
+                  MAX((julianday(approved_at) - julianday(requested_at)) * 86400)
+           FROM user_requests
+           WHERE approved_at IS NOT NULL AND (approved_by IS NULL OR approved_by NOT LIKE 'policy:%')
+           GROUP BY date(approved_at)
+           ON CONFLICT (day) DO UPDATE SET
+               approved = approved + excluded.approved,
+               rejected = rejected + excluded.rejected,
+               decision_seconds = excluded.decision_seconds,
+               decision_seconds_max = excluded.decision_seconds_max"""
+    )
+    conn.execute(
+        """INSERT INTO report_daily (day, installed, failed)
+           SELECT date(finished_at), SUM(status = 'installed'), SUM(status = 'failed')
+           FROM user_requests WHERE finished_at IS NOT NULL AND status IN ('installed', 'failed')
+           GROUP BY date(finished_at)
+           ON CONFLICT (day) DO UPDATE SET installed = excluded.installed, failed = excluded.failed"""
+    )
+    conn.execute(
+        """INSERT INTO report_installs_daily (day, software_name, installed, failed)
+           SELECT date(r.finished_at), COALESCE(i.software_name, r.software_name),
+                  SUM(r.status = 'installed'), SUM(r.status = 'failed')
+           FROM user_requests r LEFT JOIN request_items i ON i.request_id = r.id
+           WHERE r.finished_at IS NOT NULL AND r.status IN ('installed', 'failed')
+           GROUP BY 1, 2"""
+    )
+
+
+def report(conn, since, until, software=None):
+    """Rollups for the days ``since``..``until`` (ISO dates, inclusive), with totals and rates.
+
+    Reads one row per day (and per software for installs), however many
+    requests those days saw.
+    """
+    keys = ("requested", "approved", "auto_approved", "rejected", "installed", "failed",
+            "decision_seconds", "decision_seconds_max")
+    days = [
+        dict(zip(("day",) + keys, row))
+        for row in conn.execute(
+            f"SELECT day, {', '.join(keys)} FROM report_daily WHERE day BETWEEN ? AND ? ORDER BY day",
+            (since, until),
+        )
+    ]
+    sql = "SELECT software_name, SUM(installed), SUM(failed) FROM report_installs_daily WHERE day BETWEEN ? AND ?"
+    params = [since, until]
+    if software:
+        sql += " AND software_name=?"
+        params.append(software)
+    installs = [
+        {"software_name": name, "installed": installed, "failed": failed,
+         "failure_rate": _rate(failed, installed + failed)}
+        for name, installed, failed in conn.execute(sql + " GROUP BY software_name ORDER BY SUM(installed) + SUM(failed) DESC", params)
+    ]
+    totals = {key: sum(day[key] for day in days) for key in keys[:-2]}
+    decided = totals["approved"] - totals["auto_approved"] + totals["rejected"]
+    totals["failure_rate"] = _rate(totals["failed"], totals["installed"] + totals["failed"])
+    totals["auto_approval_rate"] = _rate(totals["auto_approved"], totals["approved"])
+    totals["avg_decision_seconds"] = round(sum(day["decision_seconds"] for day in days) / decided, 1) if decided else None
+    totals["max_decision_seconds"] = round(max((day["decision_seconds_max"] for day in days), default=0), 1)
+    return {"since": since, "until": until, "totals": totals, "days": days, "installs": installs}
+
+
+def _rate(part, whole):
+    return round(part / whole, 4) if whole else None
+
+
+def date_range(days, until=None):
+    """(since, until) ISO dates covering the last ``days`` days up to ``until`` (default today, UTC)"""
+    end = datetime.date.fromisoformat(until) if until else datetime.datetime.now(datetime.timezone.utc).date()
+    return (end - datetime.timedelta(days=days - 1)).isoformat(), end.isoformat()
+
+
+# ================== ARCHIVE ==================
+def archive_path(archive_dir, day):
+    """Partition file of requests made on ``day``: <dir>/YYYY/MM/requests-YYYY-MM-DD.jsonl.gz"""
+    return os.path.join(archive_dir, day[:4], day[5:7], f"requests-{day}.jsonl.gz")
+
+
+def write_archive(archive_dir, records):
+    """Append records to their day partitions and fsync; each append is a complete gzip member"""
+    by_day = {}
+    for record in records:
+        by_day.setdefault((record["requested_at"] or "unknown")[:10], []).append(record)
+    for day, batch in by_day.items():
+        path = archive_path(archive_dir, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in batch).encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+def read_archive(archive_dir, since=None, until=None, **filters):
+    """Archived requests made between ``since`` and ``until`` (ISO dates), optionally filtered by field.
+
+    Only the partitions in the range are opened. A request archived twice
+    (a crash between writing and deleting) is returned once.
+    """
+    seen = set()
+    for path in sorted(glob.glob(os.path.join(archive_dir, "*", "*", "requests-*.jsonl.gz"))):
+        day = os.path.basename(path)[len("requests-"):-len(".jsonl.gz")]
+        if (since and day < since) or (until and day > until):
+            continue
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record["id"] in seen or any(record.get(k) != v for k, v in filters.items() if v is not None):
+                    continue
+                seen.add(record["id"])
+                yield record
+
+
+class Retention:
+    """Moves closed requests older than ``RETENTION_DAYS`` out of the database into archive files.
+
+    Every ``RETENTION_INTERVAL`` seconds, installed, failed and rejected
+    requests whose last step is older than the cutoff are written, with
+    their packages and install log, to gzipped JSON-lines files under
+    ``ARCHIVE_DIR``, one per day of request, then deleted. Rollups are
+    not touched, so reports still cover archived days. Runs in one worker;
+    ``RETENTION_DAYS=0`` turns it off.
+    """
+
+    def __init__(self, db, archive_dir=None, days=None, interval=None, batch_size=None):
+        self.db = db
+        self.archive_dir = os.path.abspath(archive_dir or os.getenv("ARCHIVE_DIR", "archive"))
+        self.days = days if days is not None else int(os.getenv("RETENTION_DAYS", "90"))
+        self.interval = interval or float(os.getenv("RETENTION_INTERVAL", "3600"))
+        self.batch_size = batch_size or int(os.getenv("RETENTION_BATCH_SIZE", "200"))
+        self._task = None
+        self.archived = 0
+
+    async def start(self, app=None):
+        """Start the periodic archive run (aiohttp on_startup hook)"""
+        if self.days > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, app=None):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                count = await self.run_once()
+                if count:
+                    tracing.log(f"Archived {count} requests to {self.archive_dir}")
+            except Exception as e:
+                tracing.log(f"Request archive run failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        """Archive everything past the cutoff, a batch at a time; returns the number of requests archived"""
+        total = 0
+        while True:
+            records = await self.db.read(self._select)
+            if not records:
+                return total
+            await asyncio.get_running_loop().run_in_executor(None, write_archive, self.archive_dir, records)
+            ids = [r["id"] for r in records]
+            await self.db.transaction(lambda conn: self._delete(conn, ids))
+            metrics.REQUESTS_ARCHIVED.inc(len(ids))
+            self.archived += len(ids)
+            total += len(ids)
+            if len(records) < self.batch_size:
+                return total
+
+    def _select(self, conn):
+        rows = conn.execute(
+            f"""SELECT {ARCHIVE_COLUMNS} FROM user_requests
+                WHERE status IN ({', '.join('?' * len(CLOSED_STATUSES))})
+                  AND COALESCE(finished_at, approved_at, requested_at) < datetime('now', ?)
+                ORDER BY id LIMIT ?""",
+            (*CLOSED_STATUSES, f"-{self.days} days", self.batch_size),
+        ).fetchall()
+        keys = ARCHIVE_COLUMNS.split(", ")
+        records = []
+        for row in rows:
+            record = dict(zip(keys, row))
+            record["items"] = [
+                dict(zip(("software_name", "version", "winget_id"), item))
+                for item in conn.execute(
+                    "SELECT software_name, version, winget_id FROM request_items WHERE request_id=? ORDER BY id",
+                    (record["id"],),
+                )
+            ]
+            log, _, first = logstore.read(conn, record["id"])
+            record["logs"] = log.decode("utf-8", errors="replace")
+            record["logs_dropped_bytes"] = first
+            records.append(record)
+        return records
+
+    def _delete(self, conn, ids):
+        marks = ", ".join("?" * len(ids))
+        conn.execute(f"DELETE FROM request_logs WHERE request_id IN ({marks})", ids)
+        conn.execute(f"DELETE FROM request_items WHERE request_id IN ({marks})", ids)
+        conn.execute(f"DELETE FROM install_jobs WHERE request_id IN ({marks}) AND status NOT IN ('queued', 'running')", ids)
+        conn.execute(f"DELETE FROM user_requests WHERE id IN ({marks})", ids)
+
+
+def main(argv=None):
+    """Offline query of archived requests: python reporting.py [--since D] [--until D] [--status S] ..."""
+    parser = argparse.ArgumentParser(description="Query archived requests (prints JSON lines)")
+    parser.add_argument("--archive-dir", default=os.getenv("ARCHIVE_DIR", "archive"))
+    parser.add_argument("--since", help="First request day (YYYY-MM-DD)")
+    parser.add_argument("--until", help="Last request day (YYYY-MM-DD)")
+    parser.add_argument("--user-id")
+    parser.add_argument("--software-name")
+    parser.add_argument("--status", choices=CLOSED_STATUSES)
+    parser.add_argument("--no-logs", action="store_true", help="Leave out the install logs")
+    parser.add_argument("--count", action="store_true", help="Print only the number of matching requests")
+    args = parser.parse_args(argv)
+    records = read_archive(args.archive_dir, args.since, args.until,
+                           user_id=args.user_id, software_name=args.software_name, status=args.status)
+    if args.count:
+        print(sum(1 for _ in records))
+        return
+    for record in records:
+        if args.no_logs:
+            record.pop("logs", None)
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
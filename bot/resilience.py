@@ -0,0 +1,118 @@
+import os
+import time
+import asyncio
+import tracing
+
+
+class Unavailable(Exception):
+    """An upstream call was refused locally; ``retry_after`` says when to try again"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Unavailable):
+    pass
+
+
+class BulkheadFull(Unavailable):
+    pass
+
+
+class CircuitBreaker:
+    """Closed / open / half-open circuit breaker for one upstream.
+
+    ``failure_threshold`` consecutive failures open the circuit; calls are
+    then refused with ``CircuitOpenError`` without any I/O. After
+    ``reset_timeout`` seconds up to ``half_open_max`` probe calls are let
+    through: a successful probe closes the circuit, a failed one reopens it.
+    Runs on the event loop, so no locking is needed.
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None, half_open_max=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv("MCP_CB_FAILURE_THRESHOLD", "5"))
+        self.reset_timeout = reset_timeout or float(os.getenv("MCP_CB_RESET_TIMEOUT", "30"))
+        self.half_open_max = half_open_max or int(os.getenv("MCP_CB_HALF_OPEN_MAX", "1"))
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.rejected = 0
+
+    def retry_after(self):
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpenError; admitted calls end with record() or cancel()"""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name}: circuit open", self.retry_after())
+            self.state = "half_open"
+            self.probes = 0
+        if self.state == "half_open":
+            if self.probes >= self.half_open_max:
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name}: circuit half-open, probe in flight", 1.0)
+            self.probes += 1
+
+    def cancel(self):
+        if self.state == "half_open" and self.probes > 0:
+            self.probes -= 1
+
+    def record(self, success):
+        if success:
+            self.state = "closed"
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                tracing.log(f"⚠️ Circuit for {self.name} opened after {self.failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after": round(self.retry_after(), 1),
+            "rejected_total": self.rejected,
+        }
+
+
+class Bulkhead:
+    """Caps concurrent calls to one upstream.
+
+    A caller waits at most ``max_wait`` seconds for a slot and is then
+    refused with ``BulkheadFull``, so a slow upstream cannot tie up every
+    coroutine of the bot.
+    """
+
+    def __init__(self, name, limit=None, max_wait=None):
+        self.name = name
+        self.limit = limit or int(os.getenv("MCP_BULKHEAD_LIMIT", "20"))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("MCP_BULKHEAD_MAX_WAIT", "1"))
+        self._slots = asyncio.Semaphore(self.limit)
+        self.in_use = 0
+        self.rejected = 0
+
+    async def __aenter__(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise BulkheadFull(f"{self.name}: {self.limit} calls already in flight", self.max_wait)
+        self.in_use += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.in_use -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {"limit": self.limit, "in_use": self.in_use, "rejected_total": self.rejected}
@@ -0,0 +1,56 @@
+import unittest
+from catalog import CatalogEntry, SearchIndex, normalize
+
+
+def entry(name, winget_id, aliases=()):
+    return CatalogEntry(name, "1.0", "job", winget_id, tuple(aliases), ())
+
+
+ENTRIES = [
+    entry("Visual Studio Code", "Microsoft.VisualStudioCode", ["vscode"]),
+    entry("Google Chrome", "Google.Chrome", ["chrome"]),
+    entry("Chromium", "Hibbiki.Chromium"),
+    entry("Chrome Remote", "Google.ChromeRemoteDesktop"),
+    entry("Microsoft Visual Studio Community", "Microsoft.VisualStudio.2022.Community"),
+    entry("Slack", "SlackTechnologies.Slack"),
+    entry("Zoom", "Zoom.Zoom"),
+]
+
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex(ENTRIES)
+
+    def names(self, query, offset=0, limit=10):
+        results, total = self.index.search(query, offset, limit)
+        return [e.software_name for e in results], total
+
+    def test_tokens_match_word_prefixes(self):
+        self.assertEqual(self.names("chro"), (["Chromium", "Chrome Remote", "Google Chrome"], 3))
+        self.assertEqual(self.names("vis stud"), (["Visual Studio Code", "Microsoft Visual Studio Community"], 2))
+        # Inside a word is not a prefix
+        self.assertEqual(self.names("hrome"), ([], 0))
+
+    def test_long_tokens_are_checked_against_the_text(self):
+        self.assertEqual(self.names("visualstudiocode"), (["Visual Studio Code"], 1))
+        self.assertEqual(self.names("communityx"), ([], 0))
+
+    def test_shorter_names_rank_first_and_exact_matches_lead(self):
+        self.assertEqual(self.names("c")[0][:3], ["Chromium", "Chrome Remote", "Google Chrome"])
+        # "chrome" is Google Chrome's alias, so it goes ahead of Chrome Remote, which sorts first by name
+        self.assertEqual(self.names("chrome"), (["Google Chrome", "Chrome Remote"], 2))
+
+    def test_offset_and_total(self):
+        self.assertEqual(self.names("")[1], len(ENTRIES))
+        first, total = self.names("c", 0, 2)
+        second, _ = self.names("c", 2, 2)
+        self.assertEqual(total, 5)
+        self.assertEqual(first + second, self.names("c")[0][:4])
+        self.assertEqual(self.names("c", 10, 2), ([], 5))
+
+    def test_normalize(self):
+        self.assertEqual(normalize("  Notepad++ / C#  "), "notepad++ c#")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import catalog_sync
+
+SOFTWARE_CATALOG = """
+    CREATE TABLE software_catalog (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        software_name TEXT NOT NULL,
+        version TEXT NOT NULL,
+        rundeck_job_id TEXT,
+        winget_id TEXT,
+        aliases TEXT,
+        tags TEXT,
+        source TEXT
+    )
+"""
+
+
+class CatalogSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        # CatalogSync runs its own BEGIN IMMEDIATE transactions
+        self.conn = sqlite3.connect(":memory:", isolation_level=None)
+        self.addCleanup(self.conn.close)
+        self.conn.execute(SOFTWARE_CATALOG)
+
+    def manifest(self, winget_id, version, name, tags=()):
+        path = os.path.join(self.root, winget_id[0].lower(), *winget_id.split("."), version)
+        os.makedirs(path, exist_ok=True)
+        lines = [f"PackageIdentifier: {winget_id}", f"PackageVersion: {version}", f"PackageName: {name}"]
+        if tags:
+            lines += ["Tags:"] + [f"- {t}" for t in tags]
+        with open(os.path.join(path, f"{winget_id}.yaml"), "w") as f:
+            f.write("\n".join(lines + ["ManifestType: singleton", ""]))
+        return path
+
+    def sync(self):
+        return catalog_sync.CatalogSync(self.conn, self.root, "job", workers=1, log=lambda message: None).run()
+
+    def catalog(self):
+        return self.conn.execute("SELECT software_name, version, winget_id, tags, source FROM software_catalog "
+                                 "ORDER BY software_name").fetchall()
+
+    def test_first_sync_adds_the_newest_versions(self):
+        self.manifest("Google.Chrome", "9.0", "Google Chrome", ["Browser"])
+        self.manifest("Google.Chrome", "10.0", "Google Chrome", ["Browser"])
+        self.manifest("Git.Git", "2.42.0", "Git")
+        stats = self.sync()
+        self.assertEqual({k: stats[k] for k in ("dirs", "unchanged", "read", "parsed", "invalid", "packages")},
+                         {"dirs": 3, "unchanged": 0, "read": 3, "parsed": 3, "invalid": 0, "packages": 2})
+        self.assertEqual(self.catalog(), [("Git", "2.42.0", "Git.Git", "", "winget"),
+                                          ("Google Chrome", "10.0", "Google.Chrome", "browser", "winget")])
+
+    def test_unchanged_stamps_are_skipped(self):
+        self.manifest("Google.Chrome", "10.0", "Google Chrome")
+        path = self.manifest("Git.Git", "2.42.0", "Git")
+        self.sync()
+        stats = self.sync()
+        self.assertEqual((stats["dirs"], stats["unchanged"], stats["read"], stats["packages"]), (2, 2, 0, 0))
+        # A newer mtime with the same content is read but only its stamp is stored
+        st = os.stat(os.path.join(path, "Git.Git.yaml"))
+        os.utime(os.path.join(path, "Git.Git.yaml"), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        stats = self.sync()
+        self.assertEqual((stats["unchanged"], stats["read"], stats["parsed"], stats["packages"]), (1, 1, 0, 0))
+        self.assertEqual(self.sync()["read"], 0)
+
+    def test_new_and_removed_versions_update_the_catalog(self):
+        self.manifest("Google.Chrome", "9.0", "Google Chrome")
+        self.manifest("Git.Git", "2.42.0", "Git")
+        self.sync()
+        newest = self.manifest("Google.Chrome", "10.0", "Google Chrome")
+        stats = self.sync()
+        self.assertEqual((stats["unchanged"], stats["read"], stats["packages"]), (2, 1, 1))
+        self.assertEqual(self.catalog()[1][:2], ("Google Chrome", "10.0"))
+        shutil.rmtree(newest)
+        shutil.rmtree(os.path.join(self.root, "g", "Git"))
+        stats = self.sync()
+        self.assertEqual((stats["removed"], stats["packages"]), (2, 2))
+        self.assertEqual(self.catalog(), [("Google Chrome", "9.0", "Google.Chrome", "", "winget")])
+
+    def test_manual_rows_keep_their_name_and_are_not_removed(self):
+        self.conn.execute("INSERT INTO software_catalog (software_name, version, rundeck_job_id, winget_id, aliases, source) "
+                          "VALUES ('Chrome', '1.0', 'manual-job', 'Google.Chrome', 'browser', 'manual')")
+        path = self.manifest("Google.Chrome", "10.0", "Google Chrome")
+        self.sync()
+        self.assertEqual(self.catalog(), [("Chrome", "10.0", "Google.Chrome", "", "manual")])
+        shutil.rmtree(path)
+        self.sync()
+        self.assertEqual(self.catalog(), [("Chrome", "10.0", "Google.Chrome", "", "manual")])
+
+    def test_unsafe_values_are_invalid(self):
+        self.manifest("Evil.Pkg", "1.0", "Evil; rm -rf")
+        self.manifest("Google.Chrome", "10.0 beta", "Google Chrome")
+        self.manifest("Git.Git", "2.42.0", "Git")
+        stats = self.sync()
+        self.assertEqual((stats["parsed"], stats["invalid"], stats["packages"]), (3, 2, 1))
+        self.assertEqual([row[0] for row in self.catalog()], ["Git"])
+
+
+class VersionKeyTest(unittest.TestCase):
+    def test_versions_sort_numerically(self):
+        versions = ["1.10", "1.9", "1.9.1", "10.0", "2.0"]
+        self.assertEqual(sorted(versions, key=catalog_sync.version_key), ["1.9", "1.9.1", "1.10", "2.0", "10.0"])
+
+
+if __name__ == "__main__":
+    unittest.main()
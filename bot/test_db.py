@@ -0,0 +1,50 @@
+import os
+import asyncio
+import sqlite3
+import tempfile
+import unittest
+from db import Database
+
+
+class DatabaseTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.dir.name, "test.db"), commit_window=0.01)
+        with self.db.connect() as conn:
+            conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.dir.cleanup()
+
+    async def names(self):
+        return [row[0] for row in await self.db.fetchall("SELECT name FROM items ORDER BY id")]
+
+    async def test_concurrent_writes_share_one_commit(self):
+        await asyncio.gather(*(self.db.execute("INSERT INTO items (name) VALUES (?)", (f"n{i}",)) for i in range(20)))
+        self.assertEqual(len(await self.names()), 20)
+        self.assertEqual(self.db.writes, 20)
+        self.assertEqual(self.db.batches, 1)
+
+    async def test_failing_write_rolls_back_only_its_own_savepoint(self):
+        def insert_twice(conn):
+            conn.execute("INSERT INTO items (name) VALUES ('partial')")
+            conn.execute("INSERT INTO items (name) VALUES ('a')")
+
+        results = await asyncio.gather(
+            self.db.execute("INSERT INTO items (name) VALUES ('a')"),
+            self.db.transaction(insert_twice),
+            self.db.execute("INSERT INTO items (name) VALUES ('b')"),
+            return_exceptions=True,
+        )
+        self.assertIsInstance(results[1], sqlite3.IntegrityError)
+        self.assertEqual(self.db.batches, 1)
+        self.assertEqual(await self.names(), ["a", "b"])
+
+    async def test_transaction_returns_the_functions_result(self):
+        row_id = await self.db.transaction(lambda conn: conn.execute("INSERT INTO items (name) VALUES ('x')").lastrowid)
+        self.assertEqual(await self.db.fetchone("SELECT name FROM items WHERE id=?", (row_id,)), ("x",))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import asyncio
+import tempfile
+import unittest
+from types import SimpleNamespace
+import idempotency
+from db import Database
+
+
+class IdempotencyStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.dir.name, "keys.db"), commit_window=0)
+        with self.db.connect() as conn:
+            conn.execute(idempotency.SCHEMA)
+            conn.execute(idempotency.INDEX)
+        await self.db.start()
+        self.store = idempotency.IdempotencyStore(self.db, ttl=60, sweep_interval=0.01)
+        self.calls = 0
+
+    async def asyncTearDown(self):
+        await self.store.close()
+        await self.db.close()
+        self.dir.cleanup()
+
+    async def action(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return f"request {self.calls} is logged"
+
+    async def test_duplicate_key_runs_once_and_gets_the_result(self):
+        first = await self.store.once("k", self.action)
+        again = await self.store.once("k", self.action)
+        self.assertEqual(first, (True, "request 1 is logged"))
+        self.assertEqual(again, (False, "request 1 is logged"))
+        self.assertEqual(self.calls, 1)
+
+    async def test_concurrent_duplicate_waits_for_the_first_call(self):
+        results = await asyncio.gather(self.store.once("k", self.action), self.store.once("k", self.action))
+        self.assertEqual(sorted(results), [(False, "request 1 is logged"), (True, "request 1 is logged")])
+        self.assertEqual(self.calls, 1)
+
+    async def test_failure_releases_the_key(self):
+        async def fail():
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            await self.store.once("k", fail)
+        self.assertEqual(await self.store.once("k", self.action), (True, "request 1 is logged"))
+
+    async def test_expired_keys_are_swept_and_can_run_again(self):
+        self.store.ttl = 0.01
+        await self.store.once("k", self.action)
+        await self.store.start()
+        await asyncio.sleep(0.1)
+        self.assertEqual(await self.db.fetchone("SELECT COUNT(*) FROM idempotency_keys"), (0,))
+        self.assertEqual(await self.store.once("k", self.action), (True, "request 2 is logged"))
+
+
+class KeyTest(unittest.TestCase):
+    def activity(self, activity_id, reply_to_id=None, value=None):
+        return SimpleNamespace(id=activity_id, reply_to_id=reply_to_id, value=value,
+                               conversation=SimpleNamespace(id="conv"))
+
+    def test_double_click_on_a_card_has_the_same_key(self):
+        value = {"action": "approve_request", "request_id": 1}
+        self.assertEqual(
+            idempotency.activity_key("approve_request", "u", self.activity("a1", "card", value)),
+            idempotency.activity_key("approve_request", "u", self.activity("a2", "card", value)),
+        )
+
+    def test_message_key_follows_the_activity_id(self):
+        key = idempotency.message_key("u", self.activity("a1"))
+        self.assertEqual(key, idempotency.message_key("u", self.activity("a1")))
+        self.assertNotEqual(key, idempotency.message_key("u", self.activity("a2")))
+        self.assertIsNone(idempotency.message_key("u", self.activity(None)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+import jobs
+import tracing
+from db import Database
+
+
+class JobQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.dir.name, "jobs.db"), commit_window=0)
+        with self.db.connect() as conn:
+            conn.execute(jobs.SCHEMA)
+        self.failed = []
+        self.calls = 0
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.dir.cleanup()
+
+    async def handler(self, job_id, request_id):
+        self.calls += 1
+        raise RuntimeError("Rundeck said no")
+
+    async def on_failed(self, job_id, request_id, error):
+        self.failed.append((request_id, error))
+
+    async def run_until_settled(self, queue):
+        # Claims and runs jobs directly; retries are made due at once instead of after their backoff
+        while True:
+            job = await queue._claim()
+            if job is None:
+                return
+            job_id, request_id, attempts, _ = job
+            with tracing.start_span("install_job"):
+                await queue._run_job(job_id, request_id, attempts)
+            await self.db.execute("UPDATE install_jobs SET run_after=0")
+
+    async def test_failure_hook_runs_once_attempts_are_used_up(self):
+        queue = jobs.JobQueue(self.db, self.handler, max_attempts=3, on_failed=self.on_failed)
+        await self.db.transaction(lambda conn: jobs.enqueue(conn, 42))
+        await self.run_until_settled(queue)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(self.failed, [(42, "Rundeck said no")])
+        row = await self.db.fetchone("SELECT status, attempts, last_error FROM install_jobs")
+        self.assertEqual(row, ("failed", 3, "Rundeck said no"))
+
+    async def test_expired_leases_count_as_attempts(self):
+        queue = jobs.JobQueue(self.db, self.handler, max_attempts=2, on_failed=self.on_failed)
+        await self.db.transaction(lambda conn: jobs.enqueue(conn, 7))
+        await self.db.execute("UPDATE install_jobs SET status='running', attempts=2, lease_until=0")
+        await self.run_until_settled(queue)
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(self.failed, [(7, "Lease expired 2 times")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import sqlite3
+import unittest
+from unittest import mock
+import logstore
+
+
+class LogStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute(logstore.SCHEMA)
+        patcher = mock.patch.multiple(logstore, MAX_BYTES=100, CHUNK_BYTES=16)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_small_log_round_trips_in_chunks(self):
+        text = "line one\nline two\nline three\n"
+        self.assertEqual(logstore.store(self.conn, 1, text), len(text))
+        self.assertEqual(logstore.read(self.conn, 1), (text.encode(), len(text), 0))
+        chunks = self.conn.execute("SELECT COUNT(*) FROM request_logs WHERE request_id=1").fetchone()[0]
+        self.assertEqual(chunks, 2)
+
+    def test_only_the_end_is_kept_past_the_cap(self):
+        text = "".join(f"{n:04d}\n" for n in range(50))
+        logstore.store(self.conn, 1, text)
+        data, next_offset, first = logstore.read(self.conn, 1)
+        self.assertEqual(first, len(text) - 100)
+        self.assertEqual(data, text.encode()[first:])
+        self.assertEqual(next_offset, len(text))
+
+    def test_reads_resume_from_an_offset_with_a_limit(self):
+        text = "abcdefghij" * 5
+        logstore.store(self.conn, 1, text)
+        data, next_offset, _ = logstore.read(self.conn, 1, offset=10, limit=20)
+        self.assertEqual((data, next_offset), (text[10:30].encode(), 30))
+        self.assertEqual(logstore.read(self.conn, 1, offset=len(text))[0], b"")
+
+    def test_store_replaces_and_missing_logs_read_empty(self):
+        logstore.store(self.conn, 1, "old log")
+        logstore.store(self.conn, 1, "new")
+        self.assertEqual(logstore.read(self.conn, 1)[0], b"new")
+        self.assertEqual(logstore.read(self.conn, 2, offset=5), (b"", 5, 0))
+
+
+class SignedLinkTest(unittest.TestCase):
+    def test_signature_is_per_request_and_secret(self):
+        sig = logstore.sign("secret", 1)
+        self.assertTrue(logstore.verify("secret", 1, sig))
+        self.assertFalse(logstore.verify("secret", 2, sig))
+        self.assertFalse(logstore.verify("other", 1, sig))
+        self.assertFalse(logstore.verify("secret", 1, ""))
+
+    def test_no_secret_signs_nothing(self):
+        self.assertIsNone(logstore.sign("", 1))
+        self.assertFalse(logstore.verify("", 1, ""))
+
+
+class SummaryTest(unittest.TestCase):
+    def test_summary_keeps_the_last_lines(self):
+        text = "\n".join(f"line {n}" for n in range(20)) + "\n"
+        self.assertEqual(logstore.summary(text, lines=2), "… (18 earlier lines)\nline 18\nline 19")
+
+
+if __name__ == "__main__":
+    unittest.main()
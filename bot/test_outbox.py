@@ -0,0 +1,85 @@
+import os
+import time
+import tempfile
+import unittest
+import outbox
+from db import Database
+
+
+class Refused(Exception):
+    retry_after = 30
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.dir.name, "outbox.db"), commit_window=0)
+        with self.db.connect() as conn:
+            conn.execute(outbox.SCHEMA)
+            for stmt in outbox.INDEXES:
+                conn.execute(stmt)
+        await self.db.start()
+        self.handled = []
+        self.error = None
+        self.dispatcher = outbox.OutboxDispatcher(self.db, {"note": self.note}, base_delay=1, max_attempts=2)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.dir.cleanup()
+
+    async def note(self, request_id, text):
+        if self.error is not None:
+            raise self.error
+        self.handled.append(text)
+
+    async def add(self, request_id, text):
+        await self.db.transaction(lambda conn: outbox.add(conn, "note", request_id, text=text))
+
+    async def drain_once(self):
+        rows = await self.dispatcher._claim(10)
+        for row in rows:
+            await self.dispatcher._dispatch(*row)
+        return len(rows)
+
+    async def row(self):
+        return await self.db.fetchone("SELECT status, attempts, next_attempt_at, last_error FROM outbox")
+
+    async def test_rows_of_one_request_run_in_order(self):
+        await self.add(1, "1a")
+        await self.add(1, "1b")
+        await self.add(2, "2a")
+        self.assertEqual(await self.drain_once(), 2)
+        self.assertEqual(self.handled, ["1a", "2a"])
+        await self.drain_once()
+        self.assertEqual(self.handled, ["1a", "2a", "1b"])
+        self.assertEqual(await self.db.fetchone("SELECT COUNT(*) FROM outbox"), (0,))
+
+    async def test_failure_backs_off_then_goes_dead(self):
+        await self.add(1, "x")
+        self.error = RuntimeError("ServiceNow down")
+        await self.drain_once()
+        status, attempts, next_attempt_at, last_error = await self.row()
+        self.assertEqual((status, attempts, last_error), ("pending", 1, "ServiceNow down"))
+        self.assertGreater(next_attempt_at, time.time())
+        # Not due yet, so a later row of the same request waits behind it
+        await self.add(1, "y")
+        self.assertEqual(await self.drain_once(), 0)
+        await self.db.execute("UPDATE outbox SET next_attempt_at=0")
+        await self.drain_once()
+        self.assertEqual((await self.row())[:2], ("dead", 2))
+        # A dead row no longer holds back the request
+        self.error = None
+        await self.drain_once()
+        self.assertEqual(self.handled, ["y"])
+
+    async def test_retry_after_defers_without_using_an_attempt(self):
+        await self.add(1, "x")
+        self.error = Refused("circuit open")
+        await self.drain_once()
+        status, attempts, next_attempt_at, _ = await self.row()
+        self.assertEqual((status, attempts), ("pending", 0))
+        self.assertGreaterEqual(next_attempt_at, time.time() + 29)
+
+
+if __name__ == "__main__":
+    unittest.main()
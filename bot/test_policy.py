@@ -0,0 +1,68 @@
+import sqlite3
+import unittest
+import policy
+from catalog import CatalogEntry
+
+CHROME = CatalogEntry("Google Chrome", "118.0", "job", "Google.Chrome", ("chrome",), frozenset({"browser"}))
+SLACK = CatalogEntry("Slack", "4.35", "job", "SlackTechnologies.Slack", (), frozenset({"chat"}))
+
+CONFIG = {
+    "groups": {"developers": ["dev1", "dev2"]},
+    "rules": [
+        {"name": "no-slack", "software": ["Slack"], "decision": "manual"},
+        {"name": "browsers", "tags": ["Browser"], "groups": ["developers"], "quota": {"max": 2, "hours": 24}},
+        {"name": "anyone", "users": ["*"], "versions": "any"},
+    ],
+}
+
+
+class CompileRulesTest(unittest.TestCase):
+    def test_rules_compile_in_order(self):
+        rules = policy.compile_rules(CONFIG)
+        self.assertEqual([r.name for r in rules], ["no-slack", "browsers", "anyone"])
+        self.assertFalse(rules[0].approve)
+        self.assertEqual(rules[1].tags, frozenset({"browser"}))
+        self.assertEqual(rules[1].users, frozenset({"dev1", "dev2"}))
+        self.assertEqual(rules[1].quota, (2, 24.0))
+        self.assertIsNone(rules[2].users)
+
+    def test_malformed_configs_raise_value_error(self):
+        for config in ([], {"rules": ["x"]}, {"rules": [{"tags": "browser"}]}, {"groups": {"a": "dev1"}},
+                       {"rules": [{"groups": ["nobody"]}]}, {"rules": [{"decision": "maybe"}]},
+                       {"rules": [{"versions": "newest"}]}, {"rules": [{"quota": 3}]}):
+            with self.subTest(config=config), self.assertRaises(ValueError):
+                policy.compile_rules(config)
+
+    def test_candidates_stop_at_the_first_manual_rule(self):
+        approval = policy.ApprovalPolicy(path="/nonexistent")
+        approval.rules = policy.compile_rules(CONFIG)
+        self.assertEqual([r.name for r in approval.candidates("dev1", [CHROME], ["118.0"])], ["browsers", "anyone"])
+        # Another version than the catalog's only matches "versions": "any"
+        self.assertEqual([r.name for r in approval.candidates("dev1", [CHROME], ["117.0"])], ["anyone"])
+        self.assertEqual(approval.candidates("dev1", [SLACK], ["4.35"]), [])
+        # A bundle needs one rule that covers every package: "browsers" does not cover Slack
+        self.assertEqual([r.name for r in approval.candidates("dev1", [CHROME, SLACK], ["118.0", "4.35"])], ["anyone"])
+
+
+class QuotaTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE user_requests (user_id TEXT, requested_at DATETIME DEFAULT CURRENT_TIMESTAMP, approved_by TEXT)")
+        self.rule = policy.compile_rules(CONFIG)[1]
+
+    def approve(self, user_id, requested_at="now"):
+        self.conn.execute("INSERT INTO user_requests (user_id, requested_at, approved_by) VALUES (?, datetime(?), ?)",
+                          (user_id, requested_at, policy.approver(self.rule)))
+
+    def test_quota_counts_the_users_recent_approvals_by_the_rule(self):
+        self.approve("dev1")
+        self.approve("dev2")
+        self.approve("dev1", "-2 days")
+        self.assertTrue(policy.quota_available(self.conn, "dev1", self.rule))
+        self.approve("dev1")
+        self.assertFalse(policy.quota_available(self.conn, "dev1", self.rule))
+        self.assertTrue(policy.quota_available(self.conn, "dev2", self.rule))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import sqlite3
+import unittest
+import reporting
+
+USER_REQUESTS = """
+    CREATE TABLE user_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        software_name TEXT NOT NULL,
+        version TEXT NOT NULL,
+        status TEXT DEFAULT 'requested',
+        ticket_number TEXT,
+        requested_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        approved_by TEXT,
+        approved_at DATETIME,
+        accepted_at DATETIME,
+        finished_at DATETIME,
+        execution_id TEXT,
+        ticket_sys_id TEXT,
+        request_type TEXT DEFAULT 'single'
+    )
+"""
+REQUEST_ITEMS = """
+    CREATE TABLE request_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        request_id INTEGER NOT NULL,
+        software_name TEXT NOT NULL,
+        version TEXT NOT NULL,
+        winget_id TEXT NOT NULL,
+        rundeck_job_id TEXT
+    )
+"""
+
+
+class RollupTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:", isolation_level=None)
+        self.conn.execute(USER_REQUESTS)
+        self.conn.execute(REQUEST_ITEMS)
+        for stmt in reporting.SCHEMA:
+            self.conn.execute(stmt)
+
+    def request(self, software, approved_by=None, request_type="single"):
+        # Requested a few minutes ago, so decisions take measurable time
+        return self.conn.execute(
+            """INSERT INTO user_requests (user_id, software_name, version, status, requested_at, approved_by,
+                                          approved_at, request_type)
+               VALUES ('u', ?, '1', ?, datetime('now', '-300 seconds'), ?, CASE WHEN ? IS NULL THEN NULL ELSE datetime('now') END, ?)""",
+            (software, "approved" if approved_by else "requested", approved_by, approved_by, request_type),
+        ).lastrowid
+
+    def set_status(self, req_id, status, **stamps):
+        # The bot stamps steps in UTC, like the triggers' date('now')
+        columns = "".join(f", {column}=datetime('now')" for column in stamps)
+        self.conn.execute(f"UPDATE user_requests SET status=?{columns} WHERE id=?", (status, req_id))
+
+    def rollups(self):
+        daily = self.conn.execute("SELECT * FROM report_daily ORDER BY day").fetchall()
+        installs = self.conn.execute("SELECT * FROM report_installs_daily ORDER BY day, software_name").fetchall()
+        return daily, installs
+
+    def simulate(self):
+        chrome = self.request("Google Chrome")
+        self.set_status(chrome, "approved", approved_at=True)
+        self.set_status(chrome, "running")
+        self.set_status(chrome, "installed", finished_at=True)
+        slack = self.request("Slack", approved_by="policy:chat")
+        self.set_status(slack, "failed", finished_at=True)
+        zoom = self.request("Zoom")
+        self.set_status(zoom, "rejected", approved_at=True)
+        bundle = self.request("bundle", request_type="bundle")
+        self.conn.executemany(
+            "INSERT INTO request_items (request_id, software_name, version, winget_id) VALUES (?, ?, '1', ?)",
+            [(bundle, "Git", "Git.Git"), (bundle, "Google Chrome", "Google.Chrome")],
+        )
+        self.set_status(bundle, "approved", approved_at=True)
+        self.set_status(bundle, "installed", finished_at=True)
+        self.request("Teams")
+
+    def test_triggers_count_each_step(self):
+        self.simulate()
+        report = reporting.report(self.conn, "2000-01-01", "2999-12-31")
+        totals = report["totals"]
+        self.assertEqual(
+            {k: totals[k] for k in ("requested", "approved", "auto_approved", "rejected", "installed", "failed")},
+            {"requested": 5, "approved": 3, "auto_approved": 1, "rejected": 1, "installed": 2, "failed": 1},
+        )
+        self.assertAlmostEqual(totals["avg_decision_seconds"], 300, delta=2)
+        installs = {i["software_name"]: (i["installed"], i["failed"]) for i in report["installs"]}
+        self.assertEqual(installs, {"Google Chrome": (2, 0), "Git": (1, 0), "Slack": (0, 1)})
+
+    def test_backfill_matches_the_triggers(self):
+        self.simulate()
+        daily, installs = self.rollups()
+        self.conn.execute("DELETE FROM report_daily")
+        self.conn.execute("DELETE FROM report_installs_daily")
+        reporting.backfill(self.conn)
+        backfilled_daily, backfilled_installs = self.rollups()
+        self.assertEqual(backfilled_installs, installs)
+        self.assertEqual(len(backfilled_daily), len(daily))
+        for row, expected in zip(backfilled_daily, daily):
+            self.assertEqual(row[:7], expected[:7])
+            # Seconds from stored timestamps against the trigger's julianday('now')
+            self.assertAlmostEqual(row[7], expected[7], delta=3)
+            self.assertAlmostEqual(row[8], expected[8], delta=1)
+
+    def test_backfill_runs_only_on_empty_rollups(self):
+        self.simulate()
+        before = self.rollups()
+        reporting.backfill(self.conn)
+        self.assertEqual(self.rollups(), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
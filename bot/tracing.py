@@ -0,0 +1,19 @@
+import os
+import sys
+import asyncio
+
+# The trace context, spans and exporter are shared with the MCP server (shared/tracing_core.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "shared"))
+import tracing_core
+from tracing_core import (
+    EXPORTER, Span, current_span, inject, log, parse_traceparent, set_attribute, start_span, traceparent,
+)
+
+tracing_core.configure("teams-bot")
+# A forked bot worker starts its own exporter thread
+os.register_at_fork(after_in_child=EXPORTER.reset_after_fork)
+
+
+async def close(app=None):
+    """Write out queued spans and log lines (aiohttp on_cleanup hook)"""
+    await asyncio.get_running_loop().run_in_executor(None, EXPORTER.flush)
@@ -0,0 +1,447 @@
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+import aiohttp
+from simulators import ConnectorSimulator, add_upstream_arguments, build_simulators, serve
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEBHOOK_TOKEN = "loadtest"
+BOT_STAGES = ["select", "ticket", "approve", "accept", "dispatch", "install", "total"]
+MCP_STAGES = ["create_ticket", "update_ticket", "run_job", "install", "close_ticket", "total"]
+# Used by --target mcp, which bypasses the bot's catalog
+MCP_PACKAGES = [
+    ("Google Chrome", "117.0", "Google.Chrome"),
+    ("VS Code", "1.90", "Microsoft.VisualStudioCode"),
+    ("Slack", "4.35", "SlackTechnologies.Slack"),
+    ("Zoom", "latest", "Zoom.Zoom"),
+]
+
+
+class FlowError(Exception):
+    pass
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+class Results:
+    def __init__(self, stages):
+        self.stages = stages
+        self.samples = {stage: [] for stage in stages}
+        self.ok = 0
+        self.failed = 0
+        self.outcomes = {}
+        self.errors = {}
+
+    def record(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+    def error(self, message):
+        self.failed += 1
+        self.errors[message] = self.errors.get(message, 0) + 1
+
+    def summary(self, wall):
+        stages = {}
+        for stage in self.stages:
+            values = sorted(self.samples[stage])
+            stages[stage] = {
+                "count": len(values),
+                "p50_ms": _ms(percentile(values, 50)),
+                "p95_ms": _ms(percentile(values, 95)),
+                "p99_ms": _ms(percentile(values, 99)),
+                "max_ms": _ms(values[-1] if values else None),
+            }
+        return {
+            "flows_ok": self.ok,
+            "flows_failed": self.failed,
+            "wall_seconds": round(wall, 2),
+            "throughput_per_s": round(self.ok / wall, 2) if wall else 0.0,
+            "outcomes": self.outcomes,
+            "errors": self.errors,
+            "stages": stages,
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def print_summary(summary):
+    print()
+    print(f"Flows: {summary['flows_ok']} ok, {summary['flows_failed']} failed in {summary['wall_seconds']}s "
+          f"({summary['throughput_per_s']} flows/s)")
+    if "connector_calls_per_flow" in summary:
+        print(f"Bot Connector calls per flow: {summary['connector_calls_per_flow']}")
+    if summary["outcomes"]:
+        print("Outcomes: " + ", ".join(f"{k}={v}" for k, v in sorted(summary["outcomes"].items())))
+    print(f"{'stage':<14}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'max ms':>11}")
+    for stage, s in summary["stages"].items():
+        cells = [s[k] if s[k] is not None else "-" for k in ("p50_ms", "p95_ms", "p99_ms", "max_ms")]
+        print(f"{stage:<14}{s['count']:>7}" + "".join(f"{c:>11}" for c in cells))
+    for message, count in sorted(summary["errors"].items(), key=lambda kv: -kv[1]):
+        print(f"  {count} x {message}")
+
+
+# ================== BOT FLOW ==================
+class BotDriver:
+    """Plays Teams users against the bot's /api/messages (auth disabled: no MICROSOFT_APP_ID)"""
+
+    def __init__(self, session, bot_url, connector, connector_url, timeout, run_id):
+        self.session = session
+        self.bot_url = bot_url.rstrip("/")
+        self.connector = connector
+        self.connector_url = connector_url
+        self.timeout = timeout
+        self.run_id = run_id
+        self.choices = []
+
+    async def post(self, user, conversation, text=None, value=None):
+        activity = {
+            "type": "message",
+            "id": uuid.uuid4().hex,
+            "channelId": "emulator",
+            "serviceUrl": self.connector_url,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "from": {"id": user, "name": user},
+            "recipient": {"id": "software-bot", "name": "Software Bot"},
+            "conversation": {"id": conversation},
+            "text": text,
+            "value": value,
+        }
+        async with self.session.post(f"{self.bot_url}/api/messages", json=activity) as response:
+            if response.status >= 300:
+                raise FlowError(f"/api/messages answered {response.status}")
+
+    async def expect(self, conversation, match, stage):
+        """Next bot activity in the conversation that ``match``es; warnings fail the flow"""
+        inbox = self.connector.inbox(conversation)
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise FlowError(f"timed out waiting for {stage}")
+            try:
+                activity = await asyncio.wait_for(inbox.get(), remaining)
+            except asyncio.TimeoutError:
+                raise FlowError(f"timed out waiting for {stage}")
+            text = activity.get("text") or ""
+            if match(activity):
+                return activity
+            if text.startswith("⚠️"):
+                raise FlowError(f"{stage}: {text.splitlines()[0]}")
+
+    @staticmethod
+    def card_text(activity):
+        """Text of the activity plus its cards' TextBlocks (status cards are edited in place via PUT)"""
+        texts = [activity.get("text") or ""]
+        for attachment in activity.get("attachments") or []:
+            for item in (attachment.get("content") or {}).get("body", []):
+                if item.get("type") == "TextBlock":
+                    texts.append(item.get("text") or "")
+        return "\n".join(texts)
+
+    @staticmethod
+    def card_action(activity, action):
+        for attachment in activity.get("attachments") or []:
+            for item in (attachment.get("content") or {}).get("actions", []):
+                data = item.get("data") or {}
+                if data.get("action") == action:
+                    return data
+        return None
+
+    async def warm_up(self):
+        """Read the catalog choices from the picker card"""
+        user, conversation = f"lt-{self.run_id}-warmup", f"lt-{self.run_id}-warmup"
+        await self.post(user, conversation, text="install")
+        card = await self.expect(conversation, lambda a: a.get("attachments"), "picker")
+        for item in card["attachments"][0]["content"]["body"]:
+            if item.get("id") == "software_selection":
+                self.choices = [c["value"] for c in item["choices"]]
+        if not self.choices:
+            raise FlowError("catalog picker has no choices")
+
+    async def flow(self, n, results):
+        user = conversation = f"lt-{self.run_id}-{n}"
+        started = mark = time.perf_counter()
+
+        def lap(stage):
+            nonlocal mark
+            now = time.perf_counter()
+            results.record(stage, now - mark)
+            mark = now
+
+        await self.post(user, conversation, value={
+            "action": "select_software",
+            "software_selection": self.choices[n % len(self.choices)],
+        })
+        card = await self.expect(conversation, lambda a: "Install request" in self.card_text(a), "select")
+        lap("select")
+
+        # Requests the approval policy covers come back approved, with Proceed on the first card
+        if not self.card_action(card, "accept_install"):
+            card = await self.expect(conversation, lambda a: self.card_action(a, "approve_request"), "ticket")
+            lap("ticket")
+
+            await self.post(user, conversation, value=self.card_action(card, "approve_request"))
+            card = await self.expect(conversation, lambda a: self.card_action(a, "accept_install"), "approve")
+            lap("approve")
+
+        # The card goes from queued to installing in one edit, so accept is the turn itself
+        await self.post(user, conversation, value=self.card_action(card, "accept_install"))
+        lap("accept")
+
+        await self.expect(
+            conversation, lambda a: "Installing" in self.card_text(a) or "Installation failed" in self.card_text(a),
+            "dispatch",
+        )
+        lap("dispatch")
+
+        final = await self.expect(
+            conversation,
+            lambda a: (a.get("text") or "").startswith(("✅ Installation", "❌ Installation")),
+            "install",
+        )
+        lap("install")
+        results.record("total", time.perf_counter() - started)
+        return "succeeded" if final["text"].startswith("✅") else "failed"
+
+
+# ================== MCP FLOW ==================
+class MCPDriver:
+    """Drives the MCP server endpoints directly; execution results come back to the connector simulator"""
+
+    def __init__(self, session, mcp_url, connector, timeout, run_id):
+        self.session = session
+        self.mcp_url = mcp_url.rstrip("/")
+        self.connector = connector
+        self.timeout = timeout
+        self.run_id = run_id
+
+    async def warm_up(self):
+        async with self.session.get(f"{self.mcp_url}/api/health") as response:
+            if response.status != 200:
+                raise FlowError(f"MCP health answered {response.status}")
+
+    async def call(self, path, data, stage):
+        async with self.session.post(f"{self.mcp_url}{path}", json=data) as response:
+            body = await response.json(content_type=None)
+            if response.status >= 300:
+                raise FlowError(f"{stage}: HTTP {response.status}")
+            return body
+
+    async def flow(self, n, results):
+        request_id = f"lt-{self.run_id}-{n}"
+        software, version, winget_id = MCP_PACKAGES[n % len(MCP_PACKAGES)]
+        started = mark = time.perf_counter()
+
+        def lap(stage):
+            nonlocal mark
+            now = time.perf_counter()
+            results.record(stage, now - mark)
+            mark = now
+
+        ticket = await self.call("/api/create_ticket", {
+            "user_id": request_id, "software": software, "version": version,
+        }, "create_ticket")
+        lap("create_ticket")
+        update = {"ticket_number": ticket["ticket_number"], "sys_id": ticket.get("sys_id")}
+        await self.call("/api/update_ticket", dict(update, status="approved", comments="Approved (load test)"),
+                        "update_ticket")
+        lap("update_ticket")
+
+        finished = self.connector.expect_job(request_id)
+        run = await self.call("/api/run_job", {
+            "job_id": "loadtest-job", "software": software, "winget_id": winget_id,
+            "version": version, "request_id": request_id,
+        }, "run_job")
+        if not run.get("execution_id"):
+            raise FlowError(f"run_job: {run.get('message', 'no execution')}")
+        lap("run_job")
+        try:
+            result = await asyncio.wait_for(finished, self.timeout)
+        except asyncio.TimeoutError:
+            raise FlowError("timed out waiting for install")
+        finally:
+            self.connector.job_results.pop(request_id, None)
+        lap("install")
+
+        status = "completed" if result.get("status") == "success" else "failed"
+        await self.call("/api/update_ticket", dict(update, status=status, comments=f"Installation {status}"),
+                        "close_ticket")
+        lap("close_ticket")
+        results.record("total", time.perf_counter() - started)
+        return "succeeded" if status == "completed" else "failed"
+
+
+# ================== RUN ==================
+async def run_flows(driver, results, flows, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def one(n):
+        nonlocal done
+        async with slots:
+            try:
+                outcome = await driver.flow(n, results)
+                results.ok += 1
+                results.outcomes[outcome] = results.outcomes.get(outcome, 0) + 1
+            except FlowError as e:
+                results.error(str(e))
+            except Exception as e:
+                results.error(f"{type(e).__name__}: {e}")
+            done += 1
+            if done % max(1, flows // 10) == 0:
+                print(f"  {done}/{flows} flows done")
+
+    await asyncio.gather(*(one(n) for n in range(flows)))
+
+
+def spawn_services(args, connector_url, workdir):
+    """Start the MCP server (and the bot for --target bot) against the simulators"""
+    env = dict(os.environ)
+    env.update({
+        "MCP_PORT": str(args.mcp_port),
+        "MCP_SERVER_MODE": "production",
+        "SNOW_INSTANCE": f"http://{args.host}:{args.snow_port}",
+        "SNOW_USERNAME": "loadtest",
+        "SNOW_PASSWORD": "loadtest",
+        "RUNDECK_URL": f"http://{args.host}:{args.rundeck_port}",
+        "RUNDECK_TOKEN": "loadtest",
+        "BOT_CALLBACK_URL": (f"{args.bot_url.rstrip('/')}/api/job_status" if args.target == "bot"
+                             else f"{connector_url}/api/job_status"),
+        "MCP_SERVER_URL": f"http://{args.host}:{args.mcp_port}",
+        "MICROSOFT_APP_ID": "",
+        "MICROSOFT_APP_PASSWORD": "",
+        "PYTHONUNBUFFERED": "1",
+    })
+    if args.webhooks:
+        env["RUNDECK_WEBHOOK_TOKEN"] = WEBHOOK_TOKEN
+    if args.approval_policy:
+        env["APPROVAL_POLICY_FILE"] = os.path.abspath(args.approval_policy)
+    env.setdefault("EXEC_POLL_MIN_INTERVAL", "0.5")
+    env.setdefault("EXEC_POLL_MAX_INTERVAL", "2")
+    env.setdefault("SNOW_UPDATE_WINDOW", "0.5")
+    processes = []
+    commands = [("mcp", [sys.executable, os.path.join(ROOT, "mcp-server", "mcp_server.py")])]
+    if args.target == "bot":
+        commands.append(("bot", [sys.executable, os.path.join(ROOT, "bot", "app.py")]))
+    for name, command in commands:
+        log = open(os.path.join(workdir, f"{name}.log"), "w")
+        # The bot keeps its SQLite database in the working directory
+        processes.append(subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT))
+    print(f"Service logs in {workdir}")
+    return processes
+
+
+async def wait_healthy(session, url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} did not become healthy")
+
+
+async def main(args):
+    run_id = uuid.uuid4().hex[:8]
+    connector = ConnectorSimulator()
+    connector_url = f"http://{args.host}:{args.connector_port}"
+    runners = [await serve(connector.app(), args.host, args.connector_port)]
+    processes = []
+    snow = rundeck = None
+    if args.spawn:
+        if args.webhooks:
+            args.rundeck_webhook_url = f"http://{args.host}:{args.mcp_port}/api/webhooks/rundeck?token={WEBHOOK_TOKEN}"
+        snow, rundeck = build_simulators(args)
+        runners.append(await serve(snow.app(), args.host, args.snow_port))
+        runners.append(await serve(rundeck.app(), args.host, args.rundeck_port))
+        processes = spawn_services(args, connector_url, tempfile.mkdtemp(prefix="loadtest-"))
+
+    connector_limit = aiohttp.TCPConnector(limit=max(100, args.concurrency * 2))
+    session = aiohttp.ClientSession(connector=connector_limit, timeout=aiohttp.ClientTimeout(total=args.timeout))
+    try:
+        if args.spawn:
+            await wait_healthy(session, f"http://{args.host}:{args.mcp_port}/api/health")
+            if args.target == "bot":
+                await wait_healthy(session, f"{args.bot_url.rstrip('/')}/health")
+        if args.target == "bot":
+            driver = BotDriver(session, args.bot_url, connector, connector_url, args.timeout, run_id)
+            results = Results(BOT_STAGES)
+        else:
+            driver = MCPDriver(session, args.mcp_url or f"http://{args.host}:{args.mcp_port}", connector,
+                               args.timeout, run_id)
+            results = Results(MCP_STAGES)
+        await driver.warm_up()
+
+        print(f"Running {args.flows} {args.target} flows at concurrency {args.concurrency}")
+        received = connector.received
+        started = time.perf_counter()
+        await run_flows(driver, results, args.flows, args.concurrency)
+        summary = results.summary(time.perf_counter() - started)
+        if args.target == "bot":
+            # Final card edits trail the result message
+            await asyncio.sleep(float(os.getenv("CARD_UPDATE_WINDOW", "0.5")) + 0.5)
+            summary["connector_calls_per_flow"] = round((connector.received - received) / max(1, args.flows), 2)
+        if snow is not None:
+            summary["upstreams"] = {"servicenow": snow.upstream.counts, "rundeck": rundeck.upstream.counts}
+        print_summary(summary)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(summary, f, indent=2)
+        return summary
+    finally:
+        await session.close()
+        if processes:
+            # Let write-behind ticket updates land before stopping the services
+            await asyncio.sleep(float(os.getenv("SNOW_UPDATE_WINDOW", "0.5")) + 1)
+        for process in processes:
+            process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for runner in runners:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load driver for the software-install bot and MCP server")
+    parser.add_argument("--target", choices=["bot", "mcp"], default="bot",
+                        help="bot: full select -> approve -> accept flow via /api/messages; mcp: MCP endpoints only")
+    parser.add_argument("--flows", type=int, default=100, help="Number of request flows to run")
+    parser.add_argument("--concurrency", type=int, default=10, help="Flows in flight at once")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for each stage")
+    parser.add_argument("--bot-url", default="http://localhost:3978")
+    parser.add_argument("--mcp-url", default=None, help="MCP server URL (default: spawned one)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--connector-port", type=int, default=8830, help="Port of the fake Bot Connector")
+    parser.add_argument("--json", help="Write the summary to this file")
+    parser.add_argument("--spawn", action="store_true",
+                        help="Start the simulators, the MCP server and the bot locally for the run")
+    parser.add_argument("--mcp-port", type=int, default=5050, help="Port of the spawned MCP server")
+    parser.add_argument("--webhooks", action="store_true",
+                        help="Spawned Rundeck simulator reports finished executions by webhook instead of being polled")
+    parser.add_argument("--approval-policy", help="Auto-approval policy file for the spawned bot")
+    parser.add_argument("--snow-port", type=int, default=8810)
+    parser.add_argument("--rundeck-port", type=int, default=8820)
+    add_upstream_arguments(parser)
+    summary = asyncio.run(main(parser.parse_args()))
+    sys.exit(1 if summary["flows_failed"] else 0)
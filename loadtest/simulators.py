@@ -0,0 +1,396 @@
+import json
+import time
+import uuid
+import base64
+import random
+import asyncio
+import argparse
+import aiohttp
+from aiohttp import web
+
+
+class Latency:
+    """Response-time distribution parsed from a spec string.
+
+    ``fixed:MS``, ``uniform:MIN_MS:MAX_MS``, ``exp:MEAN_MS`` or
+    ``lognormal:MEDIAN_MS:SIGMA`` (long-tailed, the default for upstreams).
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        if kind not in ("fixed", "uniform", "exp", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self):
+        """One delay in seconds"""
+        p = self.params
+        if self.kind == "fixed":
+            ms = p[0]
+        elif self.kind == "uniform":
+            ms = random.uniform(p[0], p[1])
+        elif self.kind == "exp":
+            ms = random.expovariate(1.0 / p[0]) if p[0] > 0 else 0.0
+        else:
+            ms = p[0] * random.lognormvariate(0.0, p[1] if len(p) > 1 else 0.5)
+        return max(0.0, ms) / 1000.0
+
+
+class RateLimiter:
+    """Token bucket; ``rate`` requests/second with ``burst`` capacity (0 = unlimited)"""
+
+    def __init__(self, rate=0.0, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """None if admitted, otherwise seconds until a token is available"""
+        if self.rate <= 0:
+            return None
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        return (1 - self.tokens) / self.rate
+
+
+class Upstream:
+    """Latency, error-rate and rate-limit behaviour shared by a simulator's endpoints"""
+
+    def __init__(self, name, latency="lognormal:80:0.5", error_rate=0.0, rate_limit=0.0, burst=None):
+        self.name = name
+        self.latency = Latency(latency)
+        self.error_rate = error_rate
+        self.limiter = RateLimiter(rate_limit, burst)
+        self.counts = {"requests": 0, "errors": 0, "throttled": 0}
+
+    def middleware(self):
+        @web.middleware
+        async def simulate(request, handler):
+            self.counts["requests"] += 1
+            wait = self.limiter.take()
+            if wait is not None:
+                self.counts["throttled"] += 1
+                return web.json_response(
+                    {"error": {"message": "Rate limit exceeded"}},
+                    status=429,
+                    headers={"Retry-After": str(max(1, round(wait)))},
+                )
+            await asyncio.sleep(self.latency.sample())
+            if self.error_rate and random.random() < self.error_rate:
+                self.counts["errors"] += 1
+                return web.json_response({"error": {"message": "Simulated upstream failure"}}, status=500)
+            return await handler(request)
+        return simulate
+
+
+# ================== SERVICENOW ==================
+class ServiceNowSimulator:
+    """In-memory incident table behind the Table API and the Batch API"""
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.incidents = {}
+        self.by_number = {}
+        self._next = 1
+
+    def app(self):
+        app = web.Application(middlewares=[self.upstream.middleware()])
+        app.router.add_post("/api/now/table/incident", self.create)
+        app.router.add_get("/api/now/table/incident", self.query)
+        app.router.add_patch("/api/now/table/incident/{sys_id}", self.patch)
+        app.router.add_post("/api/now/v1/batch", self.batch)
+        return app
+
+    async def create(self, req):
+        data = await req.json()
+        number = f"INC{self._next:07d}"
+        self._next += 1
+        record = dict(data, number=number, sys_id=uuid.uuid4().hex, state="1")
+        self.incidents[record["sys_id"]] = record
+        self.by_number[number] = record
+        return web.json_response({"result": record}, status=201)
+
+    async def query(self, req):
+        numbers = []
+        if req.query.get("number"):
+            numbers = [req.query["number"]]
+        query = req.query.get("sysparm_query", "")
+        if query.startswith("numberIN"):
+            numbers = query[len("numberIN"):].split(",")
+        found = [self.by_number[n] for n in numbers if n in self.by_number]
+        fields = [f for f in req.query.get("sysparm_fields", "").split(",") if f]
+        if fields:
+            found = [{f: r.get(f) for f in fields} for r in found]
+        return web.json_response({"result": found})
+
+    def apply(self, sys_id, fields):
+        record = self.incidents.get(sys_id)
+        if record is None:
+            return 404, {"error": {"message": "No Record found"}}
+        record.update(fields)
+        return 200, {"result": record}
+
+    async def patch(self, req):
+        status, body = self.apply(req.match_info["sys_id"], await req.json())
+        return web.json_response(body, status=status)
+
+    async def batch(self, req):
+        data = await req.json()
+        served = []
+        for rest in data.get("rest_requests", []):
+            sys_id = rest.get("url", "").rsplit("/", 1)[-1]
+            fields = json.loads(base64.b64decode(rest.get("body") or "e30="))
+            status, body = self.apply(sys_id, fields)
+            served.append({
+                "id": rest.get("id"),
+                "status_code": status,
+                "body": base64.b64encode(json.dumps(body).encode()).decode(),
+            })
+        return web.json_response({"batch_request_id": data.get("batch_request_id"), "serviced_requests": served})
+
+
+# ================== RUNDECK ==================
+class RundeckSimulator:
+    """Job runs that finish after a sampled duration, with a configurable failure rate.
+
+    With ``webhook_url`` every execution is also reported there when it
+    ends, like a job notification (webhook, JSON format) in Rundeck.
+    """
+
+    def __init__(self, upstream, duration="lognormal:3000:0.4", failure_rate=0.0, project="loadtest", nodes=100,
+                 webhook_url=None):
+        self.upstream = upstream
+        self.duration = Latency(duration)
+        self.failure_rate = failure_rate
+        self.project = project
+        self.nodes = [f"node-{n:04d}" for n in range(1, nodes + 1)]
+        self.webhook_url = webhook_url
+        self.webhooks_sent = 0
+        self.executions = {}
+        self._next = 1
+
+    def app(self):
+        app = web.Application(middlewares=[self.upstream.middleware()])
+        app.router.add_post("/api/40/job/{job_id}/run", self.run)
+        app.router.add_get("/api/40/execution/{execution_id}", self.get)
+        app.router.add_get("/api/40/execution/{execution_id}/output", self.output)
+        app.router.add_get("/api/40/project/{project}/executions/running", self.running)
+        app.router.add_get("/api/40/project/{project}/executions", self.query)
+        app.router.add_get("/api/40/project/{project}/resources", self.resources)
+        app.router.add_get("/api/40/projects", lambda req: web.json_response([{"name": self.project}]))
+        return app
+
+    def _view(self, execution):
+        if execution["status"] == "running" and time.time() >= execution["finish_at"]:
+            execution["status"] = execution["final"]
+        return {
+            "id": execution["id"],
+            "project": execution["project"],
+            "status": execution["status"],
+            "job": {"id": execution["job_id"]},
+            "argstring": execution["argstring"],
+            "date-started": {"unixtime": int(execution["started"] * 1000)},
+        }
+
+    async def run(self, req):
+        data = await req.json()
+        execution_id = self._next
+        self._next += 1
+        now = time.time()
+        self.executions[execution_id] = {
+            "id": execution_id,
+            "project": self.project,
+            "job_id": req.match_info["job_id"],
+            "argstring": data.get("argString") or " ".join(f"-{k} {v}" for k, v in (data.get("options") or {}).items()),
+            "filter": data.get("filter"),
+            "started": now,
+            "finish_at": now + self.duration.sample(),
+            "final": "failed" if random.random() < self.failure_rate else "succeeded",
+            "status": "running",
+        }
+        if self.webhook_url:
+            asyncio.create_task(self._notify(self.executions[execution_id]))
+        return web.json_response(self._view(self.executions[execution_id]))
+
+    async def _notify(self, execution):
+        await asyncio.sleep(max(0.0, execution["finish_at"] - time.time()))
+        view = self._view(execution)
+        payload = {
+            "trigger": "success" if view["status"] == "succeeded" else "failure",
+            "status": view["status"],
+            "executionId": view["id"],
+            "execution": view,
+        }
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(self.webhook_url, json=payload) as response:
+                    await response.read()
+            self.webhooks_sent += 1
+        except aiohttp.ClientError as e:
+            print(f"Rundeck simulator: webhook for execution {view['id']} failed: {e}")
+
+    def _execution(self, req):
+        try:
+            return self.executions[int(req.match_info["execution_id"])]
+        except (KeyError, ValueError):
+            raise web.HTTPNotFound(text=json.dumps({"error": True, "message": "Execution not found"}),
+                                   content_type="application/json")
+
+    async def get(self, req):
+        return web.json_response(self._view(self._execution(req)))
+
+    async def output(self, req):
+        view = self._view(self._execution(req))
+        completed = view["status"] != "running"
+        entries = [{"log": f"Running {view['argstring']}"}]
+        if completed:
+            entries.append({"log": f"Execution {view['id']} {view['status']}"})
+        offset = int(req.query.get("offset", 0))
+        return web.json_response({"entries": entries[offset:], "offset": len(entries), "execCompleted": completed})
+
+    def _page(self, req, executions):
+        offset = int(req.query.get("offset", 0))
+        size = int(req.query.get("max", 20))
+        return web.json_response({
+            "paging": {"count": len(executions[offset:offset + size]), "total": len(executions),
+                       "offset": offset, "max": size},
+            "executions": executions[offset:offset + size],
+        })
+
+    async def running(self, req):
+        project = req.match_info["project"]
+        views = [self._view(e) for e in self.executions.values() if e["project"] == project]
+        return self._page(req, [v for v in views if v["status"] == "running"])
+
+    async def query(self, req):
+        project = req.match_info["project"]
+        job_ids = set(req.query.getall("jobIdListFilter", []))
+        begin = int(req.query.get("begin", 0))
+        views = [
+            self._view(e) for e in self.executions.values()
+            if e["project"] == project and (not job_ids or e["job_id"] in job_ids)
+            and e["started"] * 1000 >= begin
+        ]
+        return self._page(req, views)
+
+    async def resources(self, req):
+        return web.json_response({name: {"nodename": name} for name in self.nodes})
+
+
+# ================== BOT CONNECTOR ==================
+class ConnectorSimulator:
+    """Stands in for the Bot Connector service the bot replies to (activity serviceUrl).
+
+    Every posted activity is queued per conversation so the load driver can
+    wait for the bot's answers; ``/api/job_status`` captures execution
+    results when the MCP server's callback URL points here.
+    """
+
+    def __init__(self):
+        self.inboxes = {}
+        self.job_results = {}
+        self.received = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/v3/conversations/{conversation_id}/activities", self.post_activity)
+        app.router.add_post("/v3/conversations/{conversation_id}/activities/{activity_id}", self.post_activity)
+        app.router.add_put("/v3/conversations/{conversation_id}/activities/{activity_id}", self.post_activity)
+        app.router.add_post("/api/job_status", self.job_status)
+        return app
+
+    def inbox(self, conversation_id):
+        if conversation_id not in self.inboxes:
+            self.inboxes[conversation_id] = asyncio.Queue()
+        return self.inboxes[conversation_id]
+
+    async def post_activity(self, req):
+        activity = await req.json()
+        self.received += 1
+        activity_id = req.match_info.get("activity_id") if req.method == "PUT" else uuid.uuid4().hex
+        activity["_received"] = time.perf_counter()
+        activity["_method"] = req.method
+        self.inbox(req.match_info["conversation_id"]).put_nowait(activity)
+        return web.json_response({"id": activity_id})
+
+    async def job_status(self, req):
+        data = await req.json()
+        future = self.job_results.get(str(data.get("request_id")))
+        if future is not None and not future.done():
+            future.set_result(data)
+        return web.json_response({"success": True})
+
+    def expect_job(self, request_id):
+        future = asyncio.get_running_loop().create_future()
+        self.job_results[str(request_id)] = future
+        return future
+
+
+def add_upstream_arguments(parser):
+    parser.add_argument("--snow-latency", default="lognormal:120:0.5", help="ServiceNow response time distribution")
+    parser.add_argument("--snow-error-rate", type=float, default=0.0, help="Fraction of ServiceNow calls answered 500")
+    parser.add_argument("--snow-rate-limit", type=float, default=0.0, help="ServiceNow requests/second before 429 (0 = none)")
+    parser.add_argument("--rundeck-latency", default="lognormal:60:0.5", help="Rundeck API response time distribution")
+    parser.add_argument("--rundeck-error-rate", type=float, default=0.0, help="Fraction of Rundeck calls answered 500")
+    parser.add_argument("--rundeck-rate-limit", type=float, default=0.0, help="Rundeck requests/second before 429 (0 = none)")
+    parser.add_argument("--exec-duration", default="lognormal:3000:0.4", help="Rundeck execution run time distribution")
+    parser.add_argument("--exec-failure-rate", type=float, default=0.0, help="Fraction of executions that end failed")
+    parser.add_argument("--nodes", type=int, default=100, help="Nodes in the simulated Rundeck project")
+    parser.add_argument("--rundeck-webhook-url", default=None,
+                        help="Post a job notification here when each execution ends (MCP /api/webhooks/rundeck)")
+
+
+def build_simulators(args):
+    """(ServiceNowSimulator, RundeckSimulator) configured from parsed arguments"""
+    snow = ServiceNowSimulator(Upstream("servicenow", args.snow_latency, args.snow_error_rate, args.snow_rate_limit))
+    rundeck = RundeckSimulator(
+        Upstream("rundeck", args.rundeck_latency, args.rundeck_error_rate, args.rundeck_rate_limit),
+        duration=args.exec_duration,
+        failure_rate=args.exec_failure_rate,
+        nodes=args.nodes,
+        webhook_url=args.rundeck_webhook_url,
+    )
+    return snow, rundeck
+
+
+async def serve(app, host, port):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def main(args):
+    snow, rundeck = build_simulators(args)
+    runners = [
+        await serve(snow.app(), args.host, args.snow_port),
+        await serve(rundeck.app(), args.host, args.rundeck_port),
+    ]
+    print(f"ServiceNow simulator on http://{args.host}:{args.snow_port}")
+    print(f"Rundeck simulator on http://{args.host}:{args.rundeck_port}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"servicenow {snow.upstream.counts}  rundeck {rundeck.upstream.counts}")
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local ServiceNow and Rundeck simulators for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--snow-port", type=int, default=8810)
+    parser.add_argument("--rundeck-port", type=int, default=8820)
+    add_upstream_arguments(parser)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
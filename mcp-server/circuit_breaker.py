@@ -0,0 +1,86 @@
+import os
+import time
+import threading
+import requests
+import tracing
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """Raised without calling the upstream while its circuit is open"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed / open / half-open circuit breaker for one upstream (thread-safe).
+
+    ``failure_threshold`` consecutive failures open the circuit. While open,
+    ``before_call`` raises ``CircuitOpen`` immediately. After
+    ``reset_timeout`` seconds the circuit is half-open and lets up to
+    ``half_open_max`` probe calls through: a successful probe closes the
+    circuit, a failed one opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None, half_open_max=None):
+        prefix = f"{name.upper()}_CB_"
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv(prefix + "FAILURE_THRESHOLD", "5"))
+        self.reset_timeout = reset_timeout or float(os.getenv(prefix + "RESET_TIMEOUT", "30"))
+        self.half_open_max = half_open_max or int(os.getenv(prefix + "HALF_OPEN_MAX", "1"))
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """Seconds until the circuit lets a probe through (0 when closed)"""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.time())
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpen; every admitted call must be followed by record()"""
+        with self._lock:
+            if self.state == "open":
+                if time.time() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpen(f"{self.name}: circuit open", self.retry_after())
+                self.state = "half_open"
+                self.probes = 0
+            if self.state == "half_open":
+                if self.probes >= self.half_open_max:
+                    self.rejected += 1
+                    raise CircuitOpen(f"{self.name}: circuit half-open, probe in flight", 1.0)
+                self.probes += 1
+
+    def cancel(self):
+        """Give back an admitted call that never reached the upstream"""
+        with self._lock:
+            if self.state == "half_open" and self.probes > 0:
+                self.probes -= 1
+
+    def record(self, success):
+        with self._lock:
+            if success:
+                self.state = "closed"
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    tracing.log(f"⚠️ Circuit for {self.name} opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_after": round(self.retry_after(), 1),
+                "rejected_total": self.rejected,
+            }
@@ -0,0 +1,295 @@
+import os
+import time
+import threading
+import requests
+from http_pool import UpstreamSession
+from metrics import EXECUTIONS_FINISHED
+import tracing
+
+FINAL_STATUSES = {"succeeded", "failed", "aborted", "timedout", "failed-with-retry", "other"}
+# Webhook results for executions not tracked yet are kept this long
+EARLY_RESULT_TTL = 600
+# An execution Rundeck answers 404 for this many times in a row is reported as "other" (failed)
+MAX_NOT_FOUND = int(os.getenv("EXEC_MAX_NOT_FOUND", "3"))
+
+
+class ExecutionTracker:
+    """Track in-flight Rundeck executions with a single shared poller.
+
+    Every tick the poller lists the running executions of each project in one
+    call, then resolves the ones that dropped out of that list with one bulk
+    executions query. Cost per tick is a handful of calls regardless of how
+    many installs are in flight. The interval starts at ``min_interval`` and
+    backs off to ``max_interval`` while nothing changes; with nothing in
+    flight the poller sleeps until the next execution is tracked.
+
+    With ``webhooks`` (Rundeck job notifications posted to the MCP
+    server), ``complete`` finishes executions as soon as Rundeck reports
+    them and polling drops to a safety net every ``fallback_interval``
+    seconds for lost notifications.
+
+    Final status and output are pushed to the bot's callback URL. Failed
+    deliveries are retried on the next tick. Executions tracked with an
+    ``on_finish`` callable are reported to it instead (in-process consumers
+    such as rollouts). Both run in the trace that was current at ``track``.
+    """
+
+    def __init__(self, rundeck_client, callback_url=None, min_interval=None, max_interval=None,
+                 webhooks=None, fallback_interval=None):
+        self.rundeck = rundeck_client
+        self.callback_url = callback_url or os.getenv("BOT_CALLBACK_URL", "http://localhost:3978/api/job_status")
+        self.callback_token = os.getenv("BOT_CALLBACK_TOKEN", "")
+        self.min_interval = min_interval or float(os.getenv("EXEC_POLL_MIN_INTERVAL", "2"))
+        self.max_interval = max_interval or float(os.getenv("EXEC_POLL_MAX_INTERVAL", "30"))
+        self.webhooks = bool(os.getenv("RUNDECK_WEBHOOK_TOKEN")) if webhooks is None else webhooks
+        self.fallback_interval = fallback_interval or float(os.getenv("EXEC_POLL_FALLBACK_INTERVAL", "60"))
+        self.interval = self.min_interval
+        self.http = UpstreamSession("bot")
+        self._executions = {}
+        self._undelivered = {}
+        self._early = {}
+        self._last_poll = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="execution-tracker", daemon=True)
+            self._thread.start()
+
+    def track(self, execution_id, project=None, job_id=None, context=None, on_finish=None):
+        """Start tracking an execution; context is echoed back in the completion callback.
+
+        With ``on_finish``, ``on_finish(execution_id, rundeck_status)`` is
+        called from the poller thread instead of posting to the bot.
+        """
+        record = {
+            "execution_id": str(execution_id),
+            "project": project,
+            "job_id": job_id,
+            "context": context or {},
+            "started": time.time(),
+            "on_finish": on_finish,
+            "traceparent": tracing.traceparent(),
+        }
+        with self._lock:
+            early = self._early.pop(record["execution_id"], None)
+            if early is None:
+                self._executions[record["execution_id"]] = record
+        if early is not None:
+            # Rundeck's notification beat run_job's response; the poller delivers it
+            self._finish(record, early[0])
+        self.interval = self.min_interval
+        self._wake.set()
+        self.start()
+
+    def complete(self, execution_id, rundeck_status):
+        """Finish an execution reported by a Rundeck webhook; returns what happened to it.
+
+        "finished": delivered (or queued for retry) right away. "early": not
+        tracked yet, kept until ``track``. "ignored": not a final status,
+        e.g. an onstart notification.
+        """
+        execution_id = str(execution_id)
+        if rundeck_status not in FINAL_STATUSES:
+            return "ignored"
+        now = time.time()
+        with self._lock:
+            record = self._executions.pop(execution_id, None)
+            if record is None:
+                self._early = {k: v for k, v in self._early.items() if now - v[1] < EARLY_RESULT_TTL}
+                self._early[execution_id] = (rundeck_status, now)
+                return "early"
+        self._finish(record, rundeck_status)
+        self._deliver([execution_id])
+        return "finished"
+
+    def status(self, execution_id):
+        with self._lock:
+            record = self._executions.get(str(execution_id))
+            if record:
+                return "running"
+            record = self._undelivered.get(str(execution_id))
+            return record["rundeck_status"] if record else None
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._executions)
+
+    # ---------- poller ----------
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._executions and not self._undelivered
+            if idle:
+                self._wake.wait()
+                self._wake.clear()
+                self._last_poll = time.monotonic()
+                continue
+            if self.webhooks:
+                self._run_webhook_tick()
+                continue
+            try:
+                changed = self.poll_once()
+            except Exception as e:
+                tracing.log(f"Execution poll error: {e}")
+                changed = False
+            if changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.max_interval, self.interval * 1.5)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _run_webhook_tick(self):
+        """Retry undelivered results; poll Rundeck only once per fallback interval"""
+        if time.monotonic() - self._last_poll >= self.fallback_interval:
+            self._last_poll = time.monotonic()
+            try:
+                self.poll_once()
+            except Exception as e:
+                tracing.log(f"Execution poll error: {e}")
+        else:
+            self._deliver()
+        with self._lock:
+            undelivered = bool(self._undelivered)
+        timeout = self.fallback_interval - (time.monotonic() - self._last_poll)
+        if undelivered:
+            timeout = min(timeout, self.min_interval)
+        self._wake.wait(max(0.0, timeout))
+        self._wake.clear()
+
+    def poll_once(self):
+        """Run one poll over all in-flight executions; returns True if any finished.
+
+        A failing lookup only skips its own project or execution for this
+        tick, and finished results are delivered whatever else failed.
+        """
+        try:
+            return self._poll()
+        finally:
+            self._deliver()
+
+    def _poll(self):
+        with self._lock:
+            records = list(self._executions.values())
+        finished = []
+        self._resolve_projects(records, finished)
+
+        by_project = {}
+        for record in records:
+            if record["project"]:
+                by_project.setdefault(record["project"], []).append(record)
+
+        for project, project_records in by_project.items():
+            try:
+                running_ids = {str(e.get("id")) for e in self.rundeck.running_executions(project)}
+            except Exception as e:
+                tracing.log(f"Could not list running executions of project {project}: {e}")
+                continue
+            done = [r for r in project_records if r["execution_id"] not in running_ids]
+            if not done:
+                continue
+            begin_ms = min(r["started"] for r in done) * 1000 - 60000
+            job_ids = {r["job_id"] for r in done if r["job_id"]}
+            statuses = {}
+            if job_ids:
+                try:
+                    statuses = {
+                        str(e.get("id")): e.get("status")
+                        for e in self.rundeck.query_executions(project, job_ids, begin_ms)
+                    }
+                except Exception as e:
+                    tracing.log(f"Could not query executions of project {project}: {e}")
+            for record in done:
+                status = statuses.get(record["execution_id"])
+                if status is None:
+                    execution = self._lookup(record, finished)
+                    status = execution.get("status") if execution else None
+                if status in FINAL_STATUSES:
+                    finished.append((record, status))
+
+        for record, status in finished:
+            with self._lock:
+                if self._executions.pop(record["execution_id"], None) is None:
+                    # Finished by a webhook meanwhile
+                    continue
+            self._finish(record, status)
+        return bool(finished)
+
+    def _finish(self, record, status):
+        """Hand a finished (already untracked) execution to its consumer or the delivery queue"""
+        EXECUTIONS_FINISHED.labels(status).inc()
+        if record["on_finish"]:
+            with tracing.start_span("execution finished", parent=record["traceparent"],
+                                    execution_id=record["execution_id"], status=status):
+                try:
+                    record["on_finish"](record["execution_id"], status)
+                except Exception as e:
+                    tracing.log(f"Execution {record['execution_id']} finish callback error: {e}")
+            return
+        try:
+            output, _, _ = self.rundeck.execution_output(record["execution_id"])
+        except Exception as e:
+            output = f"(could not fetch execution output: {e})"
+        with self._lock:
+            self._undelivered[record["execution_id"]] = dict(record, rundeck_status=status, output=output)
+
+    def _resolve_projects(self, records, finished):
+        for record in records:
+            if record["project"]:
+                continue
+            execution = self._lookup(record, finished)
+            if execution:
+                record["project"] = execution.get("project")
+                record["job_id"] = record["job_id"] or (execution.get("job") or {}).get("id")
+
+    def _lookup(self, record, finished):
+        """One execution from Rundeck, or None if that failed.
+
+        After ``MAX_NOT_FOUND`` 404s in a row (an unknown or purged id) the
+        execution is added to ``finished`` as "other", so its request fails
+        instead of waiting forever.
+        """
+        try:
+            execution = self.rundeck.get_execution(record["execution_id"])
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                tracing.log(f"Could not look up execution {record['execution_id']}: {e}")
+                return None
+            record["not_found"] = record.get("not_found", 0) + 1
+            tracing.log(f"Execution {record['execution_id']} not found in Rundeck ({record['not_found']}/{MAX_NOT_FOUND})")
+            if record["not_found"] >= MAX_NOT_FOUND:
+                finished.append((record, "other"))
+            return None
+        except Exception as e:
+            tracing.log(f"Could not look up execution {record['execution_id']}: {e}")
+            return None
+        record["not_found"] = 0
+        return execution
+
+    def _deliver(self, execution_ids=None):
+        with self._lock:
+            pending = [
+                r for r in self._undelivered.values() if execution_ids is None or r["execution_id"] in execution_ids
+            ]
+        headers = {"Authorization": f"Bearer {self.callback_token}"} if self.callback_token else None
+        for record in pending:
+            payload = dict(
+                record["context"],
+                execution_id=record["execution_id"],
+                status="success" if record["rundeck_status"] == "succeeded" else "failed",
+                rundeck_status=record["rundeck_status"],
+                output=record["output"],
+            )
+            with tracing.start_span("deliver execution result", parent=record["traceparent"],
+                                    execution_id=record["execution_id"], status=record["rundeck_status"]):
+                try:
+                    response = self.http.post(self.callback_url, json=payload, headers=headers, timeout=10)
+                    response.raise_for_status()
+                except requests.exceptions.RequestException as e:
+                    tracing.log(f"Could not deliver execution {record['execution_id']} result: {e}")
+                    continue
+            with self._lock:
+                self._undelivered.pop(record["execution_id"], None)
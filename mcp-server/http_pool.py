@@ -0,0 +1,102 @@
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from circuit_breaker import CircuitBreaker, CircuitOpen
+from metrics import UPSTREAM_SECONDS
+import tracing
+
+
+class UpstreamBusy(requests.exceptions.RequestException):
+    """Raised when an upstream's concurrency limit stays exhausted for too long"""
+
+
+class UpstreamSession:
+    """Keep-alive connection pool to one upstream with a cap on concurrent calls.
+
+    Wraps a ``requests.Session`` whose adapter keeps up to ``pool_size``
+    connections open for reuse. ``max_in_flight`` bounds how many calls may
+    be outstanding at once; extra callers wait up to ``acquire_timeout``
+    seconds for a slot and then fail with ``UpstreamBusy``. Calls also go
+    through a ``CircuitBreaker``: timeouts, connection errors, 5xx and 429
+    responses count as failures, and while the circuit is open calls fail
+    with ``CircuitOpen`` before taking a slot or touching the network.
+    Calls made inside a trace get a client span and a ``traceparent`` header.
+    """
+
+    def __init__(self, name, pool_size=None, max_in_flight=None, acquire_timeout=None):
+        prefix = f"{name.upper()}_"
+        self.name = name
+        self.pool_size = pool_size or int(os.getenv(prefix + "POOL_SIZE", "100"))
+        self.max_in_flight = max_in_flight or int(os.getenv(prefix + "MAX_IN_FLIGHT", "100"))
+        self.acquire_timeout = acquire_timeout or float(os.getenv(prefix + "ACQUIRE_TIMEOUT", "30"))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, pool_block=False)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.breaker = CircuitBreaker(name)
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.rejected = 0
+
+    def request(self, method, url, **kwargs):
+        with tracing.start_span(f"{self.name} {method}", kind="client", child_only=True,
+                                **{"http.url": url.split("?")[0]}) as span:
+            kwargs["headers"] = tracing.inject(kwargs.get("headers"))
+            response = self._request(method, url, **kwargs)
+            span.set_attribute("http.status_code", response.status_code)
+            return response
+
+    def _request(self, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            self.breaker.before_call()
+        except CircuitOpen:
+            UPSTREAM_SECONDS.labels(self.name, method, "circuit_open").observe(0)
+            raise
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self.rejected += 1
+            # Local saturation says nothing about the upstream's health
+            self.breaker.cancel()
+            UPSTREAM_SECONDS.labels(self.name, method, "busy").observe(time.perf_counter() - started)
+            raise UpstreamBusy(f"{self.name}: {self.max_in_flight} calls already in flight")
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+        success = False
+        outcome = "error"
+        try:
+            response = self.session.request(method, url, **kwargs)
+            success = response.status_code < 500 and response.status_code != 429
+            outcome = str(response.status_code)
+            return response
+        finally:
+            UPSTREAM_SECONDS.labels(self.name, method, outcome).observe(time.perf_counter() - started)
+            self.breaker.record(success)
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "requests_total": self.requests,
+                "rejected_total": self.rejected,
+                "circuit": self.breaker.stats(),
+            }
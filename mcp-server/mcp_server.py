@@ -1,7 +1,14 @@
 from flask import Flask, request, jsonify
 from servicenow_real import ServiceNowClient
 from rundeck_real import RundeckClient
+from execution_tracker import ExecutionTracker
+from update_queue import TicketUpdateQueue
+from rollout import RolloutManager
+import metrics
+import tracing
 import os
+import hmac
+import math
 from flask_cors import CORS
 from dotenv import load_dotenv
 
@@ -10,14 +17,70 @@ load_dotenv()
 
 app = Flask(__name__)
 CORS(app)
+metrics.instrument(app)
+tracing.instrument(app)
 
 # Initialize clients
 snow_client = ServiceNowClient()
 rundeck_client = RundeckClient()
+execution_tracker = ExecutionTracker(rundeck_client)
+ticket_updates = TicketUpdateQueue(snow_client)
+rollouts = RolloutManager(rundeck_client, execution_tracker, ticket_updates)
+WRITE_BEHIND = os.getenv('SNOW_WRITE_BEHIND', '1') == '1'
+# Shared secret of the Rundeck job notification URL; webhooks are off without it
+RUNDECK_WEBHOOK_TOKEN = os.getenv('RUNDECK_WEBHOOK_TOKEN', '')
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+def collect_gauges():
+    """Point-in-time gauges for /metrics"""
+    for session in (snow_client.http, rundeck_client.http, execution_tracker.http):
+        stats = session.stats()
+        labels = {"upstream": session.name}
+        yield "mcp_upstream_in_flight", "Upstream calls in flight", labels, stats["in_flight"]
+        yield "mcp_upstream_max_in_flight", "Upstream concurrency limit (bulkhead)", labels, stats["max_in_flight"]
+        yield ("mcp_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+               labels, CIRCUIT_STATES[stats["circuit"]["state"]])
+    yield "mcp_pending_ticket_updates", "Tickets with a queued write-behind update", {}, ticket_updates.pending_count()
+    yield "mcp_tracked_executions", "Rundeck executions being polled", {}, execution_tracker.in_flight()
+    yield "mcp_active_rollouts", "Rollouts still dispatching or finishing", {}, rollouts.active_count()
+    traces = tracing.EXPORTER.stats()
+    yield "mcp_trace_queue", "Spans and log lines waiting for the exporter thread", {}, traces["queued"]
+    yield "mcp_trace_dropped", "Spans and log lines dropped because the export queue was full", {}, traces["dropped_total"]
+
+metrics.register_gauges(collect_gauges)
+
+def upstream_unavailable(client):
+    """503 with Retry-After while the client's circuit is open, else None"""
+    retry_after = client.http.breaker.retry_after()
+    if not retry_after:
+        return None
+    response = jsonify({
+        "success": False,
+        "error": f"{client.http.name} unavailable (circuit open)",
+        "retry_after": round(retry_after, 1)
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "healthy", "service": "MCP Server"})
+    return jsonify({
+        "status": "healthy",
+        "service": "MCP Server",
+        "pending_ticket_updates": ticket_updates.pending_count(),
+        "upstreams": {
+            "servicenow": snow_client.http.stats(),
+            "rundeck": rundeck_client.http.stats()
+        }
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    body, content_type = metrics.render()
+    return body, 200, {"Content-Type": content_type}
 
 @app.route('/api/create_ticket', methods=['POST'])
 def create_ticket():
@@ -35,19 +98,22 @@ def create_ticket():
             return jsonify({"error": "Missing required fields"}), 400
             
         # Create ticket in ServiceNow
-        ticket_number = snow_client.create_incident(user_id, software, version)
+        ticket_number, sys_id = snow_client.create_incident(
+            user_id, software, version, packages=data.get('packages'), approved_by=data.get('approved_by')
+        )
         
         if ticket_number:
             return jsonify({
                 "success": True,
                 "ticket_number": ticket_number,
+                "sys_id": sys_id,
                 "message": "Incident created successfully"
             })
         else:
-            return jsonify({
+            return upstream_unavailable(snow_client) or (jsonify({
                 "success": False,
                 "message": "Failed to create incident in ServiceNow"
-            }), 500
+            }), 500)
             
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
@@ -78,8 +144,37 @@ def update_ticket():
         
         snow_state = state_map.get(status, "2")  # Default to In Progress
         
+        if WRITE_BEHIND and not data.get('sync'):
+            # Coalesced with other pending updates of this ticket and flushed in batches.
+            # Not a success until flushed: callers resend the same update_id (or poll
+            # /api/ticket_updates/<update_id>) and keep their copy until then.
+            update_id = data.get('update_id')
+            state = ticket_updates.state(update_id) if update_id else None
+            if state == "flushed":
+                return jsonify({
+                    "success": True,
+                    "update_id": update_id,
+                    "message": "Incident updated successfully"
+                })
+            if state == "dropped":
+                # Reported once; a resend after that queues the update again
+                ticket_updates.forget(update_id)
+                return upstream_unavailable(snow_client) or (jsonify({
+                    "success": False,
+                    "update_id": update_id,
+                    "message": "Incident update was dropped after repeated ServiceNow failures"
+                }), 500)
+            update_id = ticket_updates.submit(ticket_number, snow_state, comments,
+                                              sys_id=data.get('sys_id'), update_id=update_id)
+            return jsonify({
+                "success": False,
+                "queued": True,
+                "update_id": update_id,
+                "message": "Incident update queued"
+            }), 202
+        
         # Update ticket in ServiceNow
-        success = snow_client.update_incident(ticket_number, snow_state, comments)
+        success = snow_client.update_incident(ticket_number, snow_state, comments, sys_id=data.get('sys_id'))
         
         if success:
             return jsonify({
@@ -87,14 +182,22 @@ def update_ticket():
                 "message": "Incident updated successfully"
             })
         else:
-            return jsonify({
+            return upstream_unavailable(snow_client) or (jsonify({
                 "success": False,
                 "message": "Failed to update incident in ServiceNow"
-            }), 500
+            }), 500)
             
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@app.route('/api/ticket_updates/<update_id>', methods=['GET'])
+def ticket_update_state(update_id):
+    """State of a queued write-behind update: pending, flushed or dropped"""
+    state = ticket_updates.state(update_id)
+    if state is None:
+        return jsonify({"update_id": update_id, "state": "unknown"}), 404
+    return jsonify({"update_id": update_id, "state": state})
+
 @app.route('/api/run_job', methods=['POST'])
 def run_job():
     """Execute a Rundeck job with Winget ID"""
@@ -107,22 +210,210 @@ def run_job():
         software = data.get('software')
         winget_id = data.get('winget_id')
         version = data.get('version')
+        packages = data.get('packages')
         
-        if not all([job_id, software, winget_id, version]):
-            return jsonify({"error": "Missing required fields"}), 400
-            
-        # Execute job in Rundeck with Winget ID
-        status, message = rundeck_client.run_job(job_id, software, winget_id, version)
+        if packages:
+            # Bundle: a single execution carrying every package
+            if not job_id or not isinstance(packages, list) or not all(
+                isinstance(p, dict) and all([p.get('software'), p.get('winget_id'), p.get('version')]) for p in packages
+            ):
+                return jsonify({"error": "Missing required fields"}), 400
+            status, message, execution = rundeck_client.run_bundle(job_id, packages)
+        else:
+            if not all([job_id, software, winget_id, version]):
+                return jsonify({"error": "Missing required fields"}), 400
+                
+            # Execute job in Rundeck with Winget ID
+            status, message, execution = rundeck_client.run_job(job_id, software, winget_id, version)
+        
+        if not execution:
+            unavailable = upstream_unavailable(rundeck_client)
+            if unavailable:
+                return unavailable
+        
+        execution_id = None
+        if execution:
+            execution_id = str(execution.get('id'))
+            # Final status is pushed to the bot by the shared poller
+            execution_tracker.track(
+                execution_id,
+                project=execution.get('project'),
+                job_id=job_id,
+                context={"request_id": data.get('request_id')}
+            )
         
         return jsonify({
             "status": status,
-            "message": message
+            "message": message,
+            "execution_id": execution_id
         })
             
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.route('/api/executions/<execution_id>', methods=['GET'])
+def execution_status(execution_id):
+    """Status of a tracked Rundeck execution"""
+    status = execution_tracker.status(execution_id)
+    if status is None:
+        return jsonify({"error": "Execution not tracked"}), 404
+    return jsonify({"execution_id": execution_id, "status": status})
+
+@app.route('/api/executions/<execution_id>/output', methods=['GET'])
+def execution_output(execution_id):
+    """Log output of a Rundeck execution from ?offset= (Rundeck's log offset), for tailing running installs"""
+    try:
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "Invalid offset"}), 400
+    try:
+        output, next_offset, completed = rundeck_client.execution_output(execution_id, offset)
+    except Exception as e:
+        return upstream_unavailable(rundeck_client) or (jsonify({"error": f"Rundeck error: {str(e)}"}), 502)
+    return jsonify({"output": output, "offset": next_offset, "completed": completed})
+
+@app.route('/api/executions/track', methods=['POST'])
+def track_executions():
+    """(Re-)register executions for status tracking, e.g. after an MCP server restart"""
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('executions'), list):
+            return jsonify({"error": "Missing required fields"}), 400
+            
+        for item in data['executions']:
+            if not item.get('execution_id'):
+                continue
+            execution_tracker.track(
+                item['execution_id'],
+                job_id=item.get('job_id'),
+                context={"request_id": item.get('request_id')}
+            )
+        
+        return jsonify({"success": True, "tracked": execution_tracker.in_flight()})
+            
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.route('/api/webhooks/rundeck', methods=['POST'])
+def rundeck_webhook():
+    """Rundeck job notification (webhook, JSON format) for an execution.
+
+    The token comes in the X-Rundeck-Webhook-Token header or as ?token= in
+    the notification URL. A final status finishes the tracked execution:
+    the result goes to the bot right away, which records it, updates the
+    ticket and messages the requester.
+    """
+    if not RUNDECK_WEBHOOK_TOKEN:
+        return jsonify({"error": "Rundeck webhooks are not enabled"}), 404
+    token = request.headers.get('X-Rundeck-Webhook-Token') or request.args.get('token', '')
+    if not hmac.compare_digest(token.encode(), RUNDECK_WEBHOOK_TOKEN.encode()):
+        metrics.RUNDECK_WEBHOOKS.labels("unauthorized").inc()
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            metrics.RUNDECK_WEBHOOKS.labels("invalid").inc()
+            return jsonify({"error": "No JSON data provided"}), 400
+        execution = data.get('execution') if isinstance(data.get('execution'), dict) else data
+        execution_id = data.get('executionId') or execution.get('id')
+        status = execution.get('status') or data.get('status')
+        if not execution_id or not status:
+            metrics.RUNDECK_WEBHOOKS.labels("invalid").inc()
+            return jsonify({"error": "Missing required fields"}), 400
+        tracing.set_attribute("execution_id", str(execution_id))
+        result = execution_tracker.complete(execution_id, status)
+        metrics.RUNDECK_WEBHOOKS.labels(result).inc()
+        return jsonify({"success": True, "execution_id": str(execution_id), "result": result})
+            
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.route('/api/rollouts', methods=['POST'])
+def create_rollout():
+    """Roll a package out to many nodes in waves (explicit nodes or a Rundeck node filter)"""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "No JSON data provided"}), 400
+            
+        job_id = data.get('job_id')
+        software = data.get('software')
+        winget_id = data.get('winget_id')
+        version = data.get('version')
+        nodes = data.get('nodes')
+        node_filter = data.get('node_filter')
+        
+        if not all([job_id, software, winget_id, version]) or not (nodes or (node_filter and data.get('project'))):
+            return jsonify({"error": "Missing required fields"}), 400
+            
+        # Planned (and validated) first so a bad request never leaves an orphan ticket
+        planned = rollouts.plan(
+            job_id, software, winget_id, version,
+            nodes=nodes,
+            node_filter=node_filter,
+            project=data.get('project'),
+            canary_size=data.get('canary_size'),
+            wave_size=data.get('wave_size'),
+            max_concurrency=data.get('max_concurrency'),
+            nodes_per_execution=data.get('nodes_per_execution'),
+            max_failure_rate=data.get('max_failure_rate')
+        )
+            
+        ticket_number = data.get('ticket_number')
+        sys_id = data.get('sys_id')
+        if not ticket_number:
+            # One ticket tracks the whole rollout
+            ticket_number, sys_id = snow_client.create_incident(data.get('requested_by', 'rollout'), software, version)
+        
+        rollout = rollouts.launch(planned, ticket_number, sys_id)
+        return jsonify(rollout), 202
+            
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@app.route('/api/rollouts/<rollout_id>', methods=['GET'])
+def rollout_status(rollout_id):
+    """Per-wave progress of a rollout"""
+    rollout = rollouts.status(rollout_id)
+    if rollout is None:
+        return jsonify({"error": "Rollout not found"}), 404
+    return jsonify(rollout)
+
+@app.route('/api/rollouts/<rollout_id>/abort', methods=['POST'])
+def abort_rollout(rollout_id):
+    """Stop dispatching new executions; running ones finish"""
+    rollout = rollouts.abort(rollout_id)
+    if rollout is None:
+        return jsonify({"error": "Rollout not found"}), 404
+    return jsonify(rollout)
+
 if __name__ == '__main__':
     port = int(os.environ.get('MCP_PORT', 5000))
-    print(f"Starting MCP Server on port {port}")
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    mode = os.environ.get('MCP_SERVER_MODE', 'dev')
+    # With debug=True the Werkzeug reloader re-runs this file in a child process
+    # that serves the requests; the watching parent must not poll or deliver
+    if mode == 'production' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        execution_tracker.start()
+        ticket_updates.start()
+        rollouts.start()
+    if mode == 'production':
+        # Multi-threaded production WSGI server: one thread per in-flight request,
+        # all sharing the pooled upstream sessions and the single execution poller
+        from waitress import serve
+        threads = int(os.environ.get('MCP_THREADS', 256))
+        print(f"Starting MCP Server on port {port} (production, {threads} threads)")
+        serve(
+            app,
+            host='0.0.0.0',
+            port=port,
+            threads=threads,
+            connection_limit=int(os.environ.get('MCP_CONNECTION_LIMIT', 1000)),
+            channel_timeout=int(os.environ.get('MCP_CHANNEL_TIMEOUT', 120))
+        )
+    else:
+        print(f"Starting MCP Server on port {port}")
+        app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
@@ -0,0 +1,66 @@
+import time
+from prometheus_client import Counter, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+
+HTTP_SECONDS = Histogram(
+    "mcp_http_request_seconds",
+    "MCP server request latency by endpoint and status",
+    ["endpoint", "method", "status"],
+)
+UPSTREAM_SECONDS = Histogram(
+    "mcp_upstream_request_seconds",
+    "ServiceNow / Rundeck / bot call latency by outcome (HTTP status, error, busy, circuit_open)",
+    ["upstream", "method", "outcome"],
+)
+TICKET_UPDATES = Counter("mcp_ticket_updates_total", "Ticket updates by write-behind result", ["result"])
+EXECUTIONS_FINISHED = Counter("mcp_executions_finished_total", "Tracked Rundeck executions by final status", ["status"])
+RUNDECK_WEBHOOKS = Counter(
+    "mcp_rundeck_webhooks_total",
+    "Rundeck job notifications by result (finished, early, ignored, unauthorized, invalid)",
+    ["result"],
+)
+
+
+class GaugeCollector:
+    """Exposes gauges computed at scrape time; ``fn()`` yields (name, help, labels, value)"""
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def collect(self):
+        families = {}
+        for name, doc, labels, value in self.fn():
+            family = families.get(name)
+            if family is None:
+                family = families[name] = GaugeMetricFamily(name, doc, labels=sorted(labels))
+            family.add_metric([str(labels[k]) for k in sorted(labels)], value)
+        return list(families.values())
+
+
+def register_gauges(fn):
+    REGISTRY.register(GaugeCollector(fn))
+
+
+def render():
+    """(body, content type) of the Prometheus text exposition"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def instrument(app):
+    """Time every Flask request by endpoint"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            HTTP_SECONDS.labels(
+                request.url_rule.rule if request.url_rule else "unmatched",
+                request.method,
+                str(response.status_code),
+            ).observe(time.perf_counter() - started)
+        return response
@@ -0,0 +1,319 @@
+import os
+import time
+import uuid
+import threading
+import tracing
+
+ACTIVE_STATES = {"pending", "running", "aborting"}
+
+
+def positive_int(value, name, minimum=1):
+    """A request parameter as an int of at least ``minimum``; None (or "") when not given"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer") from None
+    if number < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return number
+
+
+class RolloutManager:
+    """Push one package to many Rundeck nodes in waves.
+
+    Targets (an explicit node list, or the nodes matching a Rundeck node
+    filter) are split into waves: an optional canary wave, then waves of
+    ``wave_size`` nodes. Each wave is cut into batches of
+    ``nodes_per_execution`` nodes and every batch is one Rundeck execution
+    targeted with a ``name:`` node filter. At most ``max_concurrency``
+    executions of a rollout run at once; completions are picked up by the
+    shared execution poller.
+
+    A wave starts only after the previous one finished. Once at least
+    ``min_sample`` nodes have finished, a node failure rate above
+    ``max_failure_rate`` aborts the rollout: no new executions are
+    dispatched and the running ones are left to finish. Wave progress and
+    the final result are written to the rollout's ServiceNow ticket
+    through the write-behind queue. Rollout state is kept in memory.
+    """
+
+    def __init__(self, rundeck_client, execution_tracker, ticket_updates, max_concurrency=None,
+                 nodes_per_execution=None, wave_size=None, max_failure_rate=None, min_sample=None):
+        self.rundeck = rundeck_client
+        self.tracker = execution_tracker
+        self.ticket_updates = ticket_updates
+        self.max_concurrency = max_concurrency or int(os.getenv("ROLLOUT_MAX_CONCURRENCY", "20"))
+        self.nodes_per_execution = nodes_per_execution or int(os.getenv("ROLLOUT_NODES_PER_EXECUTION", "25"))
+        self.wave_size = wave_size or int(os.getenv("ROLLOUT_WAVE_SIZE", "500"))
+        self.max_failure_rate = (max_failure_rate if max_failure_rate is not None
+                                 else float(os.getenv("ROLLOUT_MAX_FAILURE_RATE", "0.05")))
+        self.min_sample = min_sample or int(os.getenv("ROLLOUT_MIN_SAMPLE", "20"))
+        self._rollouts = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rollout-dispatcher", daemon=True)
+            self._thread.start()
+
+    def plan(self, job_id, software, winget_id, version, nodes=None, node_filter=None, project=None,
+             canary_size=0, wave_size=None, max_concurrency=None, nodes_per_execution=None,
+             max_failure_rate=None):
+        """Validate the parameters, resolve the targets and split them into waves.
+
+        Raises ValueError on bad input; nothing is started until ``launch``.
+        """
+        canary_size = positive_int(canary_size, "canary_size", minimum=0) or 0
+        wave_size = positive_int(wave_size, "wave_size") or self.wave_size
+        max_concurrency = positive_int(max_concurrency, "max_concurrency") or self.max_concurrency
+        per_execution = positive_int(nodes_per_execution, "nodes_per_execution") or self.nodes_per_execution
+        if max_failure_rate is None or max_failure_rate == "":
+            max_failure_rate = self.max_failure_rate
+        else:
+            try:
+                max_failure_rate = float(max_failure_rate)
+            except (TypeError, ValueError):
+                raise ValueError("max_failure_rate must be a number") from None
+            if not 0 <= max_failure_rate <= 1:
+                raise ValueError("max_failure_rate must be between 0 and 1")
+        if nodes is not None and not isinstance(nodes, list):
+            raise ValueError("nodes must be a list")
+        if not nodes:
+            if not (node_filter and project):
+                raise ValueError("Either nodes or node_filter and project are required")
+            nodes = self.rundeck.list_nodes(project, node_filter)
+        nodes = list(dict.fromkeys(n for n in nodes if n))
+        if not nodes:
+            raise ValueError("No target nodes")
+
+        waves = []
+        if canary_size:
+            waves.append(nodes[:canary_size])
+        rest = nodes[canary_size:]
+        waves += [rest[i:i + wave_size] for i in range(0, len(rest), wave_size)]
+
+        return {
+            "id": uuid.uuid4().hex[:12],
+            "job_id": job_id,
+            "software": software,
+            "winget_id": winget_id,
+            "version": version,
+            "ticket_number": None,
+            "sys_id": None,
+            "state": "pending",
+            "max_concurrency": max_concurrency,
+            "max_failure_rate": max_failure_rate,
+            "waves": [
+                {
+                    "number": number + 1,
+                    "state": "pending",
+                    "batches": [wave[i:i + per_execution] for i in range(0, len(wave), per_execution)],
+                    "next_batch": 0,
+                    "running": {},
+                    "succeeded": [],
+                    "failed": [],
+                }
+                for number, wave in enumerate(waves) if wave
+            ],
+            "current_wave": 0,
+            "total": len(nodes),
+            "created": time.time(),
+            "finished": None,
+            "reason": None,
+            "traceparent": tracing.traceparent(),
+        }
+
+    def launch(self, rollout, ticket_number=None, sys_id=None):
+        """Start a planned rollout, tracked on the given ticket; returns the rollout status"""
+        rollout_id = rollout["id"]
+        rollout["ticket_number"] = ticket_number
+        rollout["sys_id"] = sys_id
+        with self._lock:
+            self._rollouts[rollout_id] = rollout
+        self._comment(rollout, f"Rollout {rollout_id} of {rollout['software']} {rollout['version']} planned: "
+                               f"{rollout['total']} nodes in {len(rollout['waves'])} waves")
+        self._wake.set()
+        self.start()
+        return self.status(rollout_id)
+
+    def abort(self, rollout_id, reason="aborted by request"):
+        with self._lock:
+            rollout = self._rollouts.get(rollout_id)
+            if rollout is None:
+                return None
+            if rollout["state"] in ACTIVE_STATES:
+                rollout["state"] = "aborting"
+                rollout["reason"] = reason
+        self._wake.set()
+        return self.status(rollout_id)
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for r in self._rollouts.values() if r["state"] in ACTIVE_STATES)
+
+    def status(self, rollout_id):
+        with self._lock:
+            rollout = self._rollouts.get(rollout_id)
+            if rollout is None:
+                return None
+            succeeded = sum(len(w["succeeded"]) for w in rollout["waves"])
+            failed = sum(len(w["failed"]) for w in rollout["waves"])
+            return {
+                "rollout_id": rollout["id"],
+                "software": rollout["software"],
+                "version": rollout["version"],
+                "ticket_number": rollout["ticket_number"],
+                "state": rollout["state"],
+                "reason": rollout["reason"],
+                "total": rollout["total"],
+                "succeeded": succeeded,
+                "failed": failed,
+                "failure_rate": round(failed / (succeeded + failed), 4) if succeeded + failed else 0.0,
+                "waves": [
+                    {
+                        "number": w["number"],
+                        "state": w["state"],
+                        "nodes": sum(len(b) for b in w["batches"]),
+                        "running_executions": sorted(w["running"]),
+                        "succeeded": len(w["succeeded"]),
+                        "failed": len(w["failed"]),
+                        "failed_nodes": w["failed"][:100],
+                    }
+                    for w in rollout["waves"]
+                ],
+            }
+
+    # ---------- dispatcher ----------
+    def _run(self):
+        while True:
+            self._wake.clear()
+            with self._lock:
+                active = [r for r in self._rollouts.values() if r["state"] in ACTIVE_STATES]
+            for rollout in active:
+                try:
+                    self._advance(rollout)
+                except Exception as e:
+                    tracing.log(f"Rollout {rollout['id']} dispatch error: {e}")
+            self._wake.wait(None if not active else min(30, max(1, self.rundeck.http.breaker.retry_after())))
+
+    def _advance(self, rollout):
+        """Finish waves, check the failure threshold and dispatch batches up to the concurrency cap"""
+        while True:
+            with self._lock:
+                if rollout["current_wave"] >= len(rollout["waves"]):
+                    self._finish(rollout, "completed")
+                    return
+                wave = rollout["waves"][rollout["current_wave"]]
+                if rollout["state"] == "aborting":
+                    if not any(w["running"] for w in rollout["waves"]):
+                        self._finish(rollout, "aborted")
+                    return
+                if self._over_threshold(rollout):
+                    rollout["state"] = "aborting"
+                    rollout["reason"] = "failure rate above threshold"
+                    continue
+                if wave["next_batch"] < len(wave["batches"]) and self.rundeck.http.breaker.retry_after():
+                    # Rundeck is failing; hold the rollout until its circuit lets calls through
+                    return
+                if wave["next_batch"] >= len(wave["batches"]):
+                    if wave["running"]:
+                        return
+                    # Wave finished; move on to the next one
+                    wave["state"] = "completed"
+                    rollout["current_wave"] += 1
+                    report = (f"Rollout {rollout['id']} wave {wave['number']}/{len(rollout['waves'])} done: "
+                              f"{len(wave['succeeded'])} succeeded, {len(wave['failed'])} failed")
+                else:
+                    if len(wave["running"]) >= rollout["max_concurrency"]:
+                        return
+                    rollout["state"] = "running"
+                    wave["state"] = "running"
+                    batch = wave["batches"][wave["next_batch"]]
+                    wave["next_batch"] += 1
+                    report = None
+            if report:
+                self._comment(rollout, report)
+                continue
+            self._dispatch(rollout, wave, batch)
+
+    def _dispatch(self, rollout, wave, batch):
+        with tracing.start_span("rollout batch", parent=rollout["traceparent"], rollout_id=rollout["id"],
+                                wave=wave["number"], nodes=len(batch)):
+            self._dispatch_batch(rollout, wave, batch)
+
+    def _dispatch_batch(self, rollout, wave, batch):
+        node_filter = "name: " + ",".join(batch)
+        status, message, execution = self.rundeck.run_job(
+            rollout["job_id"], rollout["software"], rollout["winget_id"], rollout["version"], node_filter=node_filter
+        )
+        if not execution:
+            tracing.log(f"Rollout {rollout['id']} could not start batch: {message}")
+            with self._lock:
+                if self.rundeck.http.breaker.retry_after():
+                    # Not the nodes' fault; dispatch the batch again once Rundeck recovers
+                    wave["batches"].append(batch)
+                else:
+                    wave["failed"].extend(batch)
+            return
+        execution_id = str(execution.get("id"))
+        with self._lock:
+            wave["running"][execution_id] = batch
+        self.tracker.track(
+            execution_id,
+            project=execution.get("project"),
+            job_id=rollout["job_id"],
+            on_finish=lambda eid, rundeck_status: self._execution_finished(rollout, wave, eid, rundeck_status),
+        )
+
+    def _execution_finished(self, rollout, wave, execution_id, rundeck_status):
+        """Tracker callback: attribute the execution's nodes to succeeded/failed"""
+        succeeded = None
+        try:
+            execution = self.rundeck.get_execution(execution_id)
+            succeeded = set(execution.get("successfulNodes") or [])
+        except Exception as e:
+            tracing.log(f"Could not fetch nodes of execution {execution_id}: {e}")
+        with self._lock:
+            batch = wave["running"].pop(execution_id, [])
+            if succeeded is None or (not succeeded and rundeck_status == "succeeded"):
+                succeeded = set(batch) if rundeck_status == "succeeded" else set()
+            for node in batch:
+                (wave["succeeded"] if node in succeeded else wave["failed"]).append(node)
+        self._wake.set()
+
+    def _over_threshold(self, rollout):
+        succeeded = sum(len(w["succeeded"]) for w in rollout["waves"])
+        failed = sum(len(w["failed"]) for w in rollout["waves"])
+        done = succeeded + failed
+        return done >= self.min_sample and failed / done > rollout["max_failure_rate"]
+
+    def _finish(self, rollout, state):
+        rollout["state"] = state
+        for wave in rollout["waves"]:
+            if wave["state"] == "running":
+                wave["state"] = state
+        rollout["finished"] = time.time()
+        succeeded = sum(len(w["succeeded"]) for w in rollout["waves"])
+        failed = [n for w in rollout["waves"] for n in w["failed"]]
+        untouched = rollout["total"] - succeeded - len(failed)
+        summary = (f"Rollout {rollout['id']} {state}: {succeeded}/{rollout['total']} succeeded, "
+                   f"{len(failed)} failed, {untouched} not attempted")
+        if rollout["reason"]:
+            summary += f" ({rollout['reason']})"
+        if failed:
+            summary += "\nFailed nodes: " + ", ".join(failed[:50]) + (" …" if len(failed) > 50 else "")
+        with tracing.start_span("rollout finished", parent=rollout["traceparent"], rollout_id=rollout["id"],
+                                state=state, succeeded=succeeded, failed=len(failed)):
+            tracing.log(summary)
+            # Resolved when everything went out, closed as failed when aborted
+            self._comment(rollout, summary, "6" if state == "completed" else "7")
+
+    def _comment(self, rollout, comments, state="2"):
+        if rollout["ticket_number"]:
+            self.ticket_updates.submit(rollout["ticket_number"], state, comments, sys_id=rollout["sys_id"])
@@ -1,6 +1,8 @@
 import requests
 import os
+import json
 from dotenv import load_dotenv
+from http_pool import UpstreamSession
 
 load_dotenv()
 
@@ -8,11 +10,12 @@ class RundeckClient:
     def __init__(self):
         self.base_url = os.getenv('RUNDECK_URL', 'http://localhost:4440')
         self.api_token = os.getenv('RUNDECK_TOKEN')
+        self.http = UpstreamSession("rundeck")
         
-    def run_job(self, job_id, software, winget_id, version):
-        """Execute a Rundeck job using API token with Winget ID"""
+    def run_job(self, job_id, software, winget_id, version, node_filter=None, extra_options=None):
+        """Execute a Rundeck job using API token with Winget ID; node_filter overrides the job's targets"""
         if not self.api_token:
-            return "failed", "Rundeck API token not configured"
+            return "failed", "Rundeck API token not configured", None
         
         url = f"{self.base_url}/api/40/job/{job_id}/run"
         headers = {
@@ -21,24 +24,109 @@ class RundeckClient:
             "Accept": "application/json"
         }
         
-        # Format the arguments for Rundeck with Winget ID
+        # Job options as a JSON object: Rundeck takes each value verbatim, so quotes or
+        # "-option" text in a name cannot break out of its option as in an argString
         data = {
-            "argString": f"-software '{software}' -winget_id '{winget_id}' -version '{version}'"
+            "options": {"software": software, "winget_id": winget_id, "version": version, **(extra_options or {})}
         }
+        if node_filter:
+            data["filter"] = node_filter
         
         try:
-            response = requests.post(url, headers=headers, json=data, timeout=30)
+            response = self.http.post(url, headers=headers, json=data, timeout=30)
             response.raise_for_status()
             result = response.json()
             
             execution_id = result.get('id')
-            return "success", f"Rundeck execution started. Execution ID: {execution_id}"
+            return "running", f"Rundeck execution started. Execution ID: {execution_id}", result
             
         except requests.exceptions.RequestException as e:
             error_msg = f"Rundeck API error: {str(e)}"
             if hasattr(e, 'response') and e.response is not None:
                 error_msg += f"\nResponse: {e.response.text}"
-            return "failed", error_msg
+            return "failed", error_msg, None
+
+    def run_bundle(self, job_id, packages):
+        """Execute one Rundeck job for several packages.
+
+        The job receives a ``packages`` option holding the packages as a JSON
+        list of {software, winget_id, version}. For jobs written against the
+        older contract the usual -software/-winget_id/-version options also
+        carry one ';'-separated entry per package, in the same order, so a
+        value containing ';' is rejected with ValueError.
+        """
+        packages = [{key: str(p[key]) for key in ("software", "winget_id", "version")} for p in packages]
+        if any(";" in value for p in packages for value in p.values()):
+            raise ValueError("Package names, IDs and versions in a bundle must not contain ';'")
+        return self.run_job(
+            job_id,
+            ";".join(p['software'] for p in packages),
+            ";".join(p['winget_id'] for p in packages),
+            ";".join(p['version'] for p in packages),
+            extra_options={"packages": json.dumps(packages)},
+        )
+
+    def _headers(self):
+        return {
+            "X-Rundeck-Auth-Token": self.api_token,
+            "Accept": "application/json"
+        }
+
+    def get_execution(self, execution_id):
+        """Fetch a single execution (id, project, status, job)"""
+        url = f"{self.base_url}/api/40/execution/{execution_id}"
+        response = self.http.get(url, headers=self._headers(), timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def _paged_executions(self, url, params, page_size=500):
+        executions = []
+        offset = 0
+        while True:
+            page_params = dict(params, max=page_size, offset=offset)
+            response = self.http.get(url, headers=self._headers(), params=page_params, timeout=30)
+            response.raise_for_status()
+            result = response.json()
+            page = result.get('executions', [])
+            executions.extend(page)
+            total = result.get('paging', {}).get('total', len(executions))
+            offset += len(page)
+            if not page or offset >= total:
+                return executions
+
+    def list_nodes(self, project, node_filter):
+        """Names of the project's nodes matching a Rundeck node filter"""
+        url = f"{self.base_url}/api/40/project/{project}/resources"
+        response = self.http.get(url, headers=self._headers(), params={"filter": node_filter}, timeout=60)
+        response.raise_for_status()
+        result = response.json()
+        if isinstance(result, dict):
+            return sorted(result.keys())
+        return sorted(node.get('nodename') for node in result if node.get('nodename'))
+
+    def running_executions(self, project):
+        """List all running executions of a project (one call per 500 executions)"""
+        url = f"{self.base_url}/api/40/project/{project}/executions/running"
+        return self._paged_executions(url, {})
+
+    def query_executions(self, project, job_ids, begin_ms):
+        """Query executions of the given jobs started since begin_ms (epoch millis) in bulk"""
+        url = f"{self.base_url}/api/40/project/{project}/executions"
+        params = {
+            "jobIdListFilter": sorted(job_ids),
+            "begin": int(begin_ms),
+        }
+        return self._paged_executions(url, params)
+
+    def execution_output(self, execution_id, offset=0):
+        """Fetch execution log output from offset; returns (text, next_offset, completed)"""
+        url = f"{self.base_url}/api/40/execution/{execution_id}/output"
+        response = self.http.get(url, headers=self._headers(), params={"offset": offset}, timeout=30)
+        response.raise_for_status()
+        result = response.json()
+        # One line per entry, each newline-terminated, so pages fetched from successive offsets concatenate
+        text = "".join(entry.get('log', '') + "\n" for entry in result.get('entries', []))
+        return text, int(result.get('offset', offset) or offset), bool(result.get('execCompleted', result.get('completed')))
     
     def test_connection(self):
         """Test connection to Rundeck using API token"""
@@ -52,7 +140,7 @@ class RundeckClient:
         }
         
         try:
-            response = requests.get(url, headers=headers, timeout=30)
+            response = self.http.get(url, headers=headers, timeout=30)
             if response.status_code == 200:
                 return True, "Connection successful"
             else:
@@ -1,7 +1,13 @@
 import requests
 import base64
 import os
+import json
+import uuid
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
+from http_pool import UpstreamSession
+import tracing
 
 load_dotenv()
 
@@ -10,12 +16,54 @@ class ServiceNowClient:
         self.instance_url = os.getenv('SNOW_INSTANCE')
         self.username = os.getenv('SNOW_USERNAME')
         self.password = os.getenv('SNOW_PASSWORD')
+        self.http = UpstreamSession("snow")
+        # Bounded LRU of incident number -> sys_id, used when the caller has no sys_id
+        self.sys_id_cache_size = int(os.getenv('SNOW_SYS_ID_CACHE_SIZE', '10000'))
+        self._sys_ids = OrderedDict()
+        self._sys_ids_lock = threading.Lock()
         
-    def create_incident(self, user_id, software, version):
-        """Create a real ServiceNow incident"""
-        if not all([self.instance_url, self.username, self.password]):
-            print("ServiceNow credentials not configured")
+    def _cache_sys_id(self, incident_number, sys_id):
+        with self._sys_ids_lock:
+            self._sys_ids[incident_number] = sys_id
+            self._sys_ids.move_to_end(incident_number)
+            while len(self._sys_ids) > self.sys_id_cache_size:
+                self._sys_ids.popitem(last=False)
+
+    def _cached_sys_id(self, incident_number):
+        with self._sys_ids_lock:
+            sys_id = self._sys_ids.get(incident_number)
+            if sys_id is not None:
+                self._sys_ids.move_to_end(incident_number)
+            return sys_id
+
+    def _evict_sys_id(self, incident_number):
+        with self._sys_ids_lock:
+            self._sys_ids.pop(incident_number, None)
+
+    def lookup_sys_id(self, incident_number, headers):
+        """Resolve an incident number to its sys_id (cache first, then GET)"""
+        sys_id = self._cached_sys_id(incident_number)
+        if sys_id:
+            return sys_id
+        api_url = f"{self.instance_url}/api/now/table/incident"
+        params = {"number": incident_number, "sysparm_fields": "sys_id", "sysparm_limit": 1}
+        response = self.http.get(api_url, headers=headers, params=params, timeout=30)
+        response.raise_for_status()
+        incidents = response.json().get('result', [])
+        if not incidents:
             return None
+        sys_id = incidents[0]['sys_id']
+        self._cache_sys_id(incident_number, sys_id)
+        return sys_id
+        
+    def create_incident(self, user_id, software, version, packages=None, approved_by=None):
+        """Create a real ServiceNow incident; returns (number, sys_id).
+
+        ``approved_by`` (an auto-approval policy) creates it already In Progress with the decision in its comments.
+        """
+        if not all([self.instance_url, self.username, self.password]):
+            tracing.log("ServiceNow credentials not configured")
+            return None, None
             
         api_url = f"{self.instance_url}/api/now/table/incident"
         
@@ -38,34 +86,156 @@ class ServiceNowClient:
             "subcategory": "installation",
             "assignment_group": "it support"
         }
+        if packages:
+            # Bundle request: one incident covering every package
+            listing = "\n".join(f"- {p['software']} {p['version']} ({p['winget_id']})" for p in packages)
+            incident_data["short_description"] = f"Software bundle installation request: {software}"
+            incident_data["description"] = f"User {user_id} requested installation of {len(packages)} packages via Teams Bot:\n{listing}"
+        if approved_by:
+            incident_data["state"] = "2"  # In Progress, as for a manual approval
+            incident_data["comments"] = f"Request approved by {approved_by} (auto-approval)"
         
         try:
-            response = requests.post(api_url, headers=headers, json=incident_data, timeout=30)
+            response = self.http.post(api_url, headers=headers, json=incident_data, timeout=30)
             response.raise_for_status()
             result = response.json()
             
             if 'result' in result and 'number' in result['result']:
-                print(f"✅ Created ServiceNow incident: {result['result']['number']}")
-                return result['result']['number']
+                number = result['result']['number']
+                sys_id = result['result'].get('sys_id')
+                if sys_id:
+                    self._cache_sys_id(number, sys_id)
+                tracing.log(f"✅ Created ServiceNow incident: {number}")
+                return number, sys_id
             else:
-                print(f"Unexpected ServiceNow response: {result}")
-                return None
+                tracing.log(f"Unexpected ServiceNow response: {result}")
+                return None, None
                 
         except requests.exceptions.RequestException as e:
-            print(f"ServiceNow API error: {e}")
+            tracing.log(f"ServiceNow API error: {e}")
             if hasattr(e, 'response') and e.response is not None:
-                print(f"Response content: {e.response.text}")
-            return None
+                tracing.log(f"Response content: {e.response.text}")
+            return None, None
     
-    def update_incident(self, incident_number, status, comments):
+    def _headers(self):
+        credentials = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
+        return {
+            "Authorization": f"Basic {credentials}",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+
+    @staticmethod
+    def update_fields(status, comments):
+        """Incident fields for a state change, with the close fields closed states require"""
+        # Prepare update data based on status
+        update_data = {
+            "state": status,
+            "comments": comments
+        }
+        
+        # Add required fields for closed/resolved states
+        if status in ["6", "7", "Resolved", "Closed"]:
+            update_data["close_notes"] = f"Resolved via Teams Bot automation: {comments}"
+            update_data["close_code"] = "Solved (Work Around)"  # This might be the required "Resolution code"
+            update_data["resolution_code"] = "Solved (Work Around)"  # Try both field names
+            
+            # Some ServiceNow instances might use different field names
+            # Try these common field names for resolution information
+            update_data["u_resolution_code"] = "Solved (Work Around)"
+            update_data["resolution_notes"] = f"Resolved via Teams Bot automation: {comments}"
+        return update_data
+
+    def lookup_sys_ids(self, incident_numbers):
+        """Resolve many incident numbers to sys_ids with one query; cached entries skip the query"""
+        found = {}
+        missing = []
+        for number in incident_numbers:
+            sys_id = self._cached_sys_id(number)
+            if sys_id:
+                found[number] = sys_id
+            else:
+                missing.append(number)
+        if missing:
+            api_url = f"{self.instance_url}/api/now/table/incident"
+            params = {
+                "sysparm_query": "numberIN" + ",".join(missing),
+                "sysparm_fields": "number,sys_id",
+                "sysparm_limit": len(missing)
+            }
+            response = self.http.get(api_url, headers=self._headers(), params=params, timeout=30)
+            response.raise_for_status()
+            for incident in response.json().get('result', []):
+                found[incident['number']] = incident['sys_id']
+                self._cache_sys_id(incident['number'], incident['sys_id'])
+        return found
+
+    def batch_update_incidents(self, updates):
+        """Apply many incident updates in one Batch API call.
+
+        ``updates`` is a list of dicts with number, sys_id (optional), state and
+        comments. Returns {number: True/False}.
+        """
+        if not all([self.instance_url, self.username, self.password]):
+            tracing.log("ServiceNow credentials not configured")
+            return {u["number"]: False for u in updates}
+
+        results = {u["number"]: False for u in updates}
+        try:
+            sys_ids = {u["number"]: u["sys_id"] for u in updates if u.get("sys_id")}
+            unresolved = [u["number"] for u in updates if u["number"] not in sys_ids]
+            if unresolved:
+                sys_ids.update(self.lookup_sys_ids(unresolved))
+
+            rest_requests = []
+            by_request_id = {}
+            for n, update in enumerate(updates):
+                sys_id = sys_ids.get(update["number"])
+                if not sys_id:
+                    tracing.log(f"No incident found with number: {update['number']}")
+                    continue
+                body = json.dumps(self.update_fields(update["state"], update["comments"])).encode()
+                rest_requests.append({
+                    "id": str(n),
+                    "method": "PATCH",
+                    "url": f"/api/now/table/incident/{sys_id}",
+                    "headers": [
+                        {"name": "Content-Type", "value": "application/json"},
+                        {"name": "Accept", "value": "application/json"}
+                    ],
+                    "body": base64.b64encode(body).decode()
+                })
+                by_request_id[str(n)] = update["number"]
+            if not rest_requests:
+                return results
+
+            batch = {"batch_request_id": uuid.uuid4().hex, "rest_requests": rest_requests}
+            response = self.http.post(f"{self.instance_url}/api/now/v1/batch", headers=self._headers(), json=batch, timeout=60)
+            response.raise_for_status()
+            for served in response.json().get('serviced_requests', []):
+                number = by_request_id.get(served.get('id'))
+                if number is None:
+                    continue
+                ok = 200 <= int(served.get('status_code', 500)) < 300
+                results[number] = ok
+                if not ok:
+                    # Drop a possibly stale sys_id so the retry looks it up again
+                    self._evict_sys_id(number)
+            tracing.log(f"✅ Batch-updated {sum(results.values())}/{len(updates)} ServiceNow incidents")
+            return results
+
+        except requests.exceptions.RequestException as e:
+            tracing.log(f"ServiceNow batch update error: {e}")
+            if hasattr(e, 'response') and e.response is not None:
+                tracing.log(f"Response content: {e.response.text}")
+            return results
+
+    def update_incident(self, incident_number, status, comments, sys_id=None):
         """Update a ServiceNow incident with required fields for closed states"""
         if not all([self.instance_url, self.username, self.password]):
-            print("ServiceNow credentials not configured")
+            tracing.log("ServiceNow credentials not configured")
             return False
             
-        # First get the incident sys_id
-        api_url = f"{self.instance_url}/api/now/table/incident?number={incident_number}"
-        
         credentials = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
         headers = {
             "Authorization": f"Basic {credentials}",
@@ -73,44 +243,35 @@ class ServiceNowClient:
         }
         
         try:
-            # Get the incident
-            response = requests.get(api_url, headers=headers, timeout=30)
-            response.raise_for_status()
-            incidents = response.json().get('result', [])
+            # The sys_id normally comes from the caller or the cache; only look it up as a fallback
+            incident_sys_id = sys_id or self.lookup_sys_id(incident_number, headers)
             
-            if not incidents:
-                print(f"No incident found with number: {incident_number}")
+            if not incident_sys_id:
+                tracing.log(f"No incident found with number: {incident_number}")
                 return False
-                
-            incident_sys_id = incidents[0]['sys_id']
             
             # Update the incident
             update_url = f"{self.instance_url}/api/now/table/incident/{incident_sys_id}"
             
-            # Prepare update data based on status
-            update_data = {
-                "state": status,
-                "comments": comments
-            }
-            
-            # Add required fields for closed/resolved states
-            if status in ["6", "7", "Resolved", "Closed"]:
-                update_data["close_notes"] = f"Resolved via Teams Bot automation: {comments}"
-                update_data["close_code"] = "Solved (Work Around)"  # This might be the required "Resolution code"
-                update_data["resolution_code"] = "Solved (Work Around)"  # Try both field names
-                
-                # Some ServiceNow instances might use different field names
-                # Try these common field names for resolution information
-                update_data["u_resolution_code"] = "Solved (Work Around)"
-                update_data["resolution_notes"] = f"Resolved via Teams Bot automation: {comments}"
+            update_data = self.update_fields(status, comments)
             
-            update_response = requests.patch(update_url, headers=headers, json=update_data, timeout=30)
+            update_response = self.http.patch(update_url, headers=headers, json=update_data, timeout=30)
+            if update_response.status_code == 404 and not sys_id:
+                # Stale cache entry: look the incident up again once
+                self._evict_sys_id(incident_number)
+                incident_sys_id = self.lookup_sys_id(incident_number, headers)
+                if not incident_sys_id:
+                    tracing.log(f"No incident found with number: {incident_number}")
+                    return False
+                update_url = f"{self.instance_url}/api/now/table/incident/{incident_sys_id}"
+                update_response = self.http.patch(update_url, headers=headers, json=update_data, timeout=30)
             update_response.raise_for_status()
-            print(f"✅ Updated ServiceNow incident: {incident_number}")
+            self._cache_sys_id(incident_number, incident_sys_id)
+            tracing.log(f"✅ Updated ServiceNow incident: {incident_number}")
             return True
             
         except requests.exceptions.RequestException as e:
-            print(f"ServiceNow update error: {e}")
+            tracing.log(f"ServiceNow update error: {e}")
             if hasattr(e, 'response') and e.response is not None:
-                print(f"Response content: {e.response.text}")
+                tracing.log(f"Response content: {e.response.text}")
             return False
\ No newline at end of file
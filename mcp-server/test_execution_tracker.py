@@ -0,0 +1,84 @@
+import unittest
+import requests
+from execution_tracker import ExecutionTracker, MAX_NOT_FOUND
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.exceptions.HTTPError(f"{status} error", response=response)
+
+
+class StubRundeck:
+    """Rundeck with execution 1 succeeded and execution 404 unknown"""
+
+    def __init__(self):
+        self.executions = {"1": {"id": 1, "project": "p", "status": "succeeded", "job": {"id": "j"}}}
+        self.failing_projects = set()
+
+    def get_execution(self, execution_id):
+        if execution_id not in self.executions:
+            raise http_error(404)
+        return self.executions[execution_id]
+
+    def running_executions(self, project):
+        if project in self.failing_projects:
+            raise http_error(500)
+        return []
+
+    def query_executions(self, project, job_ids, begin_ms):
+        return []
+
+    def execution_output(self, execution_id, offset=0):
+        return "", 0, True
+
+
+class StubHttp:
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.posts.append(json)
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+
+class PollTest(unittest.TestCase):
+    def setUp(self):
+        self.rundeck = StubRundeck()
+        self.tracker = ExecutionTracker(self.rundeck, webhooks=False)
+        self.tracker.http = StubHttp()
+        # Tracked directly: track() would start the poller thread
+        for execution_id, project in (("404", None), ("1", None)):
+            self.tracker._executions[execution_id] = {
+                "execution_id": execution_id, "project": project, "job_id": None, "context": {},
+                "started": 0, "on_finish": None, "traceparent": None,
+            }
+
+    def delivered(self):
+        return {p["execution_id"]: p["rundeck_status"] for p in self.tracker.http.posts}
+
+    def test_unknown_execution_does_not_block_others(self):
+        self.assertTrue(self.tracker.poll_once())
+        self.assertEqual(self.delivered(), {"1": "succeeded"})
+        self.assertEqual(self.tracker.status("1"), None)
+        self.assertEqual(self.tracker.status("404"), "running")
+
+    def test_unknown_execution_fails_after_repeated_404s(self):
+        for _ in range(MAX_NOT_FOUND):
+            self.tracker.poll_once()
+        self.assertEqual(self.delivered(), {"1": "succeeded", "404": "other"})
+        self.assertEqual(self.tracker.in_flight(), 0)
+
+    def test_failing_project_does_not_block_delivery(self):
+        self.rundeck.executions["2"] = {"id": 2, "project": "broken", "status": "running"}
+        self.tracker._executions["2"] = dict(self.tracker._executions["1"], execution_id="2")
+        self.rundeck.failing_projects.add("broken")
+        self.tracker.poll_once()
+        self.assertEqual(self.delivered(), {"1": "succeeded"})
+        self.assertEqual(self.tracker.status("2"), "running")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+from rollout import RolloutManager
+
+
+class RolloutPlanTest(unittest.TestCase):
+    def setUp(self):
+        self.rollouts = RolloutManager(None, None, None, max_concurrency=20, nodes_per_execution=25, wave_size=500)
+        self.nodes = [f"node{i}" for i in range(10)]
+
+    def plan(self, **options):
+        return self.rollouts.plan("job", "Chrome", "Google.Chrome", "117", nodes=self.nodes, **options)
+
+    def test_numeric_strings_are_converted(self):
+        rollout = self.plan(canary_size="1", wave_size="4", max_concurrency="2", nodes_per_execution="2")
+        self.assertEqual([sum(len(b) for b in w["batches"]) for w in rollout["waves"]], [1, 4, 4, 1])
+        self.assertEqual(rollout["max_concurrency"], 2)
+
+    def test_bad_sizes_are_rejected(self):
+        for options in ({"wave_size": -1}, {"wave_size": "ten"}, {"max_concurrency": "0"},
+                        {"nodes_per_execution": 1.5}, {"canary_size": -2}, {"max_failure_rate": 2}):
+            with self.subTest(**options), self.assertRaises(ValueError):
+                self.plan(**options)
+
+    def test_plan_starts_nothing(self):
+        rollout = self.plan()
+        self.assertEqual(self.rollouts.status(rollout["id"]), None)
+        self.assertEqual(len(rollout["waves"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from types import SimpleNamespace
+from update_queue import TicketUpdateQueue
+
+
+class StubServiceNow:
+    """Batch API stub; tickets in ``failing`` are not updated"""
+
+    def __init__(self):
+        self.failing = set()
+        self.batches = []
+        self.http = SimpleNamespace(breaker=SimpleNamespace(retry_after=lambda: 0))
+
+    def batch_update_incidents(self, updates):
+        self.batches.append(updates)
+        return {u["number"]: u["number"] not in self.failing for u in updates}
+
+
+class UpdateStateTest(unittest.TestCase):
+    def setUp(self):
+        self.snow = StubServiceNow()
+        self.queue = TicketUpdateQueue(self.snow, window=0, max_attempts=2)
+        # Flushed by hand: submit() would start the flusher thread
+        self.queue.start = lambda: None
+
+    def flush(self):
+        due, _ = self.queue._take_due(float("inf"))
+        self.queue._flush(due)
+
+    def test_update_is_pending_until_flushed(self):
+        update_id = self.queue.submit("INC1", "2", "approved")
+        self.assertEqual(self.queue.state(update_id), "pending")
+        self.flush()
+        self.assertEqual(self.queue.state(update_id), "flushed")
+
+    def test_resubmitting_an_id_does_not_queue_it_twice(self):
+        update_id = self.queue.submit("INC1", "2", "approved")
+        self.queue.submit("INC1", "2", "approved", update_id=update_id)
+        self.flush()
+        self.assertEqual(self.snow.batches[0][0]["comments"], "approved")
+        self.queue.submit("INC1", "2", "approved", update_id=update_id)
+        self.assertEqual(self.queue.pending_count(), 0)
+
+    def test_merged_updates_settle_together(self):
+        first = self.queue.submit("INC1", "2", "approved")
+        second = self.queue.submit("INC1", "6", "completed")
+        self.flush()
+        self.assertEqual(self.queue.state(first), "flushed")
+        self.assertEqual(self.queue.state(second), "flushed")
+
+    def test_update_is_dropped_after_max_attempts(self):
+        self.snow.failing.add("INC1")
+        update_id = self.queue.submit("INC1", "2", "approved")
+        self.flush()
+        self.assertEqual(self.queue.state(update_id), "pending")
+        self.flush()
+        self.assertEqual(self.queue.state(update_id), "dropped")
+
+
+if __name__ == "__main__":
+    unittest.main()
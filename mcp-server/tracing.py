@@ -0,0 +1,39 @@
+import os
+import sys
+import atexit
+
+# The trace context, spans and exporter are shared with the bot (shared/tracing_core.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "shared"))
+import tracing_core
+from tracing_core import (
+    EXPORTER, Span, current_span, inject, log, parse_traceparent, set_attribute, start_span, traceparent,
+)
+
+tracing_core.configure("mcp-server")
+atexit.register(EXPORTER.flush)
+
+
+def instrument(app):
+    """One server span per Flask request, continuing the caller's ``traceparent``"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_span():
+        scope = start_span(
+            f"{request.method} {request.url_rule.rule if request.url_rule else 'unmatched'}",
+            parent=request.headers.get("traceparent"),
+            kind="server",
+        )
+        scope.__enter__()
+        g.trace_scope = scope
+
+    @app.after_request
+    def _status(response):
+        set_attribute("http.status_code", response.status_code)
+        return response
+
+    @app.teardown_request
+    def _end_span(error=None):
+        scope = g.pop("trace_scope", None)
+        if scope is not None:
+            scope.__exit__(type(error) if error else None, error, None)
@@ -0,0 +1,186 @@
+import os
+import time
+import uuid
+import atexit
+import threading
+from collections import OrderedDict
+from metrics import TICKET_UPDATES
+import tracing
+
+
+class TicketUpdateQueue:
+    """Write-behind queue that coalesces ServiceNow incident updates per ticket.
+
+    ``submit`` only records the update. Updates to the same ticket that arrive
+    within ``window`` seconds of its first pending update are merged: the last
+    state wins and comments are concatenated in order. A flusher thread then
+    sends the due tickets to ServiceNow through the Batch API, up to
+    ``max_batch`` tickets per call. Failed tickets are merged back and
+    retried with backoff, up to ``max_attempts`` times. Each flush is traced
+    with links to the traces that submitted its updates.
+
+    Every submitted update has an id whose state (pending, flushed or
+    dropped) is kept for the last ``max_tracked`` updates, so a caller can
+    hold on to its own copy of the update until the flush is confirmed.
+    Resubmitting an id that is pending or flushed is a no-op.
+    """
+
+    def __init__(self, snow_client, window=None, max_batch=None, max_attempts=None, max_tracked=None):
+        self.snow = snow_client
+        self.window = window if window is not None else float(os.getenv("SNOW_UPDATE_WINDOW", "2"))
+        self.max_batch = max_batch or int(os.getenv("SNOW_UPDATE_MAX_BATCH", "100"))
+        self.max_attempts = max_attempts or int(os.getenv("SNOW_UPDATE_MAX_ATTEMPTS", "5"))
+        self.max_tracked = max_tracked or int(os.getenv("SNOW_UPDATE_MAX_TRACKED", "10000"))
+        self._pending = {}
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.submitted = 0
+        self.flushed = 0
+        self.batches = 0
+        atexit.register(self.flush_all)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="snow-write-behind", daemon=True)
+            self._thread.start()
+
+    def submit(self, ticket_number, state, comments, sys_id=None, update_id=None):
+        """Queue an update; merged with any pending update of the same ticket. Returns the update id."""
+        update_id = update_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            if self._states.get(update_id) in ("pending", "flushed"):
+                return update_id
+            self._track(update_id, "pending")
+            self.submitted += 1
+            pending = self._pending.get(ticket_number)
+            if pending is None:
+                self._pending[ticket_number] = {
+                    "number": ticket_number,
+                    "sys_id": sys_id,
+                    "state": state,
+                    "comments": [comments] if comments else [],
+                    "due": now + self.window,
+                    "attempts": 0,
+                    "traces": [tracing.traceparent()],
+                    "updates": [update_id],
+                }
+            else:
+                pending["state"] = state
+                pending["sys_id"] = sys_id or pending["sys_id"]
+                if comments:
+                    pending["comments"].append(comments)
+                pending["traces"].append(tracing.traceparent())
+                pending["updates"].append(update_id)
+        self._wake.set()
+        self.start()
+        return update_id
+
+    def state(self, update_id):
+        """'pending', 'flushed' or 'dropped'; None if the id is unknown or no longer tracked"""
+        with self._lock:
+            return self._states.get(update_id)
+
+    def forget(self, update_id):
+        with self._lock:
+            self._states.pop(update_id, None)
+
+    def _track(self, update_id, state):
+        # Caller holds the lock
+        self._states[update_id] = state
+        self._states.move_to_end(update_id)
+        while len(self._states) > self.max_tracked:
+            self._states.popitem(last=False)
+
+    def _settle(self, p, state):
+        with self._lock:
+            for update_id in p["updates"]:
+                self._track(update_id, state)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _take_due(self, now):
+        # Tickets that are nearly due ride along with the batch that is due now
+        horizon = now + self.window / 2
+        with self._lock:
+            if not any(p["due"] <= now for p in self._pending.values()):
+                horizon = now
+            due = [p for p in self._pending.values() if p["due"] <= horizon]
+            due.sort(key=lambda p: p["due"])
+            due = due[:self.max_batch]
+            for p in due:
+                del self._pending[p["number"]]
+            next_due = min((p["due"] for p in self._pending.values()), default=None)
+        return due, next_due
+
+    def _flush(self, due):
+        updates = [
+            {"number": p["number"], "sys_id": p["sys_id"], "state": p["state"], "comments": "\n\n".join(p["comments"])}
+            for p in due
+        ]
+        links = [t for p in due for t in p["traces"] if t]
+        with tracing.start_span("ticket_updates.flush", links=links, tickets=len(due)) as span:
+            try:
+                results = self.snow.batch_update_incidents(updates)
+            except Exception as e:
+                span.set_error(e)
+                tracing.log(f"ServiceNow write-behind flush error: {e}")
+                results = {}
+        self.batches += 1
+        now = time.time()
+        # An open circuit is an outage, not a bad update: wait it out without using up attempts
+        deferred = self.snow.http.breaker.retry_after()
+        for p in due:
+            if results.get(p["number"]):
+                self.flushed += 1
+                TICKET_UPDATES.labels("flushed").inc()
+                self._settle(p, "flushed")
+                continue
+            if deferred:
+                TICKET_UPDATES.labels("deferred").inc()
+                p["due"] = now + deferred
+            else:
+                p["attempts"] += 1
+                if p["attempts"] >= self.max_attempts:
+                    tracing.log(f"Giving up on ServiceNow update for {p['number']} after {p['attempts']} attempts")
+                    TICKET_UPDATES.labels("dropped").inc()
+                    self._settle(p, "dropped")
+                    continue
+                TICKET_UPDATES.labels("retried").inc()
+                p["sys_id"] = None
+                p["due"] = now + min(300, max(1.0, self.window) * 2 ** p["attempts"])
+            with self._lock:
+                newer = self._pending.get(p["number"])
+                if newer is not None:
+                    # Keep the newer state; older comments go first
+                    p["state"] = newer["state"]
+                    p["comments"].extend(newer["comments"])
+                    p["traces"].extend(newer["traces"])
+                    p["updates"].extend(newer["updates"])
+                    p["due"] = min(p["due"], newer["due"])
+                self._pending[p["number"]] = p
+
+    def _run(self):
+        while True:
+            due, next_due = self._take_due(time.time())
+            if due:
+                self._flush(due)
+                continue
+            timeout = None if next_due is None else max(0.0, next_due - time.time())
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def flush_all(self):
+        """Send everything pending now (used at shutdown)"""
+        with self._lock:
+            for p in self._pending.values():
+                p["due"] = 0
+        while True:
+            due, _ = self._take_due(time.time())
+            if not due:
+                return
+            self._flush(due)
@@ -0,0 +1,332 @@
+"""W3C trace context, spans and the OTLP/JSON exporter shared by the bot and the MCP server.
+
+Each service imports this through its own ``tracing`` module, which names
+the service and adds the glue for its framework and process model.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import threading
+import contextvars
+import urllib.request
+
+SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "")
+EXPORTER_KIND = os.getenv("TRACING_EXPORTER", "none")  # none | file | otlp
+SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "1"))
+KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+def configure(service_name):
+    """Name the service spans are exported under, unless ``TRACING_SERVICE_NAME`` is set"""
+    global SERVICE_NAME
+    SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", service_name)
+
+
+def parse_traceparent(value):
+    """(trace_id, span_id, sampled) from a W3C ``traceparent`` header, or None"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3][:2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+class Span:
+    """One timed operation; exported when it ends if the trace is sampled"""
+
+    def __init__(self, name, trace_id, parent_id, sampled, kind="internal", attributes=None, links=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.links = links or []
+        self.events = []
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def recording(self):
+        return self.sampled and EXPORTER.enabled
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def add_event(self, name, **attributes):
+        if self.recording:
+            self.events.append((time.time_ns(), name, attributes))
+
+    def set_error(self, error):
+        self.error = str(error) or type(error).__name__
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if self.recording:
+                EXPORTER.submit(("span", self))
+
+
+class _Scope:
+    """Makes a span current for a ``with`` block and ends it on exit"""
+
+    def __init__(self, span):
+        self.span = span
+
+    def __enter__(self):
+        self._token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.span.set_error(exc)
+        self.span.end()
+        _current.reset(self._token)
+
+
+def start_span(name, parent=None, kind="internal", links=None, child_only=False, **attributes):
+    """``with start_span("name") as span:`` times a block as a child of the current span.
+
+    ``parent`` may be a ``traceparent`` header value (a remote or stored
+    parent); without any parent a new trace is started and sampled at
+    ``TRACING_SAMPLE_RATE``. ``links`` are traceparent values of related
+    traces (e.g. the requests a batch serves). ``child_only`` spans are
+    not recorded outside a trace, so background polling starts no traces.
+    """
+    context = parse_traceparent(parent) if isinstance(parent, str) else None
+    if context is None:
+        current = _current.get()
+        if current is not None:
+            context = (current.trace_id, current.span_id, current.sampled)
+    if context is None:
+        context = ("%032x" % random.getrandbits(128), None, not child_only and random.random() < SAMPLE_RATE)
+    trace_id, parent_id, sampled = context
+    link_contexts = [c for c in (parse_traceparent(link) for link in links or ()) if c]
+    return _Scope(Span(name, trace_id, parent_id, sampled, kind, attributes, link_contexts))
+
+
+def current_span():
+    return _current.get()
+
+
+def traceparent():
+    """``traceparent`` header value of the current span, or None outside any span"""
+    span = _current.get()
+    return span.traceparent if span is not None else None
+
+
+def inject(headers=None):
+    """Headers with the current trace context added (for outgoing HTTP calls)"""
+    headers = dict(headers or {})
+    span = _current.get()
+    if span is not None:
+        headers["traceparent"] = span.traceparent
+    return headers
+
+
+def set_attribute(key, value):
+    span = _current.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+def log(message):
+    """Non-blocking replacement for ``print`` on request paths.
+
+    The line is tagged with the current trace id, attached to the current
+    span as an event, and written to stdout by the exporter thread.
+    """
+    span = _current.get()
+    if span is not None:
+        span.add_event(message)
+        message = f"[trace {span.trace_id[:16]}] {message}"
+    EXPORTER.submit(("log", message))
+
+
+# ================== EXPORT ==================
+def _attribute(key, value):
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+
+def otlp_span(span):
+    encoded = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": KINDS.get(span.kind, 1),
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [_attribute(k, v) for k, v in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        encoded["parentSpanId"] = span.parent_id
+    if span.events:
+        encoded["events"] = [
+            {"timeUnixNano": str(t), "name": name, "attributes": [_attribute(k, v) for k, v in attrs.items()]}
+            for t, name, attrs in span.events
+        ]
+    if span.links:
+        encoded["links"] = [{"traceId": trace_id, "spanId": span_id} for trace_id, span_id, _ in span.links]
+    return encoded
+
+
+def otlp_request(spans):
+    """OTLP/JSON ExportTraceServiceRequest for a batch of ended spans"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "bot-teams-app"}, "spans": [otlp_span(s) for s in spans]}],
+        }]
+    }
+
+
+class Exporter:
+    """Bounded queue drained by one background thread.
+
+    ``submit`` never blocks the caller: when the queue is full the item is
+    dropped and counted. The thread writes log lines to stdout and exports
+    span batches as OTLP/JSON, appended one request per line to
+    ``TRACING_FILE`` (``TRACING_EXPORTER=file``) or POSTed to
+    ``TRACING_OTLP_ENDPOINT`` (``TRACING_EXPORTER=otlp``).
+    """
+
+    def __init__(self, kind=None, max_queue=None, batch_size=None, flush_interval=None):
+        self.kind = kind or EXPORTER_KIND
+        self.enabled = self.kind in ("file", "otlp")
+        self.path = os.getenv("TRACING_FILE", "traces.jsonl")
+        self.endpoint = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+        self.batch_size = batch_size or int(os.getenv("TRACING_BATCH_SIZE", "512"))
+        self.flush_interval = flush_interval or float(os.getenv("TRACING_FLUSH_INTERVAL", "1"))
+        self._queue = queue.Queue(max_queue or int(os.getenv("TRACING_QUEUE_SIZE", "10000")))
+        self._thread = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, item):
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def reset_after_fork(self):
+        """Give a forked child its own queue, lock and worker thread.
+
+        Only the forking thread survives a fork, so the parent's worker is
+        gone and its lock may be held; items queued but not yet written
+        stay with the parent.
+        """
+        running = self._thread is not None
+        self._queue = queue.Queue(self._queue.maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.exported = self.dropped = self.failed = 0
+        if running:
+            self.start()
+
+    def flush(self, timeout=5):
+        """Wait until everything submitted so far has been written"""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self.submit(("flush", done))
+        done.wait(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and item[0] != "flush":
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        spans = []
+        lines = []
+        flushes = []
+        for kind, value in batch:
+            if kind == "span":
+                spans.append(value)
+            elif kind == "log":
+                lines.append(value)
+            else:
+                flushes.append(value)
+        if lines:
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+        if spans:
+            try:
+                self._export(otlp_request(spans))
+                self.exported += len(spans)
+            except Exception as e:
+                self.failed += len(spans)
+                sys.stderr.write(f"Trace export failed: {e}\n")
+        for done in flushes:
+            done.set()
+
+    def _export(self, payload):
+        body = json.dumps(payload, separators=(",", ":"))
+        if self.kind == "file":
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(body + "\n")
+            return
+        request = urllib.request.Request(
+            self.endpoint, data=body.encode(), headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
+
+    def stats(self):
+        return {
+            "exporter": self.kind,
+            "queued": self._queue.qsize(),
+            "exported_total": self.exported,
+            "dropped_total": self.dropped,
+            "failed_total": self.failed,
+        }
+
+
+EXPORTER = Exporter()